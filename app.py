@@ -1,5 +1,6 @@
 from datetime import timedelta
 
+import click
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_smorest import Api
@@ -9,7 +10,18 @@ from services.question_service import blp as question_blp
 from services.subject_service import blp as subject_blp
 from services.node_service import blp as node_blp
 from services.result_service import blp as result_blp
+from services.admin_service import blp as admin_blp
+from db.versions.db import setup_database, deduplicate_results, init_sessions
 from secret import JWT_SECRET_KEY
+from utils.cache import init_cache
+from utils.conditional import init_conditional_requests
+from utils.metrics import init_metrics
+from utils.preload import preload
+from utils.query_counter import init_query_counter
+from utils.request_profiler import init_request_profiler
+from utils.slow_queries import init_slow_query_log
+from utils.tracing import init_tracing
+from utils.utils import expose_headers, load_settings
 
 app = Flask(__name__)
 app.config["API_TITLE"] = "QuestionsAPI"
@@ -26,13 +38,21 @@ app.config["JWT_ACCESS_COOKIE_PATH"] = "/"
 app.config["JWT_COOKIE_CSRF_PROTECT"] = False
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=24)
 jwt = JWTManager(app)
+init_sessions(app)
+init_query_counter(app)
+init_metrics(app)
+init_slow_query_log(app)
+init_request_profiler(app)
+init_cache(app)
+init_conditional_requests(app)
 
 
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = 'http://localhost:4200'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, If-None-Match'
+    expose_headers(response, 'ETag')
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     return response
 
@@ -44,6 +64,34 @@ api.register_blueprint(node_blp)
 api.register_blueprint(question_blp)
 api.register_blueprint(exam_blp)
 api.register_blueprint(result_blp)
+api.register_blueprint(admin_blp)
+# The models and schemas are configured before the first request (the heavy libraries only on demand)
+load_settings(app, {"PRELOAD_HEAVY_MODULES": False})
+preload(api, heavy_modules=app.config["PRELOAD_HEAVY_MODULES"])
+# The view functions and the models are traced, so they have to be registered and imported first
+init_tracing(app)
+
+
+@app.cli.command("init-db")
+def init_db():
+    """ Creates the missing tables and applies the pending migrations
+    """
+    setup_database()
+
+
+@app.cli.command("dedupe-results")
+@click.option("--apply", is_flag=True, help="Removes the listed results instead of only listing them.")
+def dedupe_results(apply):
+    """ Lists the results uploaded more than once that would be removed (all but the last uploaded one),
+    which keep init-db from making the results unique, and removes them with --apply
+    """
+    duplicates, removed = deduplicate_results(apply)
+    for row_id, exam_id, question_id, taker in duplicates:
+        click.echo(f"{row_id}\texam={exam_id}\tquestion={question_id}\ttaker={taker}")
+    if apply:
+        click.echo(f"{removed} results removed")
+    else:
+        click.echo(f"{len(duplicates)} results would be removed (run again with --apply to remove them)")
 
 
 if __name__ == '__main__':
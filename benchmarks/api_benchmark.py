@@ -0,0 +1,427 @@
+"""
+Drives every route of the API through the Flask test client against a local database filled by the
+synthetic data generator, and reports the p50, p95 and p99 latency and the number of queries of each
+endpoint. A run can be saved and used as the baseline of the next ones, which fail when the p95 latency
+of an endpoint grows more than the threshold or when it runs more queries than before.
+
+    python -m benchmarks.api_benchmark --repeat 20 --output baseline.json
+    python -m benchmarks.api_benchmark --repeat 20 --baseline baseline.json --threshold 0.25
+
+The database is a temporary SQLite file unless an empty one is given with --database-url.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PERCENTILES = [50, 95, 99]
+
+# Routes that are not part of the API
+IGNORED_ENDPOINTS = {'static', 'api-docs.openapi_json', 'api-docs.openapi_swagger_ui'}
+
+# Token of the metrics route while the benchmark runs
+METRICS_TOKEN = 'benchmark'
+
+
+class QueryCounter:
+    """
+    Counts the statements executed by every engine of the application.
+    """
+
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+class Context:
+    """
+    Data of the benchmark user, and helpers that create the objects needed by the routes that modify
+    or delete them. The helpers are not timed.
+    """
+
+    def __init__(self, client, data: dict):
+        self.client = client
+        self.password = data["password"]
+        self.user = data["users"][0]
+        self.subject = self.user["subjects"][0]
+        self.exam_id = self.subject["exam_ids"][0]
+        self.name = f"Benchmark {uuid.uuid4().hex[:8]}"
+        self.report_job = None
+
+    def login(self):
+        self.client.post('/user/login', json={"email": self.user["email"], "password": self.password})
+
+    def delete(self, path: str):
+        self.client.delete(path)
+
+    def node_payload(self) -> dict:
+        return {"name": self.name, "subject_id": self.subject["id"], "parent_id": self.subject["leaf_ids"][0]}
+
+    def question_payload(self) -> dict:
+        return {
+            "title": f"{self.name} ##param1##",
+            "subject_id": self.subject["id"],
+            "node_ids": [self.subject["leaf_ids"][0]],
+            "time": 5,
+            "difficulty": 5,
+            "type": "test",
+            "active": True,
+            "answers": {"items": [
+                {"body": "Correcta", "points": 100},
+                {"body": "Incorrecta", "points": 0},
+                {"body": "Penaliza", "points": -50},
+            ]},
+            "question_parameters": {"items": [
+                {"value": "1", "group": 1, "position": 1},
+                {"value": "2", "group": 2, "position": 1},
+            ]},
+        }
+
+    def exam_questions(self, exam_id: int) -> list:
+        return self.client.get(f'/exam/{exam_id}').get_json()["questions"]["items"]
+
+    def exam_payload(self, exam_id: int = None) -> dict:
+        questions = [
+            {"id": question["id"], "section_number": question["section_number"]}
+            for question in self.exam_questions(exam_id or self.exam_id)
+        ]
+        return {"title": self.name, "subject_id": self.subject["id"], "questions": {"items": questions}}
+
+    def create_subject(self) -> int:
+        return self.client.post('/subject', json={"name": self.name}).get_json()["id"]
+
+    def create_node(self) -> int:
+        return self.client.post('/node', json=self.node_payload()).get_json()["id"]
+
+    def create_question(self) -> int:
+        return self.client.post('/question', json=self.question_payload()).get_json()["id"]
+
+    def create_exam(self) -> int:
+        return self.client.post('/exam', json=self.exam_payload()).get_json()["id"]
+
+    def results_file(self, exam_id: int, takers: int = 50) -> dict:
+        lines = ['question_id,exam_id,points,taker,time']
+        for question in self.exam_questions(exam_id):
+            for taker in range(1, takers + 1):
+                lines.append(f"{question['id']},{exam_id},{100 if (taker + question['id']) % 3 else 0},{taker},5")
+        return {"file": (io.BytesIO('\n'.join(lines).encode()), 'results.csv')}
+
+    def create_exam_with_results(self) -> int:
+        exam_id = self.create_exam()
+        self.client.post('/result/upload', data=self.results_file(exam_id), content_type='multipart/form-data')
+        return exam_id
+
+    def answer_sheets(self, exam_id: int, takers: int = 30) -> dict:
+        tests = sum(question["type"] == 'test' for question in self.exam_questions(exam_id))
+        letters = 'ABC'
+        return {"sheets": [
+            {"taker": taker, "answers": [letters[(taker + i) % 3] for i in range(tests)]}
+            for taker in range(1, takers + 1)
+        ]}
+
+    def wait_for_job(self, job_id: str):
+        while self.client.get(f'/result/reports/job/{job_id}').get_json()["status"] == 'running':
+            time.sleep(0.05)
+
+    def finished_report_job(self) -> str:
+        """
+        Returns a score report job of the exam, started and finished once for the whole benchmark.
+        """
+        if self.report_job is None:
+            self.report_job = self.client.post(f'/result/reports/{self.exam_id}').get_json()["id"]
+            self.wait_for_job(self.report_job)
+        return self.report_job
+
+
+def fixed(path: str, after=None, **arguments):
+    """
+    Requests the same path every time. Callable arguments are evaluated before each request (for
+    example the files, which can only be read once).
+    """
+    def prepare():
+        values = {key: value() if callable(value) else value for key, value in arguments.items()}
+        return dict(path=path, **values), after
+    return prepare
+
+
+def routes(context: Context) -> list:
+    """
+    Returns the requests of every route as (method, rule, prepare) tuples. prepare returns the arguments
+    of the timed request and, optionally, a function that undoes its effects afterwards.
+    """
+    subject_id = context.subject["id"]
+    exam_id = context.exam_id
+    node_id = context.subject["leaf_ids"][-1]
+    question_id = context.subject["question_ids"][0]
+
+    def fresh(create, path: str, cleanup: str = None, arguments=None):
+        # An object is created before each request, formatting its ID into the path, and deleted
+        # afterwards through the cleanup path (unless the request already deletes it)
+        def prepare():
+            object_id = create()
+            after = (lambda response: context.delete(cleanup.format(id=object_id))) if cleanup else None
+            return dict(path=path.format(id=object_id), **(arguments(object_id) if arguments else {})), after
+        return prepare
+
+    def deleted(path: str):
+        # The object created by the request is deleted afterwards
+        return lambda response: context.delete(f"{path}/{response.get_json()['id']}")
+
+    def deleted_items(path: str):
+        return lambda response: [context.delete(f"{path}/{item['id']}") for item in response.get_json()["items"]]
+
+    csv_questions = "title,type,answer1,points1,answer2,points2\n" + "\n".join(
+        f"Pregunta CSV {i},test,Sí,100,No,0" for i in range(1, 11)
+    )
+    aiken_questions = "\n".join(f"Pregunta Aiken {i}?\nA. Sí\nB. No\nANSWER: A\n" for i in range(1, 11))
+
+    return [
+        # User
+        ('GET', '/user/<int:id>', fixed(f'/user/{context.user["id"]}')),
+        ('POST', '/user/signup', fixed('/user/signup', json=lambda: {
+            "email": f"{uuid.uuid4().hex}@example.com", "name": "Benchmark", "password": context.password
+        })),
+        ('POST', '/user/login', fixed('/user/login', json={"email": context.user["email"], "password": context.password})),
+        ('POST', '/user/logout', fixed('/user/logout', after=lambda response: context.login())),
+        # Subject
+        ('GET', '/subject/<int:id>', fixed(f'/subject/{subject_id}')),
+        ('GET', '/subject/user-subjects', fixed('/subject/user-subjects')),
+        ('POST', '/subject', fixed('/subject', after=deleted('/subject'), json={"name": context.name})),
+        ('PUT', '/subject/<int:id>', fixed(f'/subject/{subject_id}', json={"name": "Asignatura 1"})),
+        ('DELETE', '/subject/<int:id>', fresh(context.create_subject, '/subject/{id}')),
+        ('GET', '/subject/<int:id>/export', fixed(f'/subject/{subject_id}/export', query_string={"format": "gift"})),
+        # Node
+        ('GET', '/node/<int:id>', fixed(f'/node/{node_id}')),
+        ('GET', '/node/list/<int:id>', fixed(f'/node/list/{subject_id}')),
+        ('POST', '/node', fixed('/node', after=deleted('/node'), json=context.node_payload())),
+        ('PUT', '/node/<int:id>', fixed(f'/node/{node_id}', json={"name": "Tema"})),
+        ('DELETE', '/node/<int:id>', fresh(context.create_node, '/node/{id}')),
+        # Question
+        ('GET', '/question/user-questions', fixed('/question/user-questions', query_string={"limit": 50})),
+        ('GET', '/question/subject-questions/<int:id>',
+         fixed(f'/question/subject-questions/{subject_id}', query_string={"limit": 50})),
+        ('GET', '/question/full/<int:id>', fixed(f'/question/full/{question_id}')),
+        ('POST', '/question', fixed('/question', after=deleted('/question'), json=context.question_payload())),
+        ('PUT', '/question/<int:question_id>', fresh(
+            context.create_question, '/question/{id}', cleanup='/question/{id}',
+            arguments=lambda object_id: {"json": context.client.get(f'/question/full/{object_id}').get_json()}
+        )),
+        ('PUT', '/question/disable/<int:id>',
+         fresh(context.create_question, '/question/disable/{id}', cleanup='/question/{id}')),
+        ('DELETE', '/question/<int:id>', fresh(context.create_question, '/question/{id}')),
+        ('POST', '/question/upload', fixed(
+            '/question/upload', after=deleted_items('/question'), query_string={"subject_id": subject_id},
+            data=lambda: {"file": (io.BytesIO(csv_questions.encode()), 'questions.csv')},
+            content_type='multipart/form-data'
+        )),
+        ('POST', '/question/upload_aiken', fixed(
+            '/question/upload_aiken', after=deleted_items('/question'), query_string={"subject_id": subject_id},
+            data=lambda: {"file": (io.BytesIO(aiken_questions.encode()), 'questions.txt')},
+            content_type='multipart/form-data'
+        )),
+        # Exam
+        ('GET', '/exam/<int:id>', fixed(f'/exam/{exam_id}')),
+        ('GET', '/exam/list/<int:subject_id>', fixed(f'/exam/list/{subject_id}')),
+        ('GET', '/exam/select-questions', fixed('/exam/select-questions', query_string={
+            "node_ids": context.subject["node_ids"][:1], "question_number": 10, "time": 60, "difficulty": 5,
+            "type": ["test", "desarrollo"], "repeat": "true",
+        })),
+        ('GET', '/exam/exam-questions', fixed(
+            '/exam/exam-questions', query_string={"subject_id": subject_id, "exam_ids": context.subject["exam_ids"]}
+        )),
+        ('POST', '/exam', fixed('/exam', after=deleted('/exam'), json=context.exam_payload())),
+        ('PUT', '/exam/<int:exam_id>', fresh(
+            context.create_exam, '/exam/{id}', cleanup='/exam/{id}',
+            arguments=lambda object_id: {"json": context.exam_payload(object_id)}
+        )),
+        ('DELETE', '/exam/<int:id>', fresh(context.create_exam, '/exam/{id}')),
+        ('GET', '/exam/<int:id>/export_aiken', fixed(f'/exam/{exam_id}/export_aiken')),
+        ('GET', '/exam/<int:id>/export_pdf', fixed(f'/exam/{exam_id}/export_pdf')),
+        ('GET', '/exam/<int:id>/export_gift', fixed(f'/exam/{exam_id}/export_gift')),
+        ('GET', '/exam/<int:id>/export_moodlexml', fixed(f'/exam/{exam_id}/export_moodlexml')),
+        ('GET', '/exam/<int:id>/export_odt', fixed(f'/exam/{exam_id}/export_odt')),
+        ('GET', '/exam/<int:id>/export_html', fixed(f'/exam/{exam_id}/export_html')),
+        ('GET', '/exam/<int:id>/preview', fixed(f'/exam/{exam_id}/preview')),
+        ('GET', '/exam/<int:id>/export_bundle',
+         fixed(f'/exam/{exam_id}/export_bundle', query_string={"formats": "pdf,gift,html"})),
+        ('POST', '/exam/<int:id>/print_run', fixed(f'/exam/{exam_id}/print_run', json={"copies": 5})),
+        # Result
+        ('GET', '/result/list/<int:subject_id>', fixed(f'/result/list/{subject_id}', query_string={"limit": 100})),
+        ('GET', '/result/analysis/<int:exam_id>', fixed(f'/result/analysis/{exam_id}')),
+        ('GET', '/result/summary/<int:exam_id>', fixed(f'/result/summary/{exam_id}')),
+        ('GET', '/result/distractors/<int:exam_id>', fixed(f'/result/distractors/{exam_id}')),
+        ('GET', '/result/export/subject/<int:subject_id>', fixed(f'/result/export/subject/{subject_id}')),
+        ('GET', '/result/export/exam/<int:exam_id>',
+         fixed(f'/result/export/exam/{exam_id}', query_string={"format": "arrow"})),
+        ('POST', '/result/upload', fresh(
+            context.create_exam, '/result/upload', cleanup='/exam/{id}',
+            arguments=lambda object_id: {"data": context.results_file(object_id),
+                                         "content_type": 'multipart/form-data'}
+        )),
+        ('POST', '/result/grade/<int:exam_id>', fresh(
+            context.create_exam, '/result/grade/{id}', cleanup='/exam/{id}',
+            arguments=lambda object_id: {"json": context.answer_sheets(object_id)}
+        )),
+        ('DELETE', '/result/<int:id>', fresh(context.create_exam_with_results, '/result/{id}', cleanup='/exam/{id}')),
+        ('POST', '/result/archive', fixed('/result/archive', json={})),
+        ('POST', '/result/reports/<int:exam_id>', fixed(
+            f'/result/reports/{exam_id}', after=lambda response: context.wait_for_job(response.get_json()["id"])
+        )),
+        ('GET', '/result/reports/job/<string:job_id>',
+         lambda: (dict(path=f'/result/reports/job/{context.finished_report_job()}'), None)),
+        ('GET', '/result/reports/job/<string:job_id>/download',
+         lambda: (dict(path=f'/result/reports/job/{context.finished_report_job()}/download'), None)),
+        # Monitoring
+        ('GET', '/metrics', fixed('/metrics', headers={'Authorization': f"Bearer {METRICS_TOKEN}"})),
+        ('GET', '/admin/slow-queries', fixed('/admin/slow-queries')),
+    ]
+
+
+def measure(client, counter: QueryCounter, method: str, prepare, repeat: int, warmup: int) -> dict:
+    """
+    Runs the request of a route warmup + repeat times and returns its latency percentiles (in
+    milliseconds), the median number of queries and the status codes of the measured requests.
+    """
+    latencies = []
+    queries = []
+    statuses = set()
+    for i in range(warmup + repeat):
+        arguments, after = prepare()
+        path = arguments.pop('path')
+
+        counter.count = 0
+        start = time.perf_counter()
+        response = client.open(path, method=method, **arguments)
+        # Streamed responses are only produced when they are read
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        count = counter.count
+
+        if after:
+            after(response)
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(count)
+            statuses.add(response.status_code)
+
+    result = {f"p{percentile}": float(np.percentile(latencies, percentile)) for percentile in PERCENTILES}
+    result["queries"] = int(np.median(queries))
+    result["statuses"] = sorted(statuses)
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list:
+    """
+    Returns the regressions of the results against the baseline: endpoints whose p95 latency grew more
+    than the threshold (and more than min_delta milliseconds, to ignore the noise of the fastest
+    endpoints) or that run more queries.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["p95"] > previous["p95"] * (1 + threshold) and result["p95"] - previous["p95"] > min_delta:
+            regressions.append(f"{name}: p95 {previous['p95']:.1f} ms -> {result['p95']:.1f} ms")
+        if result["queries"] > previous["queries"]:
+            regressions.append(f"{name}: {previous['queries']} -> {result['queries']} queries")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', help='empty database to use instead of a temporary SQLite file')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--route', action='append', help='only run the routes whose rule contains this text')
+    parser.add_argument('--output', help='file where the results are saved as JSON')
+    parser.add_argument('--baseline', help='results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative growth of the p95')
+    parser.add_argument('--min-delta', type=float, default=2.0, help='ignored p95 growth, in milliseconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--subjects', type=int, default=2)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--branching', type=int, default=4)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--exams', type=int, default=8)
+    parser.add_argument('--exam-questions', type=int, default=30)
+    parser.add_argument('--takers', type=int, default=80)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    # The database has to be chosen before the services create their sessions
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(directory.name, 'benchmark.db')}"
+    from app import app
+    from benchmarks.synthetic_data import generate
+    from db.versions.db import create_db, setup_database
+
+    # The export routes write their files to the working directory, which is the temporary one
+    os.chdir(directory.name)
+    setup_database()
+    start = time.perf_counter()
+    session = create_db()()
+    data = generate(
+        session, seed=args.seed, subjects=args.subjects, depth=args.depth, branching=args.branching,
+        questions=args.questions, exams=args.exams, exam_questions=args.exam_questions, takers=args.takers
+    )
+    session.close()
+    print(f"synthetic data generated in {time.perf_counter() - start:.1f} s")
+
+    app.config["ADMIN_EMAILS"] = data["users"][0]["email"]
+    app.config["METRICS_TOKEN"] = METRICS_TOKEN
+    client = app.test_client()
+    context = Context(client, data)
+    context.login()
+    counter = QueryCounter()
+
+    benchmark_routes = routes(context)
+    endpoints = {
+        (method, rule.rule)
+        for rule in app.url_map.iter_rules() if rule.endpoint not in IGNORED_ENDPOINTS
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+    }
+    missing = endpoints - {(method, rule) for method, rule, _ in benchmark_routes}
+    if args.route:
+        benchmark_routes = [route for route in benchmark_routes if any(text in route[1] for text in args.route)]
+
+    results = {}
+    errors = []
+    print(f"{'endpoint':<52} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8}")
+    for method, rule, prepare in benchmark_routes:
+        name = f"{method} {rule}"
+        result = measure(client, counter, method, prepare, args.repeat, args.warmup)
+        results[name] = result
+        print(f"{name:<52} {result['p50']:8.1f}ms {result['p95']:8.1f}ms {result['p99']:8.1f}ms {result['queries']:8d}")
+        if any(status >= 400 for status in result["statuses"]):
+            errors.append(f"{name}: status {result['statuses']}")
+    directory.cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    failures = [f"{method} {rule}: not benchmarked" for method, rule in sorted(missing)] + errors
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            failures += compare(results, json.load(baseline), args.threshold, args.min_delta)
+
+    if failures:
+        print("\nFAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
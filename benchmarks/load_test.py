@@ -0,0 +1,218 @@
+"""
+Compares the throughput of the production server (gunicorn with gunicorn.conf.py) in several worker and
+thread setups. Every setup serves the same synthetic dataset while a fixed number of clients, each with
+its own keep-alive connection, send a mix of the read routes for a fixed time.
+
+    python -m benchmarks.load_test --duration 20 --clients 16
+    python -m benchmarks.load_test --setup prefork:4:1 --setup threaded:1:16 --database-url postgresql://...
+
+A setup is name:workers:threads. The database is a temporary SQLite file unless an empty one is given
+with --database-url; SQLite serializes the connections, so the comparison is closer to production on Postgres.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SETUPS = ['prefork:4:1', 'threaded:1:8', 'hybrid:2:4']
+
+PERCENTILES = [50, 95, 99]
+
+# The servers are started with this token, so the readiness check can read the metrics route
+METRICS_TOKEN = secrets.token_hex(16)
+
+
+def read_routes(subject: dict) -> list:
+    """
+    Returns the (weight, path) of the requests sent by the clients, the listings being the most frequent.
+    """
+    return [
+        (4, '/subject/user-subjects'),
+        (4, f"/exam/list/{subject['id']}"),
+        (3, '/question/user-questions?limit=50'),
+        (3, f"/question/subject-questions/{subject['id']}?limit=50"),
+        (2, f"/exam/{subject['exam_ids'][0]}"),
+        (2, f"/result/summary/{subject['exam_ids'][0]}"),
+        (1, f"/result/analysis/{subject['exam_ids'][0]}"),
+    ]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url: str, workers: int, threads: int) -> tuple:
+    port = free_port()
+    environment = dict(os.environ, DATABASE_URL=database_url, WEB_BIND=f"127.0.0.1:{port}",
+                       WEB_WORKERS=str(workers), WEB_THREADS=str(threads), METRICS_TOKEN=METRICS_TOKEN)
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, environment.get("PYTHONPATH")]))
+    server = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', '-m', 'gunicorn', 'wsgi:app'],
+        cwd=ROOT, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    # The server is ready when every worker could answer, which is approximated by the metrics route
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/metrics', headers={'Authorization': f"Bearer {METRICS_TOKEN}"})
+            if connection.getresponse().status == 200:
+                connection.close()
+                return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("the server did not start")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def login(port: int, user: dict, password: str) -> str:
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = json.dumps({"email": user["email"], "password": password})
+    connection.request('POST', '/user/login', body=body, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    # Only the name and value of the access token cookie are sent back
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def client(port: int, cookie: str, routes: list, deadline: float, seed: int, latencies: list, errors: list):
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in routes]
+    paths = [path for _, path in routes]
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while time.monotonic() < deadline:
+        path = rng.choices(paths, weights)[0]
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers={"Cookie": cookie})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(path)
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.close()
+
+
+def run_clients(port: int, cookie: str, routes: list, clients: int, duration: float) -> tuple:
+    """
+    Sends requests from every client until the duration is over, and returns the latencies of the
+    successful ones, the paths of the failed ones and the elapsed time.
+    """
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    pool = [
+        threading.Thread(target=client, args=(port, cookie, routes, deadline, i, latencies, errors))
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_setup(database_url: str, data: dict, workers: int, threads: int, clients: int, duration: float,
+              warmup: float) -> dict:
+    server, port = start_server(database_url, workers, threads)
+    try:
+        user = data["users"][0]
+        cookie = login(port, user, data["password"])
+        routes = read_routes(user["subjects"][0])
+
+        # A short run fills the caches and opens the connections of every worker before measuring
+        run_clients(port, cookie, routes, clients, warmup)
+        latencies, errors, elapsed = run_clients(port, cookie, routes, clients, duration)
+    finally:
+        stop_server(server)
+
+    values = np.array(latencies) * 1000 if latencies else np.array([np.nan])
+    return {
+        "workers": workers,
+        "threads": threads,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / elapsed,
+        **{f"p{percentile}": float(np.percentile(values, percentile)) for percentile in PERCENTILES},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--setup', action='append', help='name:workers:threads (by default ' + ', '.join(DEFAULT_SETUPS) + ')')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds measured in each setup')
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--database-url', help='empty database to use instead of a temporary SQLite file')
+    parser.add_argument('--output', help='file where the results are saved as JSON')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--subjects', type=int, default=2)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--exams', type=int, default=8)
+    parser.add_argument('--exam-questions', type=int, default=30)
+    parser.add_argument('--takers', type=int, default=80)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(directory.name, 'load.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    from benchmarks.synthetic_data import generate
+    from db.versions.db import create_db, setup_database
+
+    setup_database()
+    session = create_db()()
+    data = generate(
+        session, seed=args.seed, subjects=args.subjects, questions=args.questions, exams=args.exams,
+        exam_questions=args.exam_questions, takers=args.takers
+    )
+    session.close()
+
+    results = {}
+    print(f"{'setup':<12} {'workers':>7} {'threads':>7} {'req/s':>8} "
+          + ' '.join(f"{'p' + str(percentile):>9}" for percentile in PERCENTILES) + f" {'errors':>7}")
+    for setup in args.setup or DEFAULT_SETUPS:
+        name, workers, threads = setup.split(':')
+        result = run_setup(database_url, data, int(workers), int(threads), args.clients, args.duration, args.warmup)
+        results[name] = result
+        print(f"{name:<12} {result['workers']:>7} {result['threads']:>7} {result['throughput']:>8.1f} "
+              + ' '.join(f"{result['p' + str(percentile)]:>7.1f}ms" for percentile in PERCENTILES)
+              + f" {result['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
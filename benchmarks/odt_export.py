@@ -0,0 +1,182 @@
+"""
+Compares the streamed ODT writer (Exam.write_exam_to_odt) with the odfpy implementation it replaced, kept
+here as the baseline: checks that both documents are structurally equivalent (the mimetype entry, the
+paragraphs and styles of content.xml and office:styles) and measures the time and peak memory of each one.
+
+    python -m benchmarks.odt_export --questions 2000 --repeat 5
+"""
+import argparse
+import io
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+from xml.etree import ElementTree
+
+from models.exam.exam import Exam
+from utils.question_formats import answer_letter, apply_parameters, question_parameter_values
+from utils.utils import get_academic_year
+
+OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+
+
+def build_exam_data(question_number: int, answers_per_question: int = 4, section_size: int = 25):
+    questions = []
+    for i in range(1, question_number + 1):
+        questions.append({
+            'id': i,
+            'title': f"Question {i} about <tags> & entities with value ##param1##",
+            'type': 'test' if i % 5 else 'desarrollo',
+            'section_number': (i - 1) // section_size + 1,
+            'group': 1,
+            'question_parameters': {'items': [{'value': str(i), 'group': 1, 'position': 1}]},
+            'answers': {'items': [
+                {'body': f"Answer {j} of question {i}", 'points': 100 if j == 0 else 0}
+                for j in range(answers_per_question)
+            ]},
+        })
+    return {'id': 1, 'title': "Benchmark exam", 'year': 2024, 'month': 10, 'questions': {'items': questions}}
+
+
+def write_exam_to_odt_odfpy(exam_data, subject_name, output_file):
+    """
+    Writes the exam as an ODT document building the whole odfpy document tree, as the exports did before
+    the streamed writer.
+    """
+    from odf.opendocument import OpenDocumentText
+    from odf.text import H, P, Span
+    from odf.style import Style, TextProperties, ParagraphProperties
+
+    doc = OpenDocumentText()
+
+    h1_style = Style(name="Heading1", family="paragraph")
+    h1_style.addElement(TextProperties(attributes={'fontsize': "24pt", 'fontweight': "bold"}))
+    doc.styles.addElement(h1_style)
+
+    h2_style = Style(name="Heading2", family="paragraph")
+    h2_style.addElement(TextProperties(attributes={'fontsize': "18pt", 'fontweight': "bold"}))
+    doc.styles.addElement(h2_style)
+
+    p_style = Style(name="Paragraph", family="paragraph")
+    p_style.addElement(TextProperties(attributes={'fontsize': "12pt"}))
+    doc.styles.addElement(p_style)
+
+    bold_style = Style(name="Bold", family="text")
+    bold_style.addElement(TextProperties(fontweight="bold"))
+    doc.styles.addElement(bold_style)
+
+    small_right_align_style = Style(name="SmallRightAlign", family="paragraph")
+    small_right_align_style.addElement(TextProperties(attributes={'fontsize': "10pt"}))
+    small_right_align_style.addElement(ParagraphProperties(attributes={'textalign': "right"}))
+    doc.styles.addElement(small_right_align_style)
+
+    # The heading is established
+    year1 = get_academic_year(datetime(exam_data['year'], exam_data['month'], 1))
+    year2 = year1 + 1
+    name_line = "Nombre y Apellidos: _________________________________________________________________"
+    for text in (f"{subject_name} - Curso {year1}-{year2}", exam_data['title'], None, None, name_line, None):
+        if text is None:
+            doc.text.addElement(P(text=""))
+            continue
+        paragraph = P(stylename=small_right_align_style)
+        paragraph.addElement(Span(text=text, stylename=bold_style))
+        doc.text.addElement(paragraph)
+
+    # The actual content of the exam is established
+    current_section = None
+    for question_number, question in enumerate(exam_data['questions']['items'], 1):
+        section = question.get('section_number')
+        if section != current_section:
+            current_section = section
+            doc.text.addElement(H(outlinelevel=2, stylename=h2_style, text=f"Sección {current_section}"))
+            doc.text.addElement(P(text=""))
+
+        parameters = question_parameter_values(question)
+        question_title = apply_parameters(question['title'], parameters)
+        doc.text.addElement(P(stylename=p_style, text=f"{question_number}. {question_title}"))
+
+        if 'answers' in question and question['type'] == 'test':
+            for position, answer in enumerate(question['answers']['items']):
+                answer_body = apply_parameters(answer['body'], parameters)
+                doc.text.addElement(P(stylename=p_style, text=f"{answer_letter(position)}. {answer_body}"))
+        doc.text.addElement(P(text=""))
+
+    doc.save(output_file)
+
+
+def element_structure(element):
+    if element is None:
+        return None
+    return (
+        element.tag,
+        sorted(element.attrib.items()),
+        (element.text or '').strip(),
+        [element_structure(child) for child in element],
+    )
+
+
+def document_structure(data: bytes) -> dict:
+    """
+    Returns the parts of an ODT document that have to be equal in both writers.
+    """
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    first = archive.infolist()[0]
+    content = ElementTree.fromstring(archive.read('content.xml'))
+    styles = ElementTree.fromstring(archive.read('styles.xml'))
+    return {
+        "mimetype entry": (first.filename, first.compress_type, archive.read('mimetype')),
+        "content.xml paragraphs": element_structure(content.find(f'{OFFICE}body')),
+        "content.xml styles": element_structure(content.find(f'{OFFICE}automatic-styles')),
+        "office:styles": element_structure(styles.find(f'{OFFICE}styles')),
+    }
+
+
+def check_equivalence(exam_data) -> list:
+    """
+    Returns the parts of the document that differ between the streamed writer and the odfpy one.
+    """
+    streamed = document_structure(render(Exam.write_exam_to_odt, exam_data))
+    reference = document_structure(render(write_exam_to_odt_odfpy, exam_data))
+    return [part for part in reference if streamed[part] != reference[part]]
+
+
+def render(writer, exam_data):
+    output = io.BytesIO()
+    writer(exam_data, "Benchmark subject", output)
+    return output.getvalue()
+
+
+def measure(writer, exam_data, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(writer, exam_data)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    render(writer, exam_data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    exam_data = build_exam_data(args.questions)
+
+    different = check_equivalence(exam_data)
+    if different:
+        raise SystemExit(f"The streamed ODT differs from the odfpy one in: {', '.join(different)}")
+    print(f"Structural equivalence: OK ({args.questions} questions)")
+
+    for name, writer in (('odfpy', write_exam_to_odt_odfpy), ('streamed', Exam.write_exam_to_odt)):
+        seconds, peak = measure(writer, exam_data, args.repeat)
+        print(f"{name:>9}: {seconds * 1000:9.1f} ms   peak memory {peak / 1024 / 1024:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
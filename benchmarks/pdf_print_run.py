@@ -0,0 +1,70 @@
+"""
+Measures the throughput, in pages per second, of the PDF print runs against rendering
+every copy as an independent export.
+
+    python -m benchmarks.pdf_print_run --copies 200 --questions 20 --processes 4
+"""
+import argparse
+import io
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.odt_export import build_exam_data
+from models.exam.exam import Exam
+
+PAGE_PATTERN = re.compile(rb'/Type\s*/Page[^s]')
+
+
+def count_pages(data: bytes) -> int:
+    return len(PAGE_PATTERN.findall(data))
+
+
+def independent_exports(exam_data, copies: int) -> int:
+    pages = 0
+    for _ in range(copies):
+        output = io.BytesIO()
+        Exam.write_exam_to_pdf(exam_data, "Benchmark subject", output)
+        pages += count_pages(output.getvalue())
+    return pages
+
+
+def single_pdf(exam_data, copies: int) -> int:
+    names = [(i, f"Student {i}") for i in range(1, copies + 1)]
+    return count_pages(Exam.render_pdf_copies(exam_data, "Benchmark subject", names))
+
+
+def separate_pdfs(exam_data, copies: int, processes: int) -> int:
+    names = [(i, f"Student {i}") for i in range(1, copies + 1)]
+    chunk_size = -(-copies // processes)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(Exam.render_pdf_copies, exam_data, "Benchmark subject", names[i:i + chunk_size], True)
+            for i in range(0, copies, chunk_size)
+        ]
+        return sum(count_pages(data) for future in futures for _, data in future.result())
+
+
+def report(name: str, function, *args):
+    start = time.perf_counter()
+    pages = function(*args)
+    seconds = time.perf_counter() - start
+    print(f"{name:>28}: {pages:6d} pages in {seconds:7.2f} s  ->  {pages / seconds:8.1f} pages/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--copies', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    exam_data = build_exam_data(args.questions)
+
+    report("independent exports", independent_exports, exam_data, args.copies)
+    report("print run, single PDF", single_pdf, exam_data, args.copies)
+    report(f"print run, {args.processes} processes", separate_pdfs, exam_data, args.copies, args.processes)
+
+
+if __name__ == '__main__':
+    main()
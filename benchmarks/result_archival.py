@@ -0,0 +1,156 @@
+"""
+Measures the hot-path result queries (a page of the subject's result list, the per-question averages
+of the subject and the summary of a current exam) before and after archiving the closed academic years.
+A temporary SQLite database is filled with several years of synthetic results.
+
+    python -m benchmarks.result_archival --years 5 --exams 20 --questions 30 --takers 60
+"""
+import argparse
+import importlib
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.orm import sessionmaker
+
+from db.versions.db import Base
+from models.exam.exam import Exam
+from models.question.question import Question
+from models.result.result import Result, archive_results
+from models.subject.subject import Subject
+from models.user.user import User
+from models.associations.associations import exam_question_association
+from utils.preload import MODEL_MODULES
+from utils.utils import get_academic_year
+
+# Every model is imported so that their relationships can be configured
+for module in MODEL_MODULES:
+    importlib.import_module(module)
+
+USER_ID = 1
+SUBJECT_ID = 1
+
+
+def fill_database(session, years: int, exams: int, questions: int, takers: int) -> list:
+    """
+    Creates exams in the last academic years (the current one included) with one result per
+    taker and question. Returns the IDs of the exams of the current year.
+    """
+    rng = random.Random(1)
+    session.execute(insert(User), [{"id": USER_ID, "name": "benchmark", "email": "b@b", "password": "-"}])
+    session.execute(insert(Subject), [{"id": SUBJECT_ID, "name": "Benchmark", "created_by": USER_ID}])
+    session.execute(insert(Question), [
+        {
+            "id": question_id, "created_by": USER_ID, "title": f"Question {question_id}", "difficulty": 5,
+            "time": 2, "parametrized": False, "active": True, "subject_id": SUBJECT_ID, "type": "test",
+        }
+        for question_id in range(1, questions + 1)
+    ])
+
+    current_year = get_academic_year(datetime.now())
+    current_exams = []
+    exam_id = 0
+    result_id = 0
+    for year in range(current_year - years + 1, current_year + 1):
+        for _ in range(exams):
+            exam_id += 1
+            session.execute(insert(Exam), [{
+                "id": exam_id, "created_by": USER_ID, "title": f"Exam {exam_id}", "subject_id": SUBJECT_ID,
+                "created_on": datetime(year, 10, 1) if year < current_year else datetime.now(),
+            }])
+            session.execute(insert(exam_question_association), [
+                {"exam_id": exam_id, "question_id": question_id, "section_id": 1}
+                for question_id in range(1, questions + 1)
+            ])
+            rows = []
+            for taker in range(1, takers + 1):
+                for question_id in range(1, questions + 1):
+                    result_id += 1
+                    rows.append({
+                        "id": result_id, "created_by": USER_ID, "question_id": question_id, "exam_id": exam_id,
+                        "time": rng.randint(1, 20), "taker": taker, "points": rng.choice([100, 0, -50]),
+                    })
+            session.execute(insert(Result), rows)
+            if year == current_year:
+                current_exams.append(exam_id)
+    session.commit()
+    return current_exams
+
+
+def hot_queries(session, exam_id: int, include_archive: bool = False):
+    results = Result.results_source(include_archive)
+
+    # A deep page of the subject's result list (same shape as Result.get_results_list)
+    query = (
+        select(results.c.id, results.c.points, results.c.taker, Question.title, Exam.title)
+        .join(Exam, results.c.exam_id == Exam.id)
+        .join(Question, results.c.question_id == Question.id)
+        .where(results.c.created_by == USER_ID, Question.subject_id == SUBJECT_ID)
+        .offset(2000)
+        .limit(100)
+    )
+    session.execute(query).all()
+
+    # The average points of every question of the subject
+    query = (
+        select(results.c.question_id, func.avg(results.c.points))
+        .join(Question, results.c.question_id == Question.id)
+        .where(Question.subject_id == SUBJECT_ID)
+        .group_by(results.c.question_id)
+    )
+    session.execute(query).all()
+
+    # The per-taker totals of an exam of the current year (same shape as Result.get_exam_summary)
+    query = (
+        select(results.c.taker, func.sum(results.c.points), func.sum(results.c.time))
+        .where(results.c.exam_id == exam_id)
+        .group_by(results.c.taker)
+    )
+    session.execute(query).all()
+
+
+def measure(session, exam_id: int, repeat: int, include_archive: bool = False) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hot_queries(session, exam_id, include_archive)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--exams', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=30)
+    parser.add_argument('--takers', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        current_exams = fill_database(session, args.years, args.exams, args.questions, args.takers)
+        total = session.execute(select(func.count(Result.id))).scalar()
+        print(f"{total} results in {args.years} academic years")
+
+        before = measure(session, current_exams[0], args.repeat)
+        print(f"hot queries before archiving:        {before * 1000:8.1f} ms")
+
+        start = time.perf_counter()
+        archived = archive_results(session, USER_ID)
+        print(f"archived {archived['archived']} results in {archived['batches']} batches "
+              f"in {time.perf_counter() - start:.2f} s")
+
+        after = measure(session, current_exams[0], args.repeat)
+        with_archive = measure(session, current_exams[0], args.repeat, include_archive=True)
+        print(f"hot queries after archiving:         {after * 1000:8.1f} ms ({before / after:.1f}x faster)")
+        print(f"hot queries including the archive:   {with_archive * 1000:8.1f} ms")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
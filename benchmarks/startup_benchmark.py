@@ -0,0 +1,94 @@
+"""
+Measures the startup of a worker: the time to import the app and the resident memory afterwards, in
+fresh interpreters, and the heavy libraries loaded by the import. The time of the first request is
+measured as well, since the work moved out of the import must not be paid by it instead.
+
+    python -m benchmarks.startup_benchmark --repeat 10 --output startup.json
+    python -m benchmarks.startup_benchmark --baseline startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in each interpreter, after DATABASE_URL has been set to an empty database
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter() - start
+
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+memory = rss()
+heavy = [name for name in sys.argv[1].split(',') if name in sys.modules]
+start = time.perf_counter()
+status = app.test_client().get('/metrics', headers={'Authorization': 'Bearer startup'}).status_code
+first_request = time.perf_counter() - start
+print(json.dumps({"import": imported, "rss": memory, "first_request": first_request, "heavy": heavy,
+                  "status": status}))
+"""
+
+HEAVY_LIBRARIES = ('pandas', 'numpy', 'pyarrow', 'reportlab')
+
+
+def probe(database_url: str, preload_heavy: bool) -> dict:
+    environment = dict(os.environ, DATABASE_URL=database_url, PRELOAD_HEAVY_MODULES=str(preload_heavy),
+                       METRICS_TOKEN='startup')
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, environment.get("PYTHONPATH")]))
+    output = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-c', PROBE, ','.join(HEAVY_LIBRARIES)],
+        cwd=ROOT, env=environment, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--preload-heavy', action='store_true', help='import the heavy libraries as a preloading server does')
+    parser.add_argument('--output', help='file where the results are saved as JSON')
+    parser.add_argument('--baseline', help='results of a previous run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+        # One interpreter is discarded so that the files of the libraries are in the page cache
+        probe(database_url, args.preload_heavy)
+        runs = [probe(database_url, args.preload_heavy) for _ in range(args.repeat)]
+
+    results = {
+        "import_ms": statistics.median(run["import"] for run in runs) * 1000,
+        "rss_mb": statistics.median(run["rss"] for run in runs),
+        "first_request_ms": statistics.median(run["first_request"] for run in runs) * 1000,
+        "heavy_libraries": runs[-1]["heavy"],
+    }
+    print(f"import of the app     {results['import_ms']:8.1f} ms")
+    print(f"resident memory       {results['rss_mb']:8.1f} MB")
+    print(f"first request         {results['first_request_ms']:8.1f} ms")
+    print(f"heavy libraries       {', '.join(results['heavy_libraries']) or 'none'}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        for key, unit in (("import_ms", "ms"), ("rss_mb", "MB"), ("first_request_ms", "ms")):
+            change = results[key] - baseline[key]
+            print(f"{key:<20} {baseline[key]:8.1f} -> {results[key]:8.1f} {unit} ({change:+.1f})")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Seeded generator of realistic volumes of data, inserted in bulk through the models: users, subjects
+with deep node trees, questions with answers and parameters, exams with sections and their results.
+The same seed always produces the same data.
+
+    python -m benchmarks.synthetic_data --database-url sqlite:///synthetic.db --subjects 2 --questions 500
+"""
+import argparse
+import random
+from datetime import datetime
+
+import bcrypt
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.versions.db import setup_database
+# Every model is imported so that their relationships can be configured
+from models.answer.answer import Answer
+from models.exam.exam import Exam
+from models.node.node import Node
+from models.question.question import Question
+from models.question_parameter.question_parameter import QuestionParameter
+from models.question_statistics.question_statistics import QuestionStatistics
+from models.result.result import Result
+from models.subject.subject import Subject
+from models.user.user import User
+from models.associations.associations import exam_question_association, node_question_association
+from secret import PASSWORD_SALT
+from utils.utils import get_academic_year
+
+# Every generated user can log in with this password
+PASSWORD = "benchmark"
+
+# Number of results inserted by each statement
+RESULT_CHUNK_SIZE = 5000
+
+
+def _insert(session, model, rows: list) -> list:
+    """
+    Inserts the rows through the model in bulk and returns their IDs in the order of the rows.
+    """
+    if not rows:
+        return []
+    return session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+
+
+def generate_node_tree(session, rng, user_id: int, subject_id: int, name: str, depth: int, branching: int) -> tuple:
+    """
+    Creates the root node of the subject and depth levels of nodes below it, each node with between
+    one and branching children. Returns the IDs of every node and of the leaves.
+    """
+    level = _insert(session, Node, [{"name": name, "subject_id": subject_id, "created_by": user_id}])
+    node_ids = list(level)
+    for depth_level in range(1, depth + 1):
+        rows = [
+            {
+                "name": f"Tema {depth_level}.{i}",
+                "subject_id": subject_id,
+                "parent_id": parent_id,
+                "created_by": user_id,
+            }
+            for parent_id in level
+            for i in range(1, rng.randint(1, branching) + 1)
+        ]
+        level = _insert(session, Node, rows)
+        node_ids.extend(level)
+    return node_ids, level
+
+
+def generate_questions(session, rng, user_id: int, subject_id: int, leaf_ids: list, count: int) -> dict:
+    """
+    Creates test (most of them, with three to five answers) and development questions, a fifth of them
+    parametrized. Every question hangs from a leaf node. Returns the answers of every test question.
+    """
+    kinds = [
+        {
+            "type": "test" if rng.random() < 0.8 else "desarrollo",
+            "parametrized": rng.random() < 0.2,
+        }
+        for _ in range(count)
+    ]
+    question_ids = _insert(session, Question, [
+        {
+            "created_by": user_id,
+            "subject_id": subject_id,
+            "title": f"Pregunta {i} con el valor ##param1##" if kind["parametrized"] else f"Pregunta {i}",
+            "difficulty": rng.randint(1, 10),
+            "time": rng.randint(1, 20),
+            "parametrized": kind["parametrized"],
+            "active": rng.random() < 0.95,
+            "type": kind["type"],
+        }
+        for i, kind in enumerate(kinds, 1)
+    ])
+
+    session.execute(insert(node_question_association), [
+        {"node_id": rng.choice(leaf_ids), "question_id": question_id} for question_id in question_ids
+    ])
+    session.execute(insert(QuestionParameter), [
+        {"created_by": user_id, "question_id": question_id, "value": str(rng.randint(1, 100)),
+         "group": group, "position": 1}
+        for question_id, kind in zip(question_ids, kinds) if kind["parametrized"]
+        for group in range(1, rng.randint(2, 4) + 1)
+    ])
+
+    answer_rows = []
+    for question_id, kind in zip(question_ids, kinds):
+        if kind["type"] != "test":
+            continue
+        options = rng.randint(3, 5)
+        correct = rng.randrange(options)
+        for option in range(options):
+            answer_rows.append({
+                "created_by": user_id,
+                "question_id": question_id,
+                "body": f"Respuesta {option + 1}",
+                "points": 100 if option == correct else rng.choice([0, -25, -50]),
+            })
+    answer_ids = _insert(session, Answer, answer_rows)
+
+    questions = {question_id: [] for question_id in question_ids}
+    for row, answer_id in zip(answer_rows, answer_ids):
+        questions[row["question_id"]].append((answer_id, row["points"]))
+    return questions
+
+
+def generate_results(rng, user_id: int, exam_id: int, questions: dict, question_ids: list, takers: int) -> list:
+    """
+    Returns the results of the takers of an exam. Each taker has an ability that sets how likely they
+    are to choose the right answer of the test questions and how well the other questions are graded.
+    """
+    rows = []
+    for taker in range(1, takers + 1):
+        ability = rng.random()
+        for question_id in question_ids:
+            answers = questions[question_id]
+            answer_id = None
+            if answers:
+                answer_id, points = max(answers, key=lambda answer: answer[1]) if rng.random() < ability \
+                    else rng.choice(answers)
+            else:
+                points = 10 * round(10 * min(1.0, max(0.0, rng.gauss(ability, 0.2))))
+            rows.append({
+                "created_by": user_id,
+                "exam_id": exam_id,
+                "question_id": question_id,
+                "taker": taker,
+                "points": points,
+                "time": rng.randint(1, 30),
+                "answer_id": answer_id,
+            })
+    return rows
+
+
+def generate(
+        session,
+        seed: int = 1,
+        users: int = 2,
+        subjects: int = 2,
+        depth: int = 4,
+        branching: int = 4,
+        questions: int = 300,
+        exams: int = 8,
+        sections: int = 3,
+        exam_questions: int = 30,
+        takers: int = 80
+) -> dict:
+    """
+    Fills the database and returns the IDs of what was created, by user and subject. The exams are
+    created in the current academic year, so their results are not archived.
+    """
+    rng = random.Random(seed)
+    password = bcrypt.hashpw(PASSWORD.encode('utf-8'), PASSWORD_SALT).decode('utf-8')
+    emails = [f"benchmark{seed}.{i}@example.com" for i in range(1, users + 1)]
+    user_ids = _insert(session, User, [
+        {"email": email, "name": f"Benchmark {i}", "password": password} for i, email in enumerate(emails, 1)
+    ])
+
+    now = datetime.now()
+    year_start = datetime(get_academic_year(now), 9, 1)
+    data = {"password": PASSWORD, "users": []}
+    for user_id, email in zip(user_ids, emails):
+        user = {"id": user_id, "email": email, "subjects": []}
+        data["users"].append(user)
+        for subject_number in range(1, subjects + 1):
+            name = f"Asignatura {subject_number}"
+            subject_id = _insert(session, Subject, [{"name": name, "created_by": user_id}])[0]
+            node_ids, leaf_ids = generate_node_tree(session, rng, user_id, subject_id, name, depth, branching)
+            subject_questions = generate_questions(session, rng, user_id, subject_id, leaf_ids, questions)
+            question_ids = list(subject_questions)
+
+            exam_ids = []
+            for exam_number in range(1, exams + 1):
+                created_on = year_start + (now - year_start) * rng.random()
+                exam_id = _insert(session, Exam, [{
+                    "title": f"Examen {exam_number}",
+                    "subject_id": subject_id,
+                    "created_by": user_id,
+                    "created_on": created_on,
+                }])[0]
+                exam_ids.append(exam_id)
+
+                chosen = rng.sample(question_ids, min(exam_questions, len(question_ids)))
+                session.execute(insert(exam_question_association), [
+                    {"exam_id": exam_id, "question_id": question_id, "section_id": 1 + i * sections // len(chosen)}
+                    for i, question_id in enumerate(chosen)
+                ])
+                rows = generate_results(rng, user_id, exam_id, subject_questions, chosen, takers)
+                for start in range(0, len(rows), RESULT_CHUNK_SIZE):
+                    session.execute(insert(Result), rows[start:start + RESULT_CHUNK_SIZE])
+
+            # The statistics of the questions are calculated once every result is stored
+            QuestionStatistics.rebuild(session, question_ids)
+            user["subjects"].append({
+                "id": subject_id,
+                "node_ids": node_ids,
+                "leaf_ids": leaf_ids,
+                "question_ids": question_ids,
+                "exam_ids": exam_ids,
+            })
+
+    session.commit()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--subjects', type=int, default=2)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--branching', type=int, default=4)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--exams', type=int, default=8)
+    parser.add_argument('--sections', type=int, default=3)
+    parser.add_argument('--exam-questions', type=int, default=30)
+    parser.add_argument('--takers', type=int, default=80)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    setup_database(engine)
+    session = sessionmaker(bind=engine)()
+
+    data = generate(
+        session, seed=args.seed, users=args.users, subjects=args.subjects, depth=args.depth,
+        branching=args.branching, questions=args.questions, exams=args.exams, sections=args.sections,
+        exam_questions=args.exam_questions, takers=args.takers
+    )
+    subjects = [subject for user in data["users"] for subject in user["subjects"]]
+    print(f"{len(data['users'])} users, {len(subjects)} subjects, "
+          f"{sum(len(subject['node_ids']) for subject in subjects)} nodes, "
+          f"{sum(len(subject['question_ids']) for subject in subjects)} questions, "
+          f"{sum(len(subject['exam_ids']) for subject in subjects)} exams")
+    print(f"users log in with the password '{data['password']}': "
+          + ", ".join(user["email"] for user in data["users"]))
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Reads the traces exported in the OTLP/JSON format (TRACING_FILE) and prints the tree of spans of a
+trace, with the time of each span and the time spent in the span itself (not in its children), and
+the stages that took the most time in the trace.
+
+    python -m benchmarks.trace_summary /tmp/questions-api-traces.jsonl
+    python -m benchmarks.trace_summary /tmp/questions-api-traces.jsonl --trace 4bf92f3577b34da6a3ce929d0e0e4736
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def read_spans(path: str) -> dict:
+    """
+    Returns the spans of the file by trace ID.
+    """
+    traces = defaultdict(list)
+    with open(path) as exported:
+        for line in exported:
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        span["duration"] = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                        traces[span["traceId"]].append(span)
+    return traces
+
+
+def summarize(spans: list, top: int):
+    ids = {span["spanId"] for span in spans}
+    children = defaultdict(list)
+    roots = []
+    for span in sorted(spans, key=lambda span: int(span["startTimeUnixNano"])):
+        if span.get("parentSpanId") in ids:
+            children[span["parentSpanId"]].append(span)
+        else:
+            roots.append(span)
+
+    # The statements are grouped by their operation, and the rest of the spans by their name
+    stages = defaultdict(lambda: [0, 0.0])
+
+    def show(span, depth):
+        own = span["duration"] - sum(child["duration"] for child in children[span["spanId"]])
+        stage = stages[span["name"]]
+        stage[0] += 1
+        stage[1] += own
+        if span["kind"] != 3:
+            statements = [child for child in children[span["spanId"]] if child["kind"] == 3]
+            suffix = f", {len(statements)} statements" if statements else ""
+            print(f"{'  ' * depth}{span['name']}  {span['duration']:.1f}ms (self {own:.1f}ms{suffix})")
+        for child in children[span["spanId"]]:
+            show(child, depth + 1)
+
+    for root in roots:
+        show(root, 0)
+
+    print(f"\n{'stage':<60} {'count':>6} {'self time':>10}")
+    for name, (count, own) in sorted(stages.items(), key=lambda item: item[1][1], reverse=True)[:top]:
+        print(f"{name[:60]:<60} {count:>6} {own:>8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--trace', help='trace ID (the slowest trace by default)')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    traces = read_spans(args.file)
+    if not traces:
+        print("no traces")
+        return
+    trace_id = args.trace or max(traces, key=lambda trace: max(span["duration"] for span in traces[trace]))
+    if trace_id not in traces:
+        parser.error(f"trace {trace_id} not found")
+    print(f"trace {trace_id}")
+    summarize(traces[trace_id], args.top)
+
+
+if __name__ == '__main__':
+    main()
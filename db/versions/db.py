@@ -1,7 +1,11 @@
+import os
+
 from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
+from sqlalchemy.engine import URL, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from db.versions.migrations import run_migrations, find_duplicate_results, remove_duplicate_results
 
 
 
@@ -15,11 +19,78 @@ url_object = URL.create(
     port="5432"
 )
 
+# Another database (for example a local one for the benchmarks) can be given in the environment
+if os.environ.get("DATABASE_URL"):
+    url_object = make_url(os.environ["DATABASE_URL"])
+
 
 Base = declarative_base()
 
+# Engines created by the services, whose connection pools are reported in the metrics
+engines = []
+
+# Sessions of the services, which are removed at the end of every request
+sessions = []
+
 def create_db():
+    """
+    Returns the session of a service. It is a proxy to a session of the current thread, since a session can
+    not be shared by the threads of a worker, and that session is removed at the end of each request.
+    """
+    # The schema is not created here but by setup_database, so importing the services does not touch the database
     engine = create_engine(url_object)
+    engines.append(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    sessions.append(session)
+    return session
+
+def remove_sessions(exception=None):
+    # The transaction of the request is rolled back if it was not committed, and its objects are discarded
+    for session in sessions:
+        session.remove()
+
+def init_sessions(app):
+    """
+    Removes the sessions of the services when the app context of each request ends, which for the streamed
+    responses is after their last chunk has been sent.
+    """
+    app.teardown_appcontext(remove_sessions)
+
+def setup_database(engine=None):
+    """
+    Creates the missing tables and applies the pending migrations. It is run once per deployment
+    (flask --app app init-db), after every model has been imported.
+    """
+    if engine is None:
+        engine = create_engine(url_object)
+        try:
+            setup_database(engine)
+        finally:
+            engine.dispose()
+        return
     Base.metadata.create_all(engine)
-    return sessionmaker(bind=engine)
+    run_migrations(engine)
+
+def deduplicate_results(apply: bool = False, engine=None) -> tuple:
+    """
+    Returns the results uploaded more than once (all but the last uploaded one), which keep the migration
+    of the natural key of the results from being applied, and removes them if apply is given. Returns
+    them together with the number of removed results.
+    """
+    if engine is None:
+        engine = create_engine(url_object)
+        try:
+            return deduplicate_results(apply, engine)
+        finally:
+            engine.dispose()
+    with engine.begin() as connection:
+        duplicates = find_duplicate_results(connection)
+        return duplicates, remove_duplicate_results(connection) if apply else 0
 
+def dispose_engines():
+    """
+    Discards the pooled connections inherited from the parent process after a fork, without closing
+    them, since they still belong to the parent.
+    """
+    for engine in engines:
+        engine.dispose(close=False)
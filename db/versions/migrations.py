@@ -0,0 +1,309 @@
+from datetime import datetime
+
+from sqlalchemy import Table, Column, String, DateTime, MetaData, Integer, inspect, select, insert, text
+from sqlalchemy.sql import sqltypes
+
+# Arbitrary key of the advisory lock that serializes the migrations of concurrent workers (PostgreSQL)
+MIGRATION_LOCK_KEY = 7_340_034
+
+# Number of rows validated at once when the database can not validate them itself
+VALIDATION_CHUNK_SIZE = 50_000
+
+# Maximum number of invalid rows reported by a failed migration
+MAX_REPORTED_ROWS = 10
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations',
+    metadata,
+    Column('version', String, primary_key=True),
+    Column('description', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _integer_columns(connection, table: str, columns: list) -> list:
+    """
+    Returns the given columns of the table that are not stored as integers yet.
+    """
+    types = {column['name']: column['type'] for column in inspect(connection).get_columns(table)}
+    return [column for column in columns if not isinstance(types[column], sqltypes.Integer)]
+
+
+def _find_non_integer_rows(connection, table: str, columns: list) -> list:
+    """
+    Returns the IDs of the rows where any of the given columns does not hold an integer.
+    """
+    import pandas as pd
+
+    if connection.dialect.name == 'postgresql':
+        # The values are validated by the database in a single scan
+        condition = ' OR '.join(f"\"{column}\" !~ '^\\s*[-+]?[0-9]+\\s*$'" for column in columns)
+        query = text(f'SELECT id FROM "{table}" WHERE {condition} ORDER BY id LIMIT :limit')
+        return list(connection.execute(query, {'limit': MAX_REPORTED_ROWS}).scalars())
+
+    # Other databases can not match regular expressions, so the values are validated in chunks
+    invalid_ids = []
+    selected = ', '.join(f'"{column}"' for column in columns)
+    query = text(f'SELECT id, {selected} FROM "{table}" ORDER BY id')
+    for chunk in pd.read_sql(query, connection, chunksize=VALIDATION_CHUNK_SIZE):
+        values = chunk[columns].apply(lambda column: column.astype(str).str.strip())
+        invalid = (~values.apply(lambda column: column.str.fullmatch(r'[-+]?[0-9]+'))).any(axis=1)
+        invalid_ids.extend(int(row_id) for row_id in chunk.loc[invalid, 'id'])
+        if len(invalid_ids) >= MAX_REPORTED_ROWS:
+            break
+    return invalid_ids[:MAX_REPORTED_ROWS]
+
+
+def _convert_to_integer(connection, table: str, columns: list):
+    if connection.dialect.name == 'postgresql':
+        alterations = ', '.join(
+            f'ALTER COLUMN "{column}" TYPE INTEGER USING trim("{column}")::integer' for column in columns
+        )
+        connection.execute(text(f'ALTER TABLE "{table}" {alterations}'))
+        return
+
+    # Databases without ALTER COLUMN TYPE (SQLite) get the table rebuilt with the new column types
+    old_table = Table(table, MetaData(), autoload_with=connection)
+    new_table = old_table.to_metadata(MetaData())
+    for column in columns:
+        new_table.c[column].type = Integer()
+    new_table.indexes.clear()
+
+    connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{table}_old"'))
+    new_table.create(connection)
+    selected = ', '.join(
+        f'CAST(trim("{column.name}") AS INTEGER)' if column.name in columns else f'"{column.name}"'
+        for column in new_table.columns
+    )
+    names = ', '.join(f'"{column.name}"' for column in new_table.columns)
+    connection.execute(text(f'INSERT INTO "{table}" ({names}) SELECT {selected} FROM "{table}_old"'))
+    connection.execute(text(f'DROP TABLE "{table}_old"'))
+
+
+def convert_result_columns_to_integer(connection):
+    """
+    Converts result.time and result.taker from text to integer columns. Every row is validated first,
+    and the migration fails listing the offending rows if any of them does not hold an integer.
+    """
+    if not inspect(connection).has_table('result'):
+        return
+
+    columns = _integer_columns(connection, 'result', ['time', 'taker'])
+    if not columns:
+        return
+
+    invalid_ids = _find_non_integer_rows(connection, 'result', columns)
+    if invalid_ids:
+        raise MigrationError(
+            f"Los resultados {invalid_ids} tienen valores no enteros en {columns} y deben corregirse antes de migrar."
+        )
+
+    _convert_to_integer(connection, 'result', columns)
+
+
+def add_result_indexes(connection):
+    """
+    Adds the indexes used by the per-taker and per-question aggregates of the results.
+    """
+    if not inspect(connection).has_table('result'):
+        return
+
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_result_exam_id_taker ON result (exam_id, taker)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_result_question_id ON result (question_id)'))
+
+
+def add_result_answer(connection):
+    """
+    Adds the answer chosen by the taker to the results (only known for some test questions).
+    """
+    if not inspect(connection).has_table('result'):
+        return
+
+    columns = {column['name'] for column in inspect(connection).get_columns('result')}
+    if 'answer_id' not in columns:
+        connection.execute(text('ALTER TABLE result ADD COLUMN answer_id INTEGER REFERENCES answer (id)'))
+
+
+# Condition of the results that were uploaded again later with the same (exam_id, question_id, taker)
+DUPLICATE_RESULTS = 'id NOT IN (SELECT max(id) FROM result GROUP BY exam_id, question_id, taker)'
+
+
+def find_duplicate_results(connection, limit: int = None) -> list:
+    """
+    Returns the (id, exam_id, question_id, taker) of the results that were uploaded again later, which
+    are the ones removed by remove_duplicate_results.
+    """
+    if not inspect(connection).has_table('result'):
+        return []
+
+    query = f'SELECT id, exam_id, question_id, taker FROM result WHERE {DUPLICATE_RESULTS} ' \
+            f'ORDER BY exam_id, question_id, taker, id'
+    if limit is not None:
+        query += f' LIMIT {int(limit)}'
+    return [tuple(row) for row in connection.execute(text(query))]
+
+
+def remove_duplicate_results(connection) -> int:
+    """
+    Removes the results uploaded more than once but the last uploaded one, and recalculates the
+    statistics of their questions from the remaining results. Returns the number of removed results.
+    """
+    if not inspect(connection).has_table('result'):
+        return 0
+
+    query = text(f'SELECT DISTINCT question_id FROM result WHERE {DUPLICATE_RESULTS}')
+    question_ids = list(connection.execute(query).scalars())
+    if not question_ids:
+        return 0
+    removed = connection.execute(text(f'DELETE FROM result WHERE {DUPLICATE_RESULTS}')).rowcount
+
+    if inspect(connection).has_table('question_statistics'):
+        # The moments are calculated by the database from the sums of the values and of their squares
+        sources = ['SELECT question_id, points, time FROM result']
+        if inspect(connection).has_table('result_archive'):
+            sources.append('SELECT question_id, points, time FROM result_archive')
+        parameters = {f'question_{i}': question_id for i, question_id in enumerate(question_ids)}
+        selected = ', '.join(f':{name}' for name in parameters)
+        connection.execute(text(f'DELETE FROM question_statistics WHERE question_id IN ({selected})'), parameters)
+        connection.execute(text(f"""
+            INSERT INTO question_statistics
+                (question_id, count, points_mean, points_m2, time_count, time_mean, time_m2)
+            SELECT
+                question_id,
+                count(points),
+                avg(1.0 * points),
+                sum(1.0 * points * points) - count(points) * avg(1.0 * points) * avg(1.0 * points),
+                count(time),
+                coalesce(avg(1.0 * time), 0),
+                coalesce(sum(1.0 * time * time) - count(time) * avg(1.0 * time) * avg(1.0 * time), 0)
+            FROM ({' UNION ALL '.join(sources)}) AS results
+            WHERE question_id IN ({selected})
+            GROUP BY question_id
+        """), parameters)
+
+    return removed
+
+
+def add_result_natural_key(connection):
+    """
+    Makes (exam_id, question_id, taker) unique in the results so that uploads can be applied as upserts.
+    The migration fails listing the results uploaded more than once, which are not removed here but with
+    flask --app app dedupe-results (which reports them first and removes them with --apply).
+    """
+    if not inspect(connection).has_table('result'):
+        return
+
+    duplicates = find_duplicate_results(connection, limit=MAX_REPORTED_ROWS)
+    if duplicates:
+        listed = ', '.join(
+            f"{row_id} (examen {exam_id}, pregunta {question_id}, alumno {taker})"
+            for row_id, exam_id, question_id, taker in duplicates
+        )
+        raise MigrationError(
+            f"Los resultados {listed} se subieron más de una vez y deben eliminarse antes de migrar "
+            f"(flask --app app dedupe-results)."
+        )
+
+    connection.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_result_exam_question_taker ON result (exam_id, question_id, taker)'
+    ))
+
+
+def add_version_stamps(connection):
+    """
+    Adds the version stamps of the questions and exams, from which the ETags of their routes are derived.
+    The existing rows are stamped with the time of the migration.
+    """
+    for table in ('question', 'exam'):
+        if not inspect(connection).has_table(table):
+            continue
+        columns = {column['name'] for column in inspect(connection).get_columns(table)}
+        if 'updated_at' in columns:
+            continue
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN updated_at TIMESTAMP'))
+        connection.execute(text(f'UPDATE "{table}" SET updated_at = :now'), {'now': datetime.now()})
+        if connection.dialect.name == 'postgresql':
+            # SQLite can not add the constraint to an existing column
+            connection.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN updated_at SET NOT NULL'))
+
+    if inspect(connection).has_table('question'):
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_question_subject_id_created_by_updated_at '
+            'ON question (subject_id, created_by, updated_at)'
+        ))
+
+
+def _drop_not_null(connection, table: str, column: str):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" DROP NOT NULL'))
+        return
+
+    # Databases without ALTER COLUMN (SQLite) get the table copied into a new one with the nullable column,
+    # which takes the name and the indexes of the old one
+    old_table = Table(table, MetaData(), autoload_with=connection)
+    if old_table.c[column].nullable:
+        return
+    indexes = inspect(connection).get_indexes(table)
+    new_table = old_table.to_metadata(old_table.metadata, name=f'{table}_new')
+    new_table.indexes.clear()
+    new_table.c[column].nullable = True
+
+    new_table.create(connection)
+    names = ', '.join(f'"{column.name}"' for column in new_table.columns)
+    connection.execute(text(f'INSERT INTO "{table}_new" ({names}) SELECT {names} FROM "{table}"'))
+    connection.execute(text(f'DROP TABLE "{table}"'))
+    connection.execute(text(f'ALTER TABLE "{table}_new" RENAME TO "{table}"'))
+    for index in indexes:
+        unique = 'UNIQUE ' if index['unique'] else ''
+        columns = ', '.join(f'"{name}"' for name in index['column_names'])
+        connection.execute(text(f'CREATE {unique}INDEX "{index["name"]}" ON "{table}" ({columns})'))
+
+
+def make_result_time_nullable(connection):
+    """
+    Allows results without time, which is not known for the results graded from answer sheets and was
+    stored as 0 until now. Those results can not be told apart from the ones uploaded with a time of 0,
+    so they are kept as they are.
+    """
+    for table in ('result', 'result_archive'):
+        if inspect(connection).has_table(table):
+            _drop_not_null(connection, table, 'time')
+
+
+# The migrations are applied in order and recorded in the schema_migrations table
+MIGRATIONS = [
+    ('0001', 'Convert result time and taker to integer columns', convert_result_columns_to_integer),
+    ('0002', 'Add indexes on result (exam_id, taker) and (question_id)', add_result_indexes),
+    ('0003', 'Add the chosen answer to the results', add_result_answer),
+    ('0004', 'Make (exam_id, question_id, taker) unique in the results', add_result_natural_key),
+    ('0005', 'Add version stamps to the questions and exams', add_version_stamps),
+    ('0006', 'Allow results without time', make_result_time_nullable),
+]
+
+
+def run_migrations(engine):
+    """
+    Applies the pending migrations in a single transaction. Tables created from the models already have
+    the current schema, so the migrations only change the tables of existing databases.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+
+        schema_migrations.create(connection, checkfirst=True)
+        applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+        for version, description, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            migration(connection)
+            connection.execute(
+                insert(schema_migrations),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
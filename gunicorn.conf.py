@@ -0,0 +1,81 @@
+"""
+Settings of gunicorn, which loads this file from the working directory (gunicorn wsgi:app). The sizing is
+taken from the environment:
+
+    WEB_WORKERS           worker processes (the number of CPUs by default)
+    WEB_THREADS           threads of each worker; with more than one, the gthread workers are used (4)
+    WEB_BIND              address to listen on (0.0.0.0:8000)
+    WEB_TIMEOUT           seconds a request can run before its worker is restarted (120)
+    WEB_GRACEFUL_TIMEOUT  seconds a stopping worker waits for its requests and export jobs (120)
+    WEB_MAX_REQUESTS      requests after which a worker is replaced, 0 to never replace them (0)
+    EXPORT_PROCESSES      processes of the export pool of each worker (the CPUs shared among the workers)
+    CACHE_ENABLED         response cache, on by default only with a single worker or a shared CACHE_URL
+    JOBS_DIR              directory where the report jobs are stored (a directory in the temporary one)
+
+The threads of a worker are safe since each request uses its own database sessions (create_db returns
+scoped sessions, removed when the request ends). The app is preloaded with the heavy libraries in the
+master, so the workers share those pages. The metrics
+and the slow query aggregates live in the worker that handled the request. The report jobs are rendered by
+the worker that started them and stored in JOBS_DIR, so any worker reports their progress and sends their
+files; when several hosts serve the API, JOBS_DIR has to be a directory shared by all of them.
+"""
+import multiprocessing
+import os
+import signal
+import time
+
+cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_WORKERS", cpus))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.environ.get("WEB_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 120))
+keepalive = 5
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+# The CPU-bound exports of every worker share the CPUs instead of each worker using all of them
+os.environ.setdefault("EXPORT_PROCESSES", str(max(1, cpus // workers)))
+
+# The workers only see each other's cache invalidations through a shared backend
+os.environ.setdefault("CACHE_ENABLED", "1" if workers == 1 or os.environ.get("CACHE_URL") else "0")
+
+preload_app = True
+os.environ.setdefault("PRELOAD_HEAVY_MODULES", "1")
+
+
+def post_fork(server, worker):
+    # The pooled connections opened by the master are not shared with the workers, which open their own
+    from db.versions.db import dispose_engines
+    dispose_engines()
+
+
+def post_worker_init(worker):
+    # The time of the SIGTERM is recorded, since the master kills the worker graceful_timeout seconds after it
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def record_exit(sig, frame):
+        if not hasattr(worker, 'exit_requested_at'):
+            worker.exit_requested_at = time.monotonic()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, record_exit)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_exit(server, worker):
+    # The requests have already been drained, so the export jobs are waited for during the rest of the
+    # graceful timeout (the whole of it if the worker exits by itself), keeping a second to shut down
+    from utils.jobs import wait_for_jobs
+    from utils.tracing import flush_spans
+    from utils.workers import shutdown_pools
+
+    requested_at = getattr(worker, 'exit_requested_at', None)
+    elapsed = time.monotonic() - requested_at if requested_at is not None else 0
+    pending = wait_for_jobs(graceful_timeout - elapsed - 1)
+    if pending:
+        worker.log.warning("%d export batches were not finished before the worker exited", pending)
+    shutdown_pools(wait=not pending)
+    flush_spans()
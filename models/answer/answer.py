@@ -7,6 +7,7 @@ from models.answer.answer_schema import AnswerSchema, AnswerListSchema
 from models.question import Question
 from models.question.question_schema import QuestionSchema, QuestionListSchema
 from models.user.user import User
+from utils.cache import invalidate, TAG_QUESTION
 from utils.utils import get_current_user_id
 
 
@@ -49,7 +50,9 @@ class Answer(Base):
         # The answer is created and added to the database
         new_answer = Answer(body=body, question_id=question_id, created_by=user_id, points=points)
         session.add(new_answer)
+        Question.touch(session, [question_id])
         session.commit()
+        invalidate(TAG_QUESTION.format(question_id))
         schema = AnswerSchema().dump(new_answer)
         return schema
 
@@ -1,17 +1,14 @@
+import io
 import random
+from concurrent.futures import as_completed
+from copy import copy
 from datetime import datetime, timedelta
-from odf.opendocument import OpenDocumentText
-from odf.text import H, P, Span
-from odf.style import Style, TextProperties, ParagraphProperties
 
-from xml.etree.ElementTree import Element, SubElement, tostring, ElementTree
+from xml.sax.saxutils import escape as xml_escape
 
-from reportlab.lib.enums import TA_RIGHT
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from flask import abort
-from sqlalchemy import Integer, String, ForeignKey, delete, and_, func, select, distinct, not_, DateTime, true
+from sqlalchemy import Integer, String, ForeignKey, delete, and_, or_, func, select, distinct, not_, DateTime, true, \
+    update
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, Mapped, mapped_column, joinedload, subqueryload
 from typing import Set, List
@@ -22,8 +19,34 @@ from models.question.question_schema import QuestionListSchema, QuestionSchema,
 from models.question_parameter.question_parameter_schema import QuestionParameterListSchema
 from models.subject.subject import Subject
 from models.user.user import User
-from utils.utils import get_current_user_id, replace_parameters
+from utils.cache import invalidate, TAG_EXAM, TAG_QUESTION
+from utils.question_formats import apply_parameters, question_parameter_values, answer_letter, aiken_question, \
+    gift_question, moodlexml_question, MOODLEXML_HEADER, MOODLEXML_FOOTER
+from utils.utils import get_current_user_id, get_academic_year
 from models.associations.associations import exam_question_association
+from utils.html_export import render_exam_html
+from utils.odt_writer import OdtWriter
+from utils.stream_utils import stream_zip
+from utils.workers import get_process_pool, get_process_pool_size, get_thread_pool
+
+# File name of each export format inside the bundles
+EXPORT_FILE_NAMES = {
+    'pdf': "exam_{id}.pdf",
+    'odt': "exam_{id}.odt",
+    'gift': "exam_{id}_gift.txt",
+    'aiken': "exam_{id}_aiken.txt",
+    'moodlexml': "exam_{id}_moodlexml.xml",
+    'html': "exam_{id}.html",
+}
+
+# Formats whose rendering is CPU-bound, so they are rendered in other processes
+CPU_BOUND_FORMATS = {'pdf', 'odt'}
+
+# Formats that can not represent every exam (Aiken needs a correct answer in every test question), so they
+# are rendered before the bundle is returned and the request fails if they reject the exam
+VALIDATED_FORMATS = {'aiken'}
+
+NAME_LINE = "Nombre y Apellidos: _______________________________________________________________"
 
 
 class Exam(Base):
@@ -34,6 +57,8 @@ class Exam(Base):
     title: Mapped[str] = mapped_column(String, nullable=False)
     subject_id: Mapped[int] = mapped_column(Integer, ForeignKey("subject.id"))
     created_on: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Version stamp of the exam, changed by every write that changes how it is returned (its questions included)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now)
 
     # Relaciones
     created: Mapped["User"] = relationship(back_populates="exams")
@@ -44,6 +69,10 @@ class Exam(Base):
         cascade="all, delete-orphan",
         passive_deletes=True
     )
+    archived_results: Mapped[Set["ResultArchive"]] = relationship(
+        back_populates="exam",
+        passive_deletes=True
+    )
 
     def __repr__(self):
         return "<Exam(id='%s', title='%s')>" % (self.id, self.title)
@@ -51,17 +80,21 @@ class Exam(Base):
     @hybrid_property
     def connected(self):
         """
-        Calculates if the exam has associated results.
+        Calculates if the exam has associated results (archived or not).
         """
-        return len(self.results) > 0
+        return len(self.results) > 0 or len(self.archived_results) > 0
 
     @connected.expression
     def connected(cls):
         """
-        SQLAlchemy expression to calculate if the exam has associated results.
+        SQLAlchemy expression to calculate if the exam has associated results (archived or not).
         """
         from models.result.result import Result
-        return select([func.count(Result.id)]).where(Result.exam_id == cls.id).label("connected") > 0
+        from models.result.result_archive import ResultArchive
+        return or_(
+            select(func.count(Result.id)).where(Result.exam_id == cls.id).scalar_subquery() > 0,
+            select(func.count(ResultArchive.id)).where(ResultArchive.exam_id == cls.id).scalar_subquery() > 0
+        )
 
     @hybrid_property
     def difficulty(self):
@@ -128,6 +161,30 @@ class Exam(Base):
             .scalar_subquery().label('question_number')
         )
 
+    @staticmethod
+    def touch(session, exam_ids):
+        """
+        Changes the version stamp of the exams. It is called before the changes are committed.
+        """
+        exam_ids = list(exam_ids)
+        if not exam_ids:
+            return
+        query = update(Exam).where(Exam.id.in_(exam_ids)).values(updated_at=datetime.now())
+        session.execute(query, execution_options={"synchronize_session": False})
+
+    @staticmethod
+    def get_exam_version(session, id: int):
+        """
+        Returns the version stamp of the current user's exam, or None if the user has no such exam.
+        """
+        query = select(Exam.updated_at).where(
+            and_(
+                Exam.id == id,
+                Exam.created_by == get_current_user_id()
+            )
+        )
+        return session.execute(query).scalar_one_or_none()
+
     @staticmethod
     def insert_exam(
             session,
@@ -188,6 +245,11 @@ class Exam(Base):
             session.execute(association)
             session.commit()
 
+        # The questions are now connected to an exam
+        Question.touch(session, [question['id'] for question in questions])
+        session.commit()
+        invalidate(*(TAG_QUESTION.format(question['id']) for question in questions))
+
         # The questions are added to the exam data
         for question in new_exam.questions:
             question_data = Question.get_full_question(session, question.id)
@@ -334,6 +396,7 @@ class Exam(Base):
 
         # The exam's title is changed
         exam.title = title
+        previous_question_ids = [question.id for question in exam.questions]
 
         # To be more general, all the old Exam-Question relations are deleted to add the new ones
         query = delete(exam_question_association).where(exam_question_association.c.exam_id == exam_id)
@@ -364,7 +427,13 @@ class Exam(Base):
                 group=group
             )
             session.execute(association)
+
+        # The exam and the questions that were or are now in it are changed, since their connection changed
+        question_ids = set(previous_question_ids) | {question['id'] for question in questions}
+        Exam.touch(session, [exam_id])
+        Question.touch(session, question_ids)
         session.commit()
+        invalidate(TAG_EXAM.format(exam_id), *(TAG_QUESTION.format(question_id) for question_id in question_ids))
 
         for question in exam.questions:
             question_data = Question.get_full_question(session, question.id)
@@ -385,12 +454,14 @@ class Exam(Base):
             repeat: bool = None,
             parametrized: bool = None,
             exclude_ids: list[int] = None,
+            empirical: bool = False,
             limit: int = None,
             offset: int = 0
     ) -> QuestionExtendedListSchema:
         from models.question.question import Question
         from models.associations.associations import node_question_association
         from models.question_parameter.question_parameter import QuestionParameter
+        from models.question_statistics.question_statistics import QuestionStatistics
 
         # The exam is checked to belong to the current user
         current_user_id = get_current_user_id()
@@ -413,13 +484,29 @@ class Exam(Base):
 
         questions = session.execute(query).scalars().all()
 
+        # In empirical mode, the difficulty and time measured from the results replace the authored ones
+        # for the questions that have enough results
+        statistics = {}
+        if empirical:
+            statistics = QuestionStatistics.get_statistics(session, {question.id for question in questions})
+
+        def get_difficulty(question):
+            question_statistics = statistics.get(question.id)
+            empirical_difficulty = question_statistics.empirical_difficulty if question_statistics else None
+            return empirical_difficulty if empirical_difficulty is not None else question.difficulty
+
+        def get_time(question):
+            question_statistics = statistics.get(question.id)
+            empirical_time = question_statistics.empirical_time if question_statistics else None
+            return empirical_time if empirical_time is not None else question.time
+
         # A key is created for each question to establish an ordering criteria
         def get_sort_key(question):
             parametrized_priority = getattr(question, 'parametrized', False) if parametrized else None
             parametrized_value = 0 if parametrized_priority else 1
             type_match = 0 if type and question.type in type else 1
-            time_diff = abs(question.time - time) if time is not None else 0
-            difficulty_diff = abs(question.difficulty - difficulty) if difficulty is not None else 0
+            time_diff = abs(get_time(question) - time) if time is not None else 0
+            difficulty_diff = abs(get_difficulty(question) - difficulty) if difficulty is not None else 0
             uses = getattr(question, 'uses', 0)
             random_value = random.random()
             return (
@@ -469,6 +556,7 @@ class Exam(Base):
     @staticmethod
     def delete_exam(session, exam_id: int):
         from models.associations.associations import exam_question_association
+        from models.question.question import Question
 
         # The exam is checked to belong to the current user
         query = select(Exam).where(Exam.id == exam_id)
@@ -481,15 +569,20 @@ class Exam(Base):
         if exam_data['connected'] == True:
             abort(401, "El examen tiene resultados asociados.")
 
-        # The Exam-Question associations are deleted
+        # The Exam-Question associations are deleted, and the questions are no longer connected to the exam
         query = delete(exam_question_association).where(exam_question_association.c.exam_id == exam_id)
         session.execute(query)
+        Question.touch(session, [question['id'] for question in exam_data['questions']['items']])
         session.commit()
 
         # The exam is deleted
         query = delete(Exam).where(Exam.id == exam_id)
         session.execute(query)
         session.commit()
+        invalidate(
+            TAG_EXAM.format(exam_id),
+            *(TAG_QUESTION.format(question['id']) for question in exam_data['questions']['items'])
+        )
 
 
     @staticmethod
@@ -503,63 +596,26 @@ class Exam(Base):
             abort(400, "El examen no ha sido encontrado.")
 
         exam_data = Exam.get_exam(session, exam_id)
-        questions = exam_data['questions']['items']
-        question_number = 0
 
         # The new file is opened
         with open(output_file, 'w', encoding='utf-8') as file:
-            for question in questions:
-                # Only the test questions are taken into consideration
-                if question['type'] == 'test':
-                    question_number += 1
-
-                    # The questions parameters (if any) are obtained
-                    raw_parameters = [{
-                        'value': param['value'], 'group': param['group']
-                    } for param in question.get('question_parameters', {}).get('items', [])]
-                    parameters = []
-
-                    # If there are parameters, the previously specified group is selected
-                    if raw_parameters != parameters:
-                        if question['group'] is not None:
-                            random_group = question['group']
-                        else:
-
-                            # If no group was specified, a random group is selected
-                            random_param = random.choice(raw_parameters)
-                            random_group = random_param['group']
-                        for param in raw_parameters:
-                            if param['group'] == random_group:
-                                parameters.append(param['value'])
-
-                        # The question title is replaced with the parameters' values if needed
-                        question_title = replace_parameters(question['title'], parameters)
-                    else:
-                        question_title = question['title']
-
-                    file.write(f"{question_title}\n")
-                    answer_letter = 'A'
-                    correct_answer_letter = None
-
-                    # Since the answers must have a question with 100% points, while the answers are written
-                    # the correct one is searched
-                    if 'answers' in question and question['type'] == 'test':
-                        answers = question['answers']['items']
-                        for answer in answers:
-                            if raw_parameters != parameters:
-                                # The answer content is replaced with the parameters' values if needed
-                                answer_body = replace_parameters(answer['body'], parameters)
-                            else:
-                                answer_body = answer['body']
-                            file.write(f"{answer_letter}. {answer_body}\n")
-                            if answer['points'] == 100:
-                                correct_answer_letter = answer_letter
-                            answer_letter = chr(ord(answer_letter) + 1)
-
-                        if not correct_answer_letter:
-                            raise ValueError(f"La pregunta con ID {question.id} no tiene una respuesta correcta definida.")
-
-                        file.write(f"ANSWER: {correct_answer_letter}\n\n")
+            Exam.write_exam_to_aiken(exam_data, file)
+
+    @staticmethod
+    def write_exam_to_aiken(exam_data, file):
+        for question in exam_data['questions']['items']:
+            # Only the test questions are taken into consideration
+            if question['type'] != 'test':
+                continue
+
+            # The parameters' values (if any) are replaced in the question and its answers
+            title, answers = Exam.format_question(question)
+
+            # Since the answers must have a question with 100% points, the ones without it can not be exported
+            text = aiken_question(title, answers)
+            if not text:
+                raise ValueError(f"La pregunta con ID {question['id']} no tiene una respuesta correcta definida.")
+            file.write(text)
 
     @staticmethod
     def export_exam_to_pdf(session, exam_id, output_file):
@@ -572,40 +628,40 @@ class Exam(Base):
 
         subject_data = Subject.get_subject(session, exam_data['subject_id'])
 
-        # The new file is created and opened
+        Exam.write_exam_to_pdf(exam_data, subject_data.name, output_file)
+
+    @staticmethod
+    def write_exam_to_pdf(exam_data, subject_name, output_file):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate
+
+        # The new file is created and opened (output_file can be a path or a binary stream)
         doc = SimpleDocTemplate(output_file, pagesize=letter)
-        styles = getSampleStyleSheet()
+        template = Exam.build_pdf_template(exam_data, subject_name)
+        doc.build(Exam.build_pdf_copy(template))
 
-        # Personalized styles are created
-        right_aligned_style = ParagraphStyle(
-            name='RightAligned',
-            parent=styles['Normal'],
-            alignment=TA_RIGHT
-        )
+    @staticmethod
+    def build_pdf_template(exam_data, subject_name) -> dict:
+        """
+        Builds the parts of the exam PDF that are the same in every copy: the heading, the section
+        titles and the questions that do not depend on a random parameter group.
+        """
+        from reportlab.platypus import Paragraph, Spacer
+        from utils.pdf_styles import get_pdf_styles
 
-        bold_style = ParagraphStyle(
-            name='Bold',
-            parent=styles['Normal'],
-            fontName='Helvetica-Bold'
-        )
+        styles = get_pdf_styles()
 
         # The heading is established
         exam_title = exam_data['title']
-        if exam_data['month'] >= 9:
-            year1 = exam_data['year']
-            year2 = exam_data['year'] + 1
-        else:
-            year1 = exam_data['year'] - 1
-            year2 = exam_data['year']
+        year1 = get_academic_year(datetime(exam_data['year'], exam_data['month'], 1))
+        year2 = year1 + 1
 
-        subject_name = subject_data.name
         header_text = f"{subject_name}   -   Curso {year1}-{year2}<br/>{exam_title}"
-        header = Paragraph(header_text, right_aligned_style)
-
-        name_line = Paragraph("Nombre y Apellidos: _______________________________________________________________", bold_style)
+        header = Paragraph(header_text, styles['right_aligned'])
 
-        # The actual content of the exam is established
-        content = [header, Spacer(1, 50), name_line, Spacer(1, 12)]
+        # The actual content of the exam is established, leaving the questions that change in each copy
+        # to be built later
+        blocks = []
         questions = exam_data['questions']['items']
         question_number = 0
         current_section = None
@@ -617,59 +673,105 @@ class Exam(Base):
             if section != current_section:
                 current_section = section
                 section_title = f"Sección {current_section}"
-                content.append(Paragraph(section_title, styles['Heading2']))
-                content.append(Spacer(1, 10))
-
-            # The questions parameters (if any) are obtained
-            raw_parameters = [{
-                'value': param['value'], 'group': param['group']
-            } for param in question.get('question_parameters', {}).get('items', [])]
-            parameters = []
-
-            # If there are parameters, the previously specified group is selected
-            if raw_parameters != parameters:
-                if question['group'] is not None:
-                    random_group = question['group']
-                else:
-
-                    # If no group was specified, a random group is selected
-                    random_param = random.choice(raw_parameters)
-                    random_group = random_param['group']
-                for param in raw_parameters:
-                    if param['group'] == random_group:
-                        parameters.append(param['value'])
-
-                # The question title is replaced with the parameters' values if needed
-                question_title = replace_parameters(question['title'], parameters)
+                blocks.append([Paragraph(section_title, styles['heading2']), Spacer(1, 10)])
+
+            if question.get('question_parameters', {}).get('items') and question['group'] is None:
+                blocks.append((question, question_number))
             else:
-                question_title = question['title']
-            question_text = f"<b>{question_number}. {question_title}</b><br/>"
-            content.append(Paragraph(question_text, styles['Normal']))
+                blocks.append(Exam.build_pdf_question(question, question_number, styles))
 
-            # The answers (if any and if needed) are added
-            if 'answers' in question and question['type'] == 'test':
-                answers = question['answers']['items']
-                answer_letter = 'A'
+        return {"header": header, "blocks": blocks, "styles": styles}
+
+    @staticmethod
+    def build_pdf_question(question, question_number: int, styles) -> list:
+        from reportlab.platypus import Paragraph, Spacer
+
+        # The parameters' values (if any) are replaced in the question and its answers
+        parameters = question_parameter_values(question)
+        question_title = apply_parameters(question['title'], parameters)
+        question_text = f"<b>{question_number}. {question_title}</b><br/>"
+        content = [Paragraph(question_text, styles['normal'])]
 
-                for answer in answers:
+        # The answers (if any and if needed) are added
+        if 'answers' in question and question['type'] == 'test':
+            answers = question['answers']['items']
 
-                    # The answer content is replaced with the parameters' values if needed
-                    if raw_parameters != parameters:
-                        answer_body = replace_parameters(answer['body'], parameters)
-                    else:
-                        answer_body = answer['body']
-                    answer_body = answer_letter + '. ' + answer_body
-                    content.append(Paragraph(answer_body, styles['Normal']))
-                    answer_letter = chr(ord(answer_letter) + 1)
-            content.append(Spacer(1, 12))
-            content.append(Spacer(1, 12))
+            for position, answer in enumerate(answers):
 
-        doc.build(content)
+                answer_body = answer_letter(position) + '. ' + apply_parameters(answer['body'], parameters)
+                content.append(Paragraph(answer_body, styles['normal']))
+        content.append(Spacer(1, 12))
+        content.append(Spacer(1, 12))
+        return content
 
     @staticmethod
-    def export_exam_to_gift(session, exam_id: int, output_file: str):
-        from models.answer.answer import Answer
+    def build_pdf_copy(template: dict, student_name: str = None) -> list:
+        """
+        Returns the flowables of one copy of the exam. The shared paragraphs are already parsed,
+        so they are only copied (reportlab keeps layout state in each flowable).
+        """
+        from reportlab.platypus import Paragraph, Spacer
+
+        styles = template['styles']
+        if student_name:
+            name_line = Paragraph(f"Nombre y Apellidos: {xml_escape(student_name)}", styles['bold'])
+        else:
+            name_line = Paragraph(NAME_LINE, styles['bold'])
 
+        content = [copy(template['header']), Spacer(1, 50), name_line, Spacer(1, 12)]
+        for block in template['blocks']:
+            if isinstance(block, tuple):
+                question, question_number = block
+                content.extend(Exam.build_pdf_question(question, question_number, styles))
+            else:
+                content.extend(copy(flowable) for flowable in block)
+        return content
+
+    @staticmethod
+    def render_pdf_copies(exam_data, subject_name, copies: list, separate: bool = False):
+        """
+        Renders the given copies, a list of (copy number, student name) tuples, in this process.
+        Returns a list of (file name, bytes) tuples if every copy is a separate file, or the bytes
+        of a single PDF with every copy otherwise.
+        """
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, PageBreak
+
+        template = Exam.build_pdf_template(exam_data, subject_name)
+
+        if separate:
+            files = []
+            for copy_number, student_name in copies:
+                output = io.BytesIO()
+                SimpleDocTemplate(output, pagesize=letter).build(Exam.build_pdf_copy(template, student_name))
+                files.append((f"exam_{exam_data['id']}_{copy_number:04d}.pdf", output.getvalue()))
+            return files
+
+        # Every copy starts on a new page
+        content = []
+        for copy_number, student_name in copies:
+            if content:
+                content.append(PageBreak())
+            content.extend(Exam.build_pdf_copy(template, student_name))
+        output = io.BytesIO()
+        SimpleDocTemplate(output, pagesize=letter).build(content)
+        return output.getvalue()
+
+    @staticmethod
+    def export_exam_print_run(
+            session,
+            exam_id: int,
+            copies: int = None,
+            student_names: List[str] = None,
+            separate: bool = False,
+            variants: bool = False,
+            processes: int = None
+    ):
+        """
+        Renders several copies of the exam, one per student name (or the given number of copies).
+        Returns the bytes of a single PDF, or a generator that yields a ZIP file with one PDF per copy
+        if separate is given. In that case the copies are split among several processes.
+        """
         # The exam is checked to belong to the current user
         user_id = get_current_user_id()
         exam = session.query(Exam).filter(and_(Exam.id == exam_id, Exam.created_by == user_id)).one_or_none()
@@ -678,58 +780,64 @@ class Exam(Base):
             abort(400, "El examen no ha sido encontrado.")
 
         exam_data = Exam.get_exam(session, exam_id)
+        subject_name = session.query(Subject.name).filter(Subject.id == exam_data['subject_id']).scalar()
+
+        # Unless every copy should be a different version, the parameter groups are chosen once
+        if not variants:
+            for question in exam_data['questions']['items']:
+                parameters = question.get('question_parameters', {}).get('items', [])
+                if parameters and question.get('group') is None:
+                    question['group'] = random.choice(parameters)['group']
+
+        names = student_names if student_names else [None] * (copies or 1)
+        numbered_copies = list(enumerate(names, 1))
+        pool = get_process_pool()
+
+        if not separate:
+            return pool.submit(Exam.render_pdf_copies, exam_data, subject_name, numbered_copies).result()
+
+        # The copies are split in one chunk per process
+        processes = max(1, min(processes or get_process_pool_size(), len(numbered_copies)))
+        chunk_size = -(-len(numbered_copies) // processes)
+        futures = [
+            pool.submit(Exam.render_pdf_copies, exam_data, subject_name, numbered_copies[i:i + chunk_size], True)
+            for i in range(0, len(numbered_copies), chunk_size)
+        ]
+
+        def parts():
+            try:
+                for future in as_completed(futures):
+                    yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return stream_zip(parts())
 
-        questions = exam_data['questions']['items']
-        question_number = 0
+    @staticmethod
+    def export_exam_to_gift(session, exam_id: int, output_file: str):
 
-        # The new file is opened
-        with open(output_file, 'w', encoding='utf-8') as file:
-            for question in questions:
-                question_number += 1
+        # The exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        exam = session.query(Exam).filter(and_(Exam.id == exam_id, Exam.created_by == user_id)).one_or_none()
+
+        if not exam:
+            abort(400, "El examen no ha sido encontrado.")
 
-                # The questions parameters (if any) are obtained
-                raw_parameters = [{
-                    'value': param['value'], 'group': param['group']
-                } for param in question.get('question_parameters', {}).get('items', [])]
-                parameters = []
-
-                # If there are parameters, the previously specified group is selected
-                if raw_parameters != parameters:
-                    if question['group'] is not None:
-                        random_group = question['group']
-                    else:
-
-                        # If no group was specified, a random group is selected
-                        random_param = random.choice(raw_parameters)
-                        random_group = random_param['group']
-                    for param in raw_parameters:
-                        if param['group'] == random_group:
-                            parameters.append(param['value'])
-
-                    # The question title is replaced with the parameters' values if needed
-                    question_title = replace_parameters(question['title'], parameters)
-                else:
-                    question_title = question['title']
-
-                # The title is added to the file
-                file.write(f"::Question {question['id']}::{question_title} {{\n")
+        exam_data = Exam.get_exam(session, exam_id)
 
-                # The answers (if any and if needed) are added
-                if 'answers' in question and question['type'] == 'test':
-                    answers = question['answers']['items']
-                    for answer in answers:
-                        # The answer content is replaced with the parameters' values if needed
-                        if raw_parameters != parameters:
-                            answer_body = replace_parameters(answer['body'], parameters)
-                        else:
-                            answer_body = answer['body']
-                        file.write(f"~%{answer['points']}%{answer_body}\n")
+        # The new file is opened
+        with open(output_file, 'w', encoding='utf-8') as file:
+            Exam.write_exam_to_gift(exam_data, file)
 
-                file.write("}\n\n")
+    @staticmethod
+    def write_exam_to_gift(exam_data, file):
+        for question in exam_data['questions']['items']:
+            title, answers = Exam.format_question(question)
+            file.write(gift_question(f"Question {question['id']}", title, question['type'], answers, escape=False))
 
     @staticmethod
     def export_exam_to_moodlexml(session, exam_id: int, output_file: str):
-        from xml.etree.ElementTree import Element, SubElement, tostring, ElementTree
         # The exam is checked to belong to the current user
         user_id = get_current_user_id()
         exam = session.query(Exam).filter(and_(Exam.id == exam_id, Exam.created_by == user_id)).one_or_none()
@@ -738,73 +846,39 @@ class Exam(Base):
             abort(400, "El examen no ha sido encontrado.")
 
         exam_data = Exam.get_exam(session, exam_id)
-        questions = exam_data['questions']['items']
-
-        # A new quiz element is created
-        quiz = Element('quiz')
 
-        for question in questions:
-
-            # The questions parameters (if any) are obtained
-            raw_parameters = [{
-                'value': param['value'], 'group': param['group']
-            } for param in question.get('question_parameters', {}).get('items', [])]
-            parameters = []
-
-            # If there are parameters, the previously specified group is selected
-            if raw_parameters != parameters:
-                if question['group'] is not None:
-                    random_group = question['group']
-                else:
-
-                    # If no group was specified, a random group is selected
-                    random_param = random.choice(raw_parameters)
-                    random_group = random_param['group']
-                for param in raw_parameters:
-                    if param['group'] == random_group:
-                        parameters.append(param['value'])
-
-                # The question title is replaced with the parameters' values if needed
-                question_title = replace_parameters(question['title'], parameters)
-            else:
-                question_title = question['title']
-
-            # The type of the question is added
-            if question['type'] == 'test':
-                question_element = SubElement(quiz, 'question', type='multichoice')
-            else:
-                question_element = SubElement(quiz, 'question', type='essay')
-
-            # The title is added to the question
-            name = SubElement(question_element, 'name')
-            text = SubElement(name, 'text')
-            text.text = question_title
-
-            question_text = SubElement(question_element, 'questiontext', format='html')
-            text = SubElement(question_text, 'text')
-            text.text = question['title']
-
-            # The answers (if any and if needed) are added
-            if 'answers' in question and question['type'] == 'test':
-                for answer in question['answers']['items']:
-
-                    # The answer content is replaced with the parameters' values if needed
-                    if raw_parameters != parameters:
-                        answer_body = replace_parameters(answer['body'], parameters)
-                    else:
-                        answer_body = answer['body']
-                    answer_element = SubElement(question_element, 'answer', fraction=str(int(answer['points'] )))
-                    text = SubElement(answer_element, 'text')
-                    text.text = answer_body
-            else:
-                answer_element = SubElement(question_element, 'answer', fraction='0')
-                text = SubElement(answer_element, 'text')
-                text.text = ''
+        Exam.write_exam_to_moodlexml(exam_data, output_file)
 
-        tree = ElementTree(quiz)
+    @staticmethod
+    def write_exam_to_moodlexml(exam_data, output_file):
+        questions = []
+        for question in exam_data['questions']['items']:
+            # The title of the question is also used as its name
+            title, answers = Exam.format_question(question)
+            questions.append(moodlexml_question(title, title, question['type'], answers))
+        content = MOODLEXML_HEADER + ''.join(questions) + MOODLEXML_FOOTER
+
+        # The quiz is written to a new file (output_file can be a path or a binary stream)
+        if isinstance(output_file, str):
+            with open(output_file, 'w', encoding='utf-8') as file:
+                file.write(content)
+        else:
+            output_file.write(content.encode('utf-8'))
 
-        # A file is created and the quiz is added to it
-        tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    @staticmethod
+    def format_question(question):
+        """
+        Returns the title and the answers (as (body, points) tuples, only for test questions) of a question of
+        the exam, with the parameters' values (if any) replaced in them.
+        """
+        parameters = question_parameter_values(question)
+        answers = []
+        if question['type'] == 'test':
+            answers = [
+                (apply_parameters(answer['body'], parameters), answer['points'])
+                for answer in question['answers']['items']
+            ]
+        return apply_parameters(question['title'], parameters), answers
 
     @staticmethod
     def export_exam_to_odt(session, exam_id: int, output_file: str):
@@ -819,130 +893,198 @@ class Exam(Base):
         exam_data = Exam.get_exam(session, exam_id)
         subject_data = session.query(Subject).filter(Subject.id == exam_data['subject_id']).one()
 
+        Exam.write_exam_to_odt(exam_data, subject_data.name, output_file)
+
+    @staticmethod
+    def write_exam_to_odt(exam_data, subject_name, output_file):
+        """
+        Writes the exam as an ODT document, streaming its content directly into the ZIP file.
+        """
         questions = exam_data['questions']['items']
 
+        # The heading is established
+        exam_title = exam_data['title']
+        year1 = get_academic_year(datetime(exam_data['year'], exam_data['month'], 1))
+        year2 = year1 + 1
+        header_text = f"{subject_name} - Curso {year1}-{year2}"
+        name_line = "Nombre y Apellidos: _________________________________________________________________"
+
         # The new file is created
-        doc = OpenDocumentText()
+        with OdtWriter(output_file) as doc:
+            doc.paragraph(header_text, style="SmallRightAlign", span_style="Bold")
+            doc.paragraph(exam_title, style="SmallRightAlign", span_style="Bold")
+            doc.paragraph()
+            doc.paragraph()
+            doc.paragraph(name_line, style="SmallRightAlign", span_style="Bold")
+            doc.paragraph()
+
+            # The actual content of the exam is established
+            question_number = 0
+            current_section = None
 
-        # Personalized styles are created
-        h1_style = Style(name="Heading1", family="paragraph")
-        h1_style.addElement(TextProperties(attributes={'fontsize': "24pt", 'fontweight': "bold"}))
-        doc.styles.addElement(h1_style)
+            for question in questions:
+                question_number += 1
 
-        h2_style = Style(name="Heading2", family="paragraph")
-        h2_style.addElement(TextProperties(attributes={'fontsize': "18pt", 'fontweight': "bold"}))
-        doc.styles.addElement(h2_style)
+                section = question.get('section_number')
 
-        p_style = Style(name="Paragraph", family="paragraph")
-        p_style.addElement(TextProperties(attributes={'fontsize': "12pt"}))
-        doc.styles.addElement(p_style)
+                # If a new section, a line saying so is added
+                if section != current_section:
+                    current_section = section
+                    doc.heading(f"Sección {current_section}", level=2, style="Heading2")
+                    doc.paragraph()
 
-        bold_style = Style(name="Bold", family="text")
-        bold_style.addElement(TextProperties(fontweight="bold"))
-        doc.styles.addElement(bold_style)
+                # The parameters' values (if any) are replaced in the question and its answers
+                parameters = question_parameter_values(question)
+                question_title = apply_parameters(question['title'], parameters)
 
-        small_right_align_style = Style(name="SmallRightAlign", family="paragraph")
-        small_right_align_style.addElement(TextProperties(attributes={'fontsize': "10pt"}))
-        small_right_align_style.addElement(ParagraphProperties(attributes={'textalign': "right"}))
-        doc.styles.addElement(small_right_align_style)
+                # The question title is added to the document
+                doc.paragraph(f"{question_number}. {question_title}", style="Paragraph")
 
-        # The heading is established
-        exam_title = exam_data['title']
-        if exam_data['month'] >= 9:
-            year1 = exam_data['year']
-            year2 = exam_data['year'] + 1
-        else:
-            year1 = exam_data['year'] - 1
-            year2 = exam_data['year']
-        subject_name = subject_data.name
-        header_text = f"{subject_name} - Curso {year1}-{year2}"
-        name_line = "Nombre y Apellidos: _________________________________________________________________"
-        exam_line = f"{exam_title}"
+                # The answers (if any and if needed) are added
+                if 'answers' in question and question['type'] == 'test':
+                    answers = question['answers']['items']
+                    for position, answer in enumerate(answers):
 
-        header_p = P(stylename=small_right_align_style)
-        header_p.addElement(Span(text=header_text, stylename=bold_style))
-        doc.text.addElement(header_p)
+                        # The answer content is added to the document
+                        answer_body = apply_parameters(answer['body'], parameters)
+                        doc.paragraph(f"{answer_letter(position)}. {answer_body}", style="Paragraph")
+                doc.paragraph()
+
+    @staticmethod
+    def export_exam_to_html(session, exam_id: int, answer_key: bool = False) -> str:
+
+        # The exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        exam = session.query(Exam).filter(and_(Exam.id == exam_id, Exam.created_by == user_id)).one_or_none()
 
-        exam_p = P(stylename=small_right_align_style)
-        exam_p.addElement(Span(text=exam_line, stylename=bold_style))
-        doc.text.addElement(exam_p)
+        if not exam:
+            abort(400, "El examen no ha sido encontrado.")
 
-        doc.text.addElement(P(text=""))
-        doc.text.addElement(P(text=""))
+        exam_data = Exam.get_exam(session, exam_id)
+        subject_name = session.query(Subject.name).filter(Subject.id == exam_data['subject_id']).scalar()
 
-        name_p = P(stylename=small_right_align_style)
-        name_p.addElement(Span(text=name_line, stylename=bold_style))
-        doc.text.addElement(name_p)
+        file = io.StringIO()
+        Exam.write_exam_to_html(exam_data, subject_name, file, answer_key)
+        return file.getvalue()
 
-        doc.text.addElement(P(text=""))
+    @staticmethod
+    def write_exam_to_html(exam_data, subject_name, file, answer_key: bool = False):
+        # The academic year of the exam is established
+        year = get_academic_year(datetime(exam_data['year'], exam_data['month'], 1))
+        course = f"{year}-{year + 1}"
 
-        # The actual content of the exam is established
+        # The questions are grouped by section, with their parameters already replaced
+        sections = []
         question_number = 0
-        current_section = None
-
-        for question in questions:
+        for question in exam_data['questions']['items']:
             question_number += 1
+            if not sections or sections[-1]['number'] != question['section_number']:
+                sections.append({"number": question['section_number'], "questions": []})
 
-            section = question.get('section_number')
+            parameters = question_parameter_values(question)
 
-            # If a new section, a line saying so is added
-            if section != current_section:
-                current_section = section
-                section_title = f"Sección {current_section}"
-                h2 = H(outlinelevel=2, stylename=h2_style, text=section_title)
-                doc.text.addElement(h2)
-                doc.text.addElement(P(text=""))
-
-            # The questions parameters (if any) are obtained
-            raw_parameters = [{
-                'value': param['value'], 'group': param['group']
-            } for param in question.get('question_parameters', {}).get('items', [])]
-            parameters = []
-
-            # If there are parameters, the previously specified group is selected
-            if raw_parameters != parameters:
-                if question['group'] is not None:
-                    random_group = question['group']
-                else:
-
-                    # If no group was specified, a random group is selected
-                    random_param = random.choice(raw_parameters)
-                    random_group = random_param['group']
-                for param in raw_parameters:
-                    if param['group'] == random_group:
-                        parameters.append(param['value'])
-
-                # The question title is replaced with the parameters' values if needed
-                question_title = replace_parameters(question['title'], parameters)
+            answers = []
+            if 'answers' in question and question['type'] == 'test':
+                for position, answer in enumerate(question['answers']['items']):
+                    answers.append({
+                        "letter": answer_letter(position),
+                        "body": apply_parameters(answer['body'], parameters),
+                        "points": answer['points'],
+                        "correct": answer['points'] == 100,
+                    })
+
+            sections[-1]['questions'].append({
+                "number": question_number,
+                "title": apply_parameters(question['title'], parameters),
+                "answers": answers,
+                "correct_letters": [answer['letter'] for answer in answers if answer['correct']],
+            })
+
+        exam = {"title": exam_data['title'], "course": course}
+        file.write(render_exam_html(exam, subject_name, sections, answer_key))
+
+    @staticmethod
+    def render_exam(exam_data, subject_name, format: str) -> bytes:
+        """
+        Renders already loaded exam data in the given format and returns the file content.
+        """
+        if format in ('aiken', 'gift', 'html'):
+            file = io.StringIO()
+            if format == 'aiken':
+                Exam.write_exam_to_aiken(exam_data, file)
+            elif format == 'gift':
+                Exam.write_exam_to_gift(exam_data, file)
             else:
-                question_title = question['title']
+                Exam.write_exam_to_html(exam_data, subject_name, file)
+            return file.getvalue().encode('utf-8')
+
+        file = io.BytesIO()
+        if format == 'pdf':
+            Exam.write_exam_to_pdf(exam_data, subject_name, file)
+        elif format == 'odt':
+            Exam.write_exam_to_odt(exam_data, subject_name, file)
+        elif format == 'moodlexml':
+            Exam.write_exam_to_moodlexml(exam_data, file)
+        else:
+            raise ValueError(f"El formato {format} no está soportado.")
+        return file.getvalue()
 
-            # The question title is added to the document
-            question_text = f"{question_number}. {question_title}"
-            p = P(stylename=p_style, text=question_text)
-            doc.text.addElement(p)
+    @staticmethod
+    def export_exam_bundle(session, exam_id: int, formats: List[str]):
+        """
+        Loads the exam once and returns a generator that yields a ZIP archive with the exam
+        in every requested format. The formats are rendered concurrently and each one is added
+        to the archive as soon as it is ready, or replaced by a file with the error if it fails.
+        """
+        # The exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        exam = session.query(Exam).filter(and_(Exam.id == exam_id, Exam.created_by == user_id)).one_or_none()
 
-            # The answers (if any and if needed) are added
-            if 'answers' in question and question['type'] == 'test':
-                answers = question['answers']['items']
-                answer_letter = 'A'
-                for answer in answers:
-
-                    # The answer content is replaced with the parameters' values if needed
-                    if raw_parameters != parameters:
-                        answer_body = replace_parameters(answer['body'], parameters)
-                    else:
-                        answer_body = answer['body']
-
-                    # The answer content is added to the document
-                    answer_text = f"{answer_letter}. {answer_body}"
-                    p = P(stylename=p_style, text=answer_text)
-                    doc.text.addElement(p)
-                    answer_letter = chr(ord(answer_letter) + 1)
-            doc.text.addElement(P(text=""))
-
-        # The document is saved
-        doc.save(output_file)
+        if not exam:
+            abort(400, "El examen no ha sido encontrado.")
+
+        exam_data = Exam.get_exam(session, exam_id)
+        subject_name = session.query(Subject.name).filter(Subject.id == exam_data['subject_id']).scalar()
+
+        # The parameter groups are chosen once, so every format shows the same version of the exam
+        for question in exam_data['questions']['items']:
+            parameters = question.get('question_parameters', {}).get('items', [])
+            if parameters and question.get('group') is None:
+                question['group'] = random.choice(parameters)['group']
+
+        # The formats that can reject the exam are rendered first, so that a ValueError is raised before
+        # any other format is rendered and the download starts
+        formats = list(dict.fromkeys(formats))
+        rendered = [
+            (EXPORT_FILE_NAMES[format].format(id=exam_id), Exam.render_exam(exam_data, subject_name, format))
+            for format in formats if format in VALIDATED_FORMATS
+        ]
+
+        futures = {}
+        for format in formats:
+            if format in VALIDATED_FORMATS:
+                continue
+            pool = get_process_pool() if format in CPU_BOUND_FORMATS else get_thread_pool()
+            future = pool.submit(Exam.render_exam, exam_data, subject_name, format)
+            futures[future] = EXPORT_FILE_NAMES[format].format(id=exam_id)
+
+        def parts():
+            yield from rendered
+            try:
+                for future in as_completed(futures):
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        # The archive gets the reason of the failed format instead of being cut
+                        yield f"{futures[future]}.ERROR.txt", f"No se ha podido exportar: {e}".encode('utf-8')
+                        continue
+                    yield futures[future], content
+            finally:
+                # If the download is interrupted, the pending formats are not rendered
+                for future in futures:
+                    future.cancel()
+
+        return stream_zip(parts())
 
     @staticmethod
     def get_exam_questions(session, subject_id: int, exam_ids: list[int]):
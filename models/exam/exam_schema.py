@@ -1,4 +1,5 @@
-from marshmallow import Schema, fields, post_dump, EXCLUDE
+from marshmallow import Schema, fields, post_dump, EXCLUDE, validate
+from webargs.fields import DelimitedList
 from models.question.question_schema import FullQuestionListSchema
 
 class ExamSchema(Schema):
@@ -43,6 +44,7 @@ class SectionSchema(Schema):
     repeat = fields.Boolean()
     parametrized = fields.Boolean()
     exclude_ids = fields.List(fields.Integer())
+    empirical = fields.Boolean(load_default=False)
     class Meta:
         unknown = EXCLUDE
 
@@ -58,3 +60,25 @@ class ExamListSchema(Schema):
 class CompareExamsSchema(Schema):
     subject_id = fields.Integer()
     exam_ids = fields.List(fields.Integer())
+
+class ExamBundleSchema(Schema):
+    formats = DelimitedList(
+        fields.String(validate=validate.OneOf(['pdf', 'odt', 'gift', 'aiken', 'moodlexml', 'html'])),
+        required=True
+    )
+    class Meta:
+        unknown = EXCLUDE
+
+class PrintRunSchema(Schema):
+    copies = fields.Integer(validate=validate.Range(min=1, max=1000), load_default=1)
+    student_names = fields.List(fields.String(), validate=validate.Length(max=1000), load_default=None)
+    separate = fields.Boolean(load_default=False)
+    variants = fields.Boolean(load_default=False)
+    processes = fields.Integer(validate=validate.Range(min=1), load_default=None)
+    class Meta:
+        unknown = EXCLUDE
+
+class HtmlExportSchema(Schema):
+    answer_key = fields.Boolean(load_default=False)
+    class Meta:
+        unknown = EXCLUDE
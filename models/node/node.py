@@ -9,6 +9,7 @@ from models.node.node_schema import NodeSchema, NodeListSchema
 from models.question.question_schema import FullQuestionListSchema
 from models.subject.subject import Subject
 from models.user.user import User
+from utils.cache import invalidate, TAG_QUESTION, TAG_SUBJECT_NODES
 from utils.utils import get_current_user_id
 from models.associations.associations import node_question_association
 
@@ -106,6 +107,7 @@ class Node(Base):
         new_node = Node(name=name, subject_id=subject_id, created_by=user_id, parent_id=parent_id)
         session.add(new_node)
         session.commit()
+        invalidate(TAG_SUBJECT_NODES.format(subject_id))
         schema = NodeSchema().dump(new_node)
         return schema
 
@@ -162,7 +164,11 @@ class Node(Base):
             query = query.limit(limit)
         items = session.execute(query).scalars().all()
 
-        total = session.query(Node).count()
+        # Only the subject's nodes are counted, so that the cached list does not depend on other subjects
+        total = session.query(Node).filter(
+            Node.created_by == current_user_id,
+            Node.subject_id == subject_id
+        ).count()
 
         schema = NodeListSchema()
         return schema.dump({"items": items, "total": total})
@@ -186,6 +192,7 @@ class Node(Base):
         res[0].name = name
 
         session.commit()
+        invalidate(TAG_SUBJECT_NODES.format(res[0].subject_id))
 
         schema = NodeSchema().dump(res[0])
 
@@ -204,7 +211,16 @@ class Node(Base):
         if res[0].created_by != current_user_id:
             abort(401, "No tienes acceso a este recurso.")
 
-        # The node is deleted from the database
+        # The node is deleted from the database, and its questions change since they no longer list it
+        from models.question.question import Question
+        subject_id = res[0].subject_id
+        query = select(node_question_association.c.question_id).where(node_question_association.c.node_id == id)
+        question_ids = session.execute(query).scalars().all()
         query = delete(Node).where(Node.id == id)
         session.execute(query)
+        Question.touch(session, question_ids)
         session.commit()
+        invalidate(
+            TAG_SUBJECT_NODES.format(subject_id),
+            *(TAG_QUESTION.format(question_id) for question_id in question_ids)
+        )
@@ -1,9 +1,10 @@
+from datetime import datetime
 from enum import Enum
-import pandas as pd
 import re
 
 from flask import abort
-from sqlalchemy import Integer, String, select, ForeignKey, delete, and_, CheckConstraint, Boolean, func
+from sqlalchemy import Integer, String, select, ForeignKey, delete, and_, CheckConstraint, Boolean, func, DateTime, \
+    Index, update
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from typing import Set, List
@@ -15,6 +16,7 @@ from models.question.question_schema import QuestionListSchema, FullQuestionSche
     FullQuestionListSchema
 from models.subject.subject import Subject
 from models.user.user import User
+from utils.cache import invalidate, TAG_QUESTION, TAG_SUBJECT_QUESTIONS
 from utils.utils import get_current_user_id
 from models.associations.associations import node_question_association, exam_question_association
 
@@ -36,7 +38,13 @@ class Question(Base):
     active: Mapped[bool] = mapped_column(Boolean, nullable=False)
     subject_id: Mapped[int] = mapped_column(Integer, ForeignKey("subject.id"))
     type: Mapped[str] = mapped_column(String, CheckConstraint("type IN ('test', 'desarrollo')"), nullable=False)
+    # Version stamp of the question, changed by every write that changes how it is returned
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now)
 
+    # The version of the questions of a subject is read from this index alone
+    __table_args__ = (
+        Index('ix_question_subject_id_created_by_updated_at', 'subject_id', 'created_by', 'updated_at'),
+    )
 
 
     # Relaciones
@@ -79,6 +87,39 @@ class Question(Base):
             exam_question_association.c.question_id == cls.id).label("connected") > 0
 
 
+    @staticmethod
+    def touch(session, question_ids):
+        """
+        Changes the version stamp of the questions and of the exams that contain them, which return the
+        questions as well. It is called before the changes are committed.
+        """
+        from models.exam.exam import Exam
+        question_ids = list(question_ids)
+        if not question_ids:
+            return
+        now = datetime.now()
+        query = update(Question).where(Question.id.in_(question_ids)).values(updated_at=now)
+        session.execute(query, execution_options={"synchronize_session": False})
+        exam_ids = select(exam_question_association.c.exam_id).where(
+            exam_question_association.c.question_id.in_(question_ids)
+        )
+        query = update(Exam).where(Exam.id.in_(exam_ids)).values(updated_at=now)
+        session.execute(query, execution_options={"synchronize_session": False})
+
+    @staticmethod
+    def get_subject_questions_version(session, subject_id: int):
+        """
+        Returns the version of the current user's questions of the subject: the last time one of them
+        changed and their number, which changes when one is deleted.
+        """
+        query = select(func.max(Question.updated_at), func.count(Question.id)).where(
+            and_(
+                Question.subject_id == subject_id,
+                Question.created_by == get_current_user_id()
+            )
+        )
+        return tuple(session.execute(query).one())
+
     @staticmethod
     def get_answers_for_question(session, question_id: int, limit: int = None, offset: int = 0) -> AnswerListSchema:
         from models.answer.answer import Answer
@@ -153,6 +194,7 @@ class Question(Base):
         # The question (and its associations) are added to the database
         session.add(new_question)
         session.commit()
+        invalidate(TAG_SUBJECT_QUESTIONS.format(subject_id))
 
         # The answers (if any) are added to the database 
         for answer_data in answers:
@@ -215,6 +257,7 @@ class Question(Base):
     ) -> None:
         from models.answer.answer import Answer
         from models.question_parameter.question_parameter import QuestionParameter
+        from models.question_statistics.question_statistics import QuestionStatistics
         from models.associations.associations import node_question_association
         query = select(Question).where(Question.id == id)
         res = session.execute(query).first()
@@ -243,10 +286,17 @@ class Question(Base):
         session.execute(query)
         session.commit()
 
+        # The question's statistics (if any) are deleted
+        query = delete(QuestionStatistics).where(QuestionStatistics.question_id == id)
+        session.execute(query)
+        session.commit()
+
         # The question is deleted
+        subject_id = res[0].subject_id
         query = delete(Question).where(Question.id == id)
         session.execute(query)
         session.commit()
+        invalidate(TAG_QUESTION.format(id), TAG_SUBJECT_QUESTIONS.format(subject_id))
 
     @staticmethod
     def get_user_questions(session, limit: int = None, offset: int = 0) -> QuestionListSchema:
@@ -276,7 +326,11 @@ class Question(Base):
             query = query.limit(limit)
         items = session.execute(query).scalars().all()
 
-        total = session.query(Question).count()
+        # Only the subject's questions are counted, so that the total follows the version of the list
+        total = session.query(Question).filter(
+            Question.created_by == current_user_id,
+            Question.subject_id == subject_id
+        ).count()
 
         schema = QuestionListSchema()
         return schema.dump({"items": items, "total": total})
@@ -303,7 +357,7 @@ class Question(Base):
         query = select(Answer).where(Answer.question_id == id)
         items = session.execute(query).scalars().all()
 
-        total = session.query(Answer).count()
+        total = len(items)
 
         answers = AnswerListSchema()
         answers = answers.dump({"items": items, "total": total})
@@ -312,7 +366,7 @@ class Question(Base):
         query = select(QuestionParameter).where(QuestionParameter.question_id == id).order_by(QuestionParameter.group, QuestionParameter.position)
         items2 = session.execute(query).scalars().all()
 
-        total2 = session.query(QuestionParameter).count()
+        total2 = len(items2)
 
         # The related nodes are added
         query = select(Node.id).join(node_question_association).where(node_question_association.c.question_id == id)
@@ -358,9 +412,10 @@ class Question(Base):
             abort(418, "La pregunta ya estaba desactivada")
 
         res[0].active = False
+        Question.touch(session, [id])
 
         session.commit()
-
+        invalidate(TAG_QUESTION.format(id))
 
         query = select(Answer).where(Answer.question_id == id)
         items = session.execute(query).scalars().all()
@@ -427,6 +482,7 @@ class Question(Base):
             abort(404, "Pregunta no encontrada o no tienes permisos para editarla.")
 
         # The new values for the questions are given
+        previous_subject_id = question.subject_id
         question.title = title
         question.subject_id = subject_id
         question.difficulty = difficulty
@@ -475,7 +531,13 @@ class Question(Base):
             )
             session.add(new_answer)
 
+        Question.touch(session, [question_id])
         session.commit()
+        invalidate(
+            TAG_QUESTION.format(question_id),
+            TAG_SUBJECT_QUESTIONS.format(previous_subject_id),
+            TAG_SUBJECT_QUESTIONS.format(subject_id)
+        )
         schema = FullQuestionSchema()
 
         return schema.dump(
@@ -499,6 +561,7 @@ class Question(Base):
             time: int = 1,
             difficulty: int = 1
     ) -> FullQuestionListSchema:
+        import pandas as pd
         from models.answer.answer import Answer
         try:
             # The file is tried to be read with different encodings
@@ -583,7 +646,10 @@ class Question(Base):
 
         except Exception as e:
             session.rollback()
-            abort(400, message=str(e))
+            abort(400, str(e))
+        finally:
+            # The questions are committed one by one, so the subject changes even if the import fails
+            invalidate(TAG_SUBJECT_QUESTIONS.format(subject_id))
 
     @staticmethod
     def insert_questions_from_aiken(session, file, subject_id: int, difficulty: int = 1,
@@ -652,8 +718,12 @@ class Question(Base):
 
                 questions.append(new_question)
 
-            schema = FullQuestionListSchema()
+            # The answers are not listed, as in the questions imported from a CSV file
+            schema = FullQuestionListSchema(exclude=('items.answers', 'items.question_parameters'))
             return schema.dump({"items": questions})
         except Exception as e:
             session.rollback()
-            abort(400, message=str(e))
\ No newline at end of file
+            abort(400, str(e))
+        finally:
+            # The questions are committed one by one, so the subject changes even if the import fails
+            invalidate(TAG_SUBJECT_QUESTIONS.format(subject_id))
\ No newline at end of file
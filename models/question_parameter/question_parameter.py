@@ -8,6 +8,7 @@ from db.versions.db import Base
 from models.question import Question
 from models.question_parameter.question_parameter_schema import QuestionParameterSchema
 from models.user.user import User
+from utils.cache import invalidate, TAG_QUESTION
 from utils.utils import get_current_user_id
 
 
@@ -60,6 +61,8 @@ class QuestionParameter(Base):
             group=group
         )
         session.add(new_question_parameter)
+        Question.touch(session, [question_id])
         session.commit()
+        invalidate(TAG_QUESTION.format(question_id))
         schema = QuestionParameterSchema().dump(new_question_parameter)
         return schema
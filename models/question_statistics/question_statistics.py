@@ -0,0 +1,179 @@
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Integer, Float, ForeignKey, select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, Mapped, mapped_column
+
+from db.versions.db import Base
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Minimum number of results of a question for its empirical values to replace the authored ones
+MIN_CALIBRATION_RESULTS = 20
+
+# Range of the authored difficulty of the questions
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 10
+
+# Maximum points of a question
+MAX_POINTS = 100
+
+
+def batch_moments(values: 'pd.Series') -> 'pd.DataFrame':
+    """
+    Returns the count, mean and sum of squared deviations (M2) of each group of a grouped series.
+    """
+    import pandas as pd
+
+    grouped = values.groupby(level=0)
+    moments = pd.DataFrame({
+        'count': grouped.count(),
+        'mean': grouped.mean(),
+    })
+    deviations = values - moments['mean'].reindex(values.index)
+    moments['m2'] = (deviations ** 2).groupby(level=0).sum()
+    return moments.fillna(0)
+
+
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    Merges the moments of two sets of values (Chan et al. parallel variance algorithm).
+    """
+    count = count_a + count_b
+    if count == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+    return count, mean, m2
+
+
+class QuestionStatistics(Base):
+    __tablename__ = "question_statistics"
+
+    question_id: Mapped[int] = mapped_column(Integer, ForeignKey("question.id"), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    points_mean: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    points_m2: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    time_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    time_mean: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    time_m2: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+
+    # Relaciones
+    question: Mapped["Question"] = relationship()
+
+    def __repr__(self):
+        return "<QuestionStatistics(question_id='%s', count='%s')>" % (self.question_id, self.count)
+
+    @property
+    def points_variance(self):
+        return self.points_m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def time_variance(self):
+        return self.time_m2 / (self.time_count - 1) if self.time_count > 1 else None
+
+    @property
+    def empirical_difficulty(self):
+        """
+        Maps the mean points of the question to the difficulty scale: a question where every taker
+        gets the maximum points has the minimum difficulty.
+        """
+        if self.count < MIN_CALIBRATION_RESULTS:
+            return None
+        success = min(max(self.points_mean, 0), MAX_POINTS) / MAX_POINTS
+        return MIN_DIFFICULTY + (MAX_DIFFICULTY - MIN_DIFFICULTY) * (1 - success)
+
+    @property
+    def empirical_time(self):
+        if self.time_count < MIN_CALIBRATION_RESULTS:
+            return None
+        return self.time_mean
+
+    @staticmethod
+    def update_from_results(session, rows):
+        """
+        Merges a batch of (question_id, points, time) results into the running statistics of their
+        questions, without reading the results that were already ingested. The session is not committed.
+        """
+        import pandas as pd
+
+        if not rows:
+            return
+
+        df = pd.DataFrame.from_records(rows, columns=['question_id', 'points', 'time'])
+        df = df.set_index('question_id')
+        points = batch_moments(pd.to_numeric(df['points'], errors='coerce').dropna())
+        times = batch_moments(pd.to_numeric(df['time'], errors='coerce').dropna())
+
+        question_ids = sorted(int(question_id) for question_id in df.index.unique())
+
+        # The missing statistics are created empty first, so every row to merge exists and can be locked
+        dialect = session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            session.execute(insert(QuestionStatistics).values([
+                {'question_id': question_id, 'count': 0, 'points_mean': 0.0, 'points_m2': 0.0,
+                 'time_count': 0, 'time_mean': 0.0, 'time_m2': 0.0} for question_id in question_ids
+            ]).on_conflict_do_nothing(index_elements=['question_id']))
+
+        # The rows are locked (in the same order in every transaction) until the session is committed, so
+        # concurrent uploads of the same questions merge their batches one after the other instead of
+        # overwriting each other. SQLite ignores FOR UPDATE, but the insert above already took its write lock
+        query = select(QuestionStatistics).where(
+            QuestionStatistics.question_id.in_(question_ids)
+        ).order_by(QuestionStatistics.question_id).with_for_update().execution_options(populate_existing=True)
+        existing = {statistics.question_id: statistics for statistics in session.execute(query).scalars()}
+
+        for question_id in question_ids:
+            statistics = existing.get(question_id)
+            if statistics is None:
+                statistics = QuestionStatistics(
+                    question_id=question_id, count=0, points_mean=0.0, points_m2=0.0,
+                    time_count=0, time_mean=0.0, time_m2=0.0
+                )
+                session.add(statistics)
+
+            if question_id in points.index:
+                batch = points.loc[question_id]
+                statistics.count, statistics.points_mean, statistics.points_m2 = merge_moments(
+                    statistics.count, statistics.points_mean, statistics.points_m2,
+                    int(batch['count']), float(batch['mean']), float(batch['m2'])
+                )
+            if question_id in times.index:
+                batch = times.loc[question_id]
+                statistics.time_count, statistics.time_mean, statistics.time_m2 = merge_moments(
+                    statistics.time_count, statistics.time_mean, statistics.time_m2,
+                    int(batch['count']), float(batch['mean']), float(batch['m2'])
+                )
+
+    @staticmethod
+    def rebuild(session, question_ids):
+        """
+        Recalculates the statistics of the given questions from their stored results. It is used when
+        results are deleted, since removed values can not be subtracted reliably. The session is not committed.
+        """
+        from models.result.result import Result
+
+        question_ids = list(question_ids)
+        if not question_ids:
+            return
+
+        # The archived results are part of the statistics as well
+        results = Result.results_source(include_archive=True)
+        session.execute(delete(QuestionStatistics).where(QuestionStatistics.question_id.in_(question_ids)))
+        query = select(results.c.question_id, results.c.points, results.c.time).where(
+            results.c.question_id.in_(question_ids)
+        )
+        QuestionStatistics.update_from_results(session, session.execute(query).all())
+
+    @staticmethod
+    def get_statistics(session, question_ids) -> dict:
+        """
+        Returns the statistics of the given questions indexed by question ID.
+        """
+        if not question_ids:
+            return {}
+        query = select(QuestionStatistics).where(QuestionStatistics.question_id.in_(list(question_ids)))
+        return {statistics.question_id: statistics for statistics in session.execute(query).scalars()}
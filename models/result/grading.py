@@ -0,0 +1,57 @@
+import numpy as np
+
+# Maximum points of a question
+MAX_POINTS = 100
+
+# How wrong answers are scored: with the points of the chosen answer, never below zero, or with the
+# classic correction for guessing (-MAX_POINTS / (options - 1))
+NEGATIVE_MARKING_MODES = ['answers', 'none', 'guessing']
+
+BLANK = -1
+
+
+def letter_codes(sheets: list, question_number: int) -> np.ndarray:
+    """
+    Converts the chosen letters of the sheets into a sheet x question matrix of answer positions
+    (A = 0, B = 1...), with BLANK for the questions left unanswered. Every sheet must have one entry
+    per question.
+    """
+    wrong_length = [i for i, answers in enumerate(sheets) if len(answers) != question_number]
+    if wrong_length:
+        raise ValueError(f"Las hojas {wrong_length[:10]} no tienen {question_number} respuestas.")
+    wrong_letters = [i for i, answers in enumerate(sheets) if any(answer and len(answer.strip()) > 1 for answer in answers)]
+    if wrong_letters:
+        raise ValueError(f"Las hojas {wrong_letters[:10]} tienen respuestas de más de una letra.")
+
+    letters = np.array([[(answer or '').strip() for answer in answers] for answers in sheets], dtype='<U1')
+    letters = np.char.upper(letters).reshape(len(sheets), question_number)
+
+    # The code points of the letters are turned into positions, and empty strings into blanks
+    codes = letters.view(np.uint32).astype(np.int64).reshape(letters.shape)
+    return np.where(codes == 0, BLANK, codes - ord('A'))
+
+
+def score_sheets(codes: np.ndarray, answer_points: np.ndarray, answer_counts: np.ndarray,
+                 negative_marking: str = 'answers') -> np.ndarray:
+    """
+    Scores a sheet x question matrix of answer positions at once. answer_points is a question x option
+    matrix with the points of each answer (padded beyond answer_counts). Blank answers score 0.
+    """
+    answered = codes != BLANK
+    invalid = answered & ((codes < 0) | (codes >= answer_counts[None, :]))
+    if invalid.any():
+        sheets = np.nonzero(invalid.any(axis=1))[0]
+        raise ValueError(f"Las hojas {sheets[:10].tolist()} tienen letras que no corresponden a ninguna respuesta.")
+
+    question_index = np.broadcast_to(np.arange(codes.shape[1]), codes.shape)
+    points = np.where(answered, answer_points[question_index, np.where(answered, codes, 0)], 0)
+
+    if negative_marking == 'none':
+        points = np.maximum(points, 0)
+    elif negative_marking == 'guessing':
+        with np.errstate(divide='ignore'):
+            penalty = np.where(answer_counts > 1, -MAX_POINTS / (answer_counts - 1), 0)
+        wrong = answered & (points <= 0)
+        points = np.where(wrong, np.broadcast_to(penalty, codes.shape), points)
+
+    return np.rint(points).astype(np.int64)
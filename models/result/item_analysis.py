@@ -0,0 +1,197 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from utils.question_formats import answer_letter
+
+# Maximum points of a question, used to normalize the indexes to [0, 1]
+MAX_POINTS = 100
+
+# Share of takers in the upper and lower groups of the discrimination index
+GROUP_FRACTION = 0.27
+
+HISTOGRAM_BINS = 10
+
+
+def _clean(value):
+    # NaN values (not enough data) are returned as None
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def build_matrices(rows):
+    """
+    Builds the taker x question matrices of points and time from (taker, question_id, points, time) rows.
+    Missing answers count as 0 points and unknown time. Returns both matrices, the takers of their rows
+    and the question IDs of their columns.
+    """
+    df = pd.DataFrame.from_records(rows, columns=['taker', 'question_id', 'points', 'time'])
+    taker_index, takers = pd.factorize(df['taker'], sort=True)
+    question_index, question_ids = pd.factorize(df['question_id'], sort=True)
+    shape = (taker_index.max() + 1, len(question_ids))
+    cells = np.ravel_multi_index((taker_index, question_index), shape)
+    size = shape[0] * shape[1]
+
+    # Repeated results of a taker in a question are averaged
+    counts = np.bincount(cells, minlength=size)
+    points = pd.to_numeric(df['points'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    time = pd.to_numeric(df['time'], errors='coerce').to_numpy(dtype=float)
+    known_time = ~np.isnan(time)
+    time_counts = np.bincount(cells[known_time], minlength=size)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points_matrix = np.where(counts > 0, np.bincount(cells, weights=points, minlength=size) / counts, 0)
+        time_matrix = np.bincount(cells[known_time], weights=time[known_time], minlength=size) / time_counts
+
+    return points_matrix.reshape(shape), time_matrix.reshape(shape), takers, question_ids
+
+
+def item_statistics(points: np.ndarray, times: np.ndarray) -> dict:
+    """
+    Calculates, for each question (column), the difficulty index, the discrimination index
+    (upper and lower 27% of takers), the point-biserial (item-rest) correlation and the mean time.
+    """
+    takers, questions = points.shape
+    totals = points.sum(axis=1)
+
+    difficulty = points.mean(axis=0) / MAX_POINTS
+
+    # The takers are ordered by their total score to form the upper and lower groups
+    group_size = max(1, int(round(takers * GROUP_FRACTION)))
+    order = np.argsort(totals, kind='stable')
+    lower = points[order[:group_size]].mean(axis=0)
+    upper = points[order[-group_size:]].mean(axis=0)
+    discrimination = (upper - lower) / MAX_POINTS
+
+    # Correlation between each question and the total score without that question
+    rest = totals[:, None] - points
+    centered_points = points - points.mean(axis=0)
+    centered_rest = rest - rest.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        point_biserial = (centered_points * centered_rest).sum(axis=0) / np.sqrt(
+            (centered_points ** 2).sum(axis=0) * (centered_rest ** 2).sum(axis=0)
+        )
+
+    # The questions without any known time are left as NaN (np.nanmean would warn about them)
+    known_time = ~np.isnan(times)
+    time_counts = known_time.sum(axis=0)
+    mean_time = np.full(questions, np.nan)
+    np.divide(np.where(known_time, times, 0).sum(axis=0), time_counts, out=mean_time, where=time_counts > 0)
+
+    return {
+        "difficulty": difficulty,
+        "discrimination": discrimination,
+        "point_biserial": point_biserial,
+        "mean_time": mean_time,
+    }
+
+
+def cronbach_alpha(points: np.ndarray):
+    takers, questions = points.shape
+    if questions < 2 or takers < 2:
+        return None
+    total_variance = points.sum(axis=1).var(ddof=1)
+    if total_variance == 0:
+        return None
+    item_variances = points.var(axis=0, ddof=1).sum()
+    return float(questions / (questions - 1) * (1 - item_variances / total_variance))
+
+
+def score_distribution(totals: np.ndarray) -> dict:
+    if totals.size == 0:
+        return {"mean": None, "median": None, "std": None, "min": None, "max": None, "histogram": []}
+
+    counts, edges = np.histogram(totals, bins=HISTOGRAM_BINS)
+    return {
+        "mean": float(totals.mean()),
+        "median": float(np.median(totals)),
+        "std": float(totals.std(ddof=1)) if totals.size > 1 else 0.0,
+        "min": float(totals.min()),
+        "max": float(totals.max()),
+        "histogram": [
+            {"start": float(edges[i]), "end": float(edges[i + 1]), "count": int(counts[i])}
+            for i in range(len(counts))
+        ],
+    }
+
+
+def analyse_exam(rows) -> dict:
+    """
+    Returns the item analysis of an exam from its (taker, question_id, points, time) result rows.
+    """
+    if not rows:
+        return {"takers": 0, "questions": [], "cronbach_alpha": None, "score_distribution": score_distribution(np.array([]))}
+
+    points, times, _, question_ids = build_matrices(rows)
+
+    statistics = item_statistics(points, times)
+    questions = [
+        {
+            "question_id": int(question_id),
+            "difficulty": _clean(statistics['difficulty'][i]),
+            "discrimination": _clean(statistics['discrimination'][i]),
+            "point_biserial": _clean(statistics['point_biserial'][i]),
+            "mean_time": _clean(statistics['mean_time'][i]),
+        }
+        for i, question_id in enumerate(question_ids)
+    ]
+
+    return {
+        "takers": int(points.shape[0]),
+        "questions": questions,
+        "cronbach_alpha": cronbach_alpha(points),
+        "score_distribution": score_distribution(points.sum(axis=1)),
+    }
+
+
+def distractor_report(counts, answers) -> list:
+    """
+    Returns, for each question, the share of responses that chose each of its answers, overall and within
+    the upper and lower score groups. counts are (question_id, answer_id, score_group, count) rows and
+    answers are (question_id, answer_id, body, points) rows ordered by answer ID.
+    """
+    chosen = defaultdict(int)
+    responses = defaultdict(int)
+    for question_id, answer_id, score_group, count in counts:
+        for group in (None, score_group):
+            chosen[(question_id, answer_id, group)] += count
+            responses[(question_id, group)] += count
+
+    def share(question_id, answer_id, group=None):
+        total = responses[(question_id, group)]
+        return chosen[(question_id, answer_id, group)] / total if total else None
+
+    def option(question_id, answer_id, letter=None, body=None, points=None):
+        return {
+            "answer_id": answer_id,
+            "letter": letter,
+            "body": body,
+            "points": points,
+            "count": chosen[(question_id, answer_id, None)],
+            "share": share(question_id, answer_id),
+            "upper_share": share(question_id, answer_id, 'upper'),
+            "lower_share": share(question_id, answer_id, 'lower'),
+        }
+
+    question_answers = defaultdict(list)
+    for question_id, answer_id, body, points in answers:
+        question_answers[question_id].append((answer_id, body, points))
+
+    report = []
+    for question_id, question_options in question_answers.items():
+        options = [
+            option(question_id, answer_id, answer_letter(position), body, points)
+            for position, (answer_id, body, points) in enumerate(question_options)
+        ]
+        # The responses whose chosen answer is unknown are reported apart
+        if chosen[(question_id, None, None)]:
+            options.append(option(question_id, None))
+        report.append({
+            "question_id": question_id,
+            "responses": responses[(question_id, None)],
+            "upper_responses": responses[(question_id, 'upper')],
+            "lower_responses": responses[(question_id, 'lower')],
+            "options": options,
+        })
+    return report
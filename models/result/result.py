@@ -1,12 +1,278 @@
-import pandas as pd
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
 from flask import abort
-from sqlalchemy import Integer, String, select, ForeignKey, and_, CheckConstraint, delete
+from sqlalchemy import Integer, select, ForeignKey, and_, CheckConstraint, delete, cast, func, Float, Index, insert, \
+    case, union_all, extract, literal, DateTime, or_, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from typing import List
+from typing import List, TYPE_CHECKING
 from db.versions.db import Base
-from models.result.result_schema import ResultSchema, ResultListSchema, ResultDetailListSchema
+from models.question_statistics.question_statistics import QuestionStatistics
+from models.result.result_archive import ResultArchive
+from models.subject.subject import Subject
+from models.result.result_schema import ResultSchema, ResultListSchema, ResultDetailListSchema, ItemAnalysisSchema, \
+    ResultSummarySchema, DistractorReportSchema, GradingSchema, ScoreReportJobSchema, ArchiveResultSchema, \
+    ResultUploadSchema, RESULT_EXPORT_COLUMNS
+
+from utils.cache import invalidate, TAG_EXAM
+from utils.question_formats import answer_letter
+from utils.utils import get_current_user_id, get_academic_year
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SUMMARY_PERCENTILES = [10, 25, 50, 75, 90]
+SUMMARY_HISTOGRAM_BINS = 10
+
+RESULT_COLUMNS = ['question_id', 'exam_id', 'points', 'taker', 'time']
+
+# Maximum number of invalid rows reported when an upload is rejected
+MAX_REPORTED_ROWS = 10
+
+# Number of results moved to the archive in each transaction
+ARCHIVE_BATCH_SIZE = 5000
+
+# The natural key of a result: a taker answers each question of an exam once
+RESULT_KEY = ['exam_id', 'question_id', 'taker']
+
+# Columns overwritten when a result is uploaded again
+UPSERT_COLUMNS = ['points', 'time', 'answer_id']
+
+# Number of results written by each upsert statement
+UPSERT_CHUNK_SIZE = 1000
+
+# Maximum number of distractor reports kept in memory (the least recently used ones are discarded)
+DISTRACTOR_REPORT_CACHE_SIZE = 256
+
+# Distractor reports by exam ID, kept with the stamp of the exam and its results they were built from
+distractor_report_cache = OrderedDict()
+distractor_report_lock = threading.Lock()
+
+
+def get_cached_distractor_report(exam_id: int, stamp: tuple):
+    with distractor_report_lock:
+        cached = distractor_report_cache.get(exam_id)
+        if cached is None or cached[0] != stamp:
+            return None
+        distractor_report_cache.move_to_end(exam_id)
+        return cached[1]
+
+
+def store_distractor_report(exam_id: int, stamp: tuple, report: dict):
+    with distractor_report_lock:
+        distractor_report_cache[exam_id] = (stamp, report)
+        distractor_report_cache.move_to_end(exam_id)
+        while len(distractor_report_cache) > DISTRACTOR_REPORT_CACHE_SIZE:
+            distractor_report_cache.popitem(last=False)
+
+
+def discard_distractor_reports(exam_ids):
+    with distractor_report_lock:
+        for exam_id in exam_ids:
+            distractor_report_cache.pop(exam_id, None)
+
+
+def academic_year_expression(created_on):
+    """
+    SQL expression of the academic year (identified by the year it starts in, in September) of a date.
+    """
+    return extract('year', created_on) - case((extract('month', created_on) < 9, 1), else_=0)
+
+
+def upsert_results(session, rows: list, chunk_size: int = UPSERT_CHUNK_SIZE) -> dict:
+    """
+    Inserts the results, or overwrites the ones with the same (exam_id, question_id, taker) that
+    changed, with one INSERT ... ON CONFLICT DO UPDATE statement per chunk. The rows must not repeat a key.
+    Returns the written results and the number of inserted, updated and unchanged rows, or raises a
+    ValueError if any of them is already archived. The question statistics are kept up to date (results
+    without time do not count for the time). The session is not committed.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        raise ValueError(f"La base de datos {dialect} no admite la subida de resultados.")
+
+    # The results already moved to the archive can not be overwritten, so they are rejected instead of
+    # being stored twice
+    query = select(ResultArchive.exam_id, ResultArchive.question_id, ResultArchive.taker).where(
+        ResultArchive.exam_id.in_({row['exam_id'] for row in rows})
+    )
+    archived = {tuple(key) for key in session.execute(query)}
+    conflicts = [
+        key for key in ((row['exam_id'], row['question_id'], row['taker']) for row in rows) if key in archived
+    ]
+    if conflicts:
+        raise ValueError(
+            f"Los resultados (examen, pregunta, alumno) {conflicts[:MAX_REPORTED_ROWS]} ya están archivados."
+        )
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(Result)
+    else:
+        statement = sqlite.insert(Result)
+
+    # Only the rows whose values change are updated (and returned), the rest are left untouched
+    excluded = statement.excluded
+    columns = Result.__table__.c
+    statement = statement.on_conflict_do_update(
+        index_elements=RESULT_KEY,
+        set_={column: excluded[column] for column in UPSERT_COLUMNS + ['created_by']},
+        where=or_(*[columns[column].is_distinct_from(excluded[column]) for column in UPSERT_COLUMNS])
+    )
+    returned = [columns.id, columns.created_by, columns.question_id, columns.exam_id, columns.time,
+                columns.taker, columns.points, columns.answer_id]
+    if dialect == 'postgresql':
+        # A row inserted by the statement has not been deleted or locked by any transaction yet
+        statement = statement.returning(*returned, literal_column('xmax = 0').label('inserted'))
+    else:
+        statement = statement.returning(*returned)
+
+    items = []
+    inserted = []
+    updated_questions = set()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        if dialect != 'postgresql':
+            # New rows get IDs above the current maximum, while updated rows keep theirs
+            max_id = session.execute(select(func.max(Result.id))).scalar() or 0
+
+        for row in session.execute(statement.values(chunk)).mappings():
+            item = {column.name: row[column.name] for column in returned}
+            items.append(item)
+            if row['inserted'] if dialect == 'postgresql' else item['id'] > max_id:
+                inserted.append(item)
+            else:
+                updated_questions.add(item['question_id'])
+
+    # The inserted results are merged into the statistics, while the questions with overwritten results
+    # are rebuilt, since the replaced values can not be subtracted reliably
+    QuestionStatistics.update_from_results(session, [
+        (item['question_id'], item['points'], item['time'])
+        for item in inserted if item['question_id'] not in updated_questions
+    ])
+    QuestionStatistics.rebuild(session, updated_questions)
+    discard_distractor_reports({item['exam_id'] for item in items})
+
+    return {
+        "items": items,
+        "inserted": len(inserted),
+        "updated": len(items) - len(inserted),
+        "unchanged": len(rows) - len(items),
+    }
+
+
+def archive_results(session, user_id: int, before_year: int = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """
+    Moves the results of the user's exams from closed academic years (the ones before before_year, and
+    never the current one) to the archive. Each batch is copied and deleted in its own transaction.
+    """
+    from models.exam.exam import Exam
+
+    current_year = get_academic_year(datetime.now())
+    before_year = min(before_year, current_year) if before_year is not None else current_year
+    year = academic_year_expression(Exam.created_on)
+    columns = ['id', 'created_by', 'question_id', 'exam_id', 'time', 'taker', 'points', 'answer_id']
+
+    archived = 0
+    batches = 0
+    years = set()
+    while True:
+        query = (
+            select(Result.id, year)
+            .join(Exam, Exam.id == Result.exam_id)
+            .where(and_(Exam.created_by == user_id, year < before_year))
+            .order_by(Result.id)
+            .limit(batch_size)
+        )
+        batch = session.execute(query).all()
+        if not batch:
+            break
+        ids = [result_id for result_id, _ in batch]
+        years.update(int(academic_year) for _, academic_year in batch)
+
+        # The rows are copied by the database and then removed from the result table
+        query = insert(ResultArchive).from_select(
+            columns + ['academic_year', 'archived_at'],
+            select(
+                *[Result.__table__.c[column] for column in columns],
+                year,
+                literal(datetime.now(), DateTime)
+            ).join(Exam, Exam.id == Result.exam_id).where(Result.id.in_(ids))
+        )
+        session.execute(query)
+        session.execute(delete(Result).where(Result.id.in_(ids)), execution_options={'synchronize_session': False})
+        session.commit()
+
+        archived += len(ids)
+        batches += 1
+
+    return {"archived": archived, "batches": batches, "academic_years": sorted(years), "before_year": before_year}
+
+
+def parse_results(df: 'pd.DataFrame') -> 'pd.DataFrame':
+    """
+    Validates and converts the result columns of an uploaded file in bulk. Every row must have integer
+    values and points between -100 and 100; otherwise the file is rejected listing the invalid rows.
+    """
+    import pandas as pd
+
+    missing = [column for column in RESULT_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Faltan las columnas {missing}.")
+
+    values = df[RESULT_COLUMNS].apply(lambda column: pd.to_numeric(column.str.strip(), errors='coerce'))
+    invalid = values.isna().any(axis=1) | (values % 1 != 0).any(axis=1)
+    invalid |= (values['points'] < -100) | (values['points'] > 100)
+    if invalid.any():
+        # The reported line numbers count the header as the first line
+        lines = (values.index[invalid] + 2).tolist()[:MAX_REPORTED_ROWS]
+        raise ValueError(f"Las filas {lines} del fichero tienen valores no válidos.")
 
-from utils.utils import get_current_user_id
+    return values.astype('int64')
+
+
+def resolve_answers(session, question_ids: 'pd.Series', answers: 'pd.Series') -> 'pd.Series':
+    """
+    Converts the chosen answers of an uploaded file to answer IDs. Each answer can be given by its ID
+    or by its letter, the answers of a question being lettered from A in the order of their IDs.
+    Empty values are kept as unknown answers.
+    """
+    import pandas as pd
+    from models.answer.answer import Answer
+
+    query = select(Answer.question_id, Answer.id).where(
+        Answer.question_id.in_([int(question_id) for question_id in question_ids.unique()])
+    ).order_by(Answer.question_id, Answer.id)
+    question_answers = {}
+    for question_id, answer_id in session.execute(query):
+        question_answers.setdefault(question_id, []).append(answer_id)
+    answer_questions = {
+        answer_id: question_id for question_id, answer_ids in question_answers.items() for answer_id in answer_ids
+    }
+    letters = {
+        (question_id, answer_letter(position)): answer_id
+        for question_id, answer_ids in question_answers.items()
+        for position, answer_id in enumerate(answer_ids)
+    }
+
+    resolved = []
+    invalid = []
+    for index, question_id, answer in zip(answers.index, question_ids, answers):
+        answer = answer.strip() if isinstance(answer, str) else ''
+        if not answer:
+            resolved.append(None)
+        elif answer.isdigit() and answer_questions.get(int(answer)) == question_id:
+            resolved.append(int(answer))
+        elif (question_id, answer.upper()) in letters:
+            resolved.append(letters[(question_id, answer.upper())])
+        else:
+            invalid.append(index + 2)
+            resolved.append(None)
+
+    if invalid:
+        raise ValueError(f"Las filas {invalid[:MAX_REPORTED_ROWS]} del fichero tienen respuestas que no son de su pregunta.")
+    return pd.Series(resolved, index=answers.index, dtype=object)
 
 
 class Result(Base):
@@ -16,18 +282,41 @@ class Result(Base):
     created_by: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"))
     question_id: Mapped[int] = mapped_column(Integer, ForeignKey("question.id"))
     exam_id: Mapped[int] = mapped_column(Integer, ForeignKey("exam.id"))
-    time: Mapped[int] = mapped_column(String, nullable=False)
-    taker: Mapped[int] = mapped_column(String, nullable=False)
+    # The time is unknown (NULL) for the results graded from answer sheets
+    time: Mapped[int] = mapped_column(Integer, nullable=True)
+    taker: Mapped[int] = mapped_column(Integer, nullable=False)
     points: Mapped[int] = mapped_column(Integer, CheckConstraint('points >= -100 AND points <= 100'), nullable=False)
+    answer_id: Mapped[int] = mapped_column(Integer, ForeignKey("answer.id"), nullable=True)
 
     # Relaciones
     created: Mapped["User"] = relationship(back_populates="results")
     question: Mapped["Question"] = relationship(back_populates="results")
     exam: Mapped["Exam"] = relationship(back_populates="results")
 
+    # The per-taker and per-question aggregates are driven by these indexes
+    __table_args__ = (
+        Index('ix_result_exam_id_taker', 'exam_id', 'taker'),
+        Index('ix_result_question_id', 'question_id'),
+        Index('uq_result_exam_question_taker', *RESULT_KEY, unique=True),
+    )
+
     def __repr__(self):
         return "<Result(id='%s', taker='%s')>" % (self.id, self.taker)
 
+    @staticmethod
+    def results_source(include_archive: bool = False):
+        """
+        Returns the table the results are read from, or the union of the result and archive
+        tables if the archived results should be included.
+        """
+        if not include_archive:
+            return Result.__table__
+        columns = ['id', 'created_by', 'question_id', 'exam_id', 'time', 'taker', 'points', 'answer_id']
+        return union_all(
+            select(*[Result.__table__.c[column] for column in columns]),
+            select(*[ResultArchive.__table__.c[column] for column in columns])
+        ).subquery('results')
+
     @staticmethod
     def insert_result(
             session,
@@ -36,6 +325,7 @@ class Result(Base):
             time: int,
             points: int,
             taker: int,
+            answer_id: int = None,
     ) -> ResultSchema:
         from models.associations.associations import exam_question_association
         from models.result.result_schema import ResultSchema
@@ -53,58 +343,179 @@ class Result(Base):
         if not association:
             abort(400, "La pregunta no pertenece al examen.")
 
-        new_result = Result(
-            created_by=user_id,
-            question_id=question_id,
-            exam_id=exam_id,
-            points=points,
-            time=time,
-            taker=taker
-        )
+        # A result posted again for the same taker overwrites the previous one, as in the uploads
+        row = {
+            "created_by": user_id,
+            "question_id": question_id,
+            "exam_id": exam_id,
+            "points": points,
+            "time": time,
+            "taker": taker,
+            "answer_id": answer_id,
+        }
+        try:
+            upload = upsert_results(session, [row])
+        except ValueError as e:
+            session.rollback()
+            abort(400, str(e))
+        if upload["items"]:
+            result = upload["items"][0]
+            Exam.touch(session, [exam_id])
+            session.commit()
+            invalidate(TAG_EXAM.format(exam_id))
+        else:
+            # The result was already uploaded with the same values
+            session.rollback()
+            result = session.execute(
+                select(Result).where(Result.exam_id == exam_id, Result.question_id == question_id,
+                                     Result.taker == taker)
+            ).scalar_one()
+            result = {column: getattr(result, column) for column in ['id'] + RESULT_COLUMNS + ['answer_id']}
 
-        session.add(new_result)
-        session.commit()
-        schema = ResultSchema()
-
-        return schema.dump(
-            {
-                "id": new_result.id,
-                "question_id": new_result.question_id,
-                "exam_id": new_result.exam_id,
-                "time": new_result.time,
-                "taker": new_result.taker,
-                "points": new_result.points,
-            }
-        )
+        return ResultSchema().dump(result)
 
     @staticmethod
-    def insert_results_from_csv(session, file) -> List[ResultSchema]:
+    def insert_results_from_csv(session, file) -> ResultUploadSchema:
+        import pandas as pd
+        from models.associations.associations import exam_question_association
+        from models.exam.exam import Exam
 
         try:
-            # The file is opened
+            # The file is opened and all its rows are validated at once
             df = pd.read_csv(file, dtype='object')
+            records = parse_results(df)
+            if records.empty:
+                return ResultUploadSchema().dump({"items": [], "inserted": 0, "updated": 0, "unchanged": 0})
+            if 'answer' in df.columns:
+                # The optional answer column holds the chosen answer as an ID or as a letter
+                records['answer_id'] = resolve_answers(session, records['question_id'], df['answer'])
 
-            results = []
-            for index, row in df.iterrows():
-                # For each result (row), its data is obtained and inserted as a new result
-                question_id = int(row['question_id'])
-                exam_id = int(row['exam_id'])
-                points = int(row['points'])
-                taker = int(row['taker'])
-                time = int(row['time'])
-
-                result = Result.insert_result(
-                    session=session,
-                    question_id=question_id,
-                    exam_id=exam_id,
-                    points=points,
-                    taker=taker,
-                    time=time
-                )
-                results.append(result)
-            return results
+            # The questions are checked to be associated to their exams with a single query
+            pairs = set(zip(records['exam_id'], records['question_id']))
+            query = select(exam_question_association.c.exam_id, exam_question_association.c.question_id).where(
+                exam_question_association.c.exam_id.in_({exam_id for exam_id, _ in pairs})
+            )
+            missing = pairs - {tuple(row) for row in session.execute(query)}
+            if missing:
+                raise ValueError("La pregunta no pertenece al examen.")
+
+            # A result repeated in the file is taken from its last row, and the results already
+            # uploaded are overwritten, so that uploading the same file again changes nothing
+            records = records.drop_duplicates(subset=RESULT_KEY, keep='last')
+            if 'answer_id' not in records.columns:
+                records['answer_id'] = None
+            records = records.astype(object).where(records.notna(), None)
+            user_id = get_current_user_id()
+            rows = [dict(row, created_by=user_id) for row in records.to_dict('records')]
+            upload = upsert_results(session, rows)
+            Exam.touch(session, {exam_id for exam_id, _ in pairs})
+            session.commit()
+            invalidate(*(TAG_EXAM.format(exam_id) for exam_id in {exam_id for exam_id, _ in pairs}))
+
+            return ResultUploadSchema().dump(upload)
         except Exception as e:
-            abort(400, message=str(e))
+            session.rollback()
+            abort(400, str(e))
+
+    @staticmethod
+    def grade_answer_sheets(
+            session,
+            exam_id: int,
+            sheets: List[dict],
+            question_ids: List[int] = None,
+            negative_marking: str = 'answers'
+    ) -> GradingSchema:
+        import numpy as np
+        from models.answer.answer import Answer
+        from models.associations.associations import exam_question_association
+        from models.exam.exam import Exam
+        from models.question.question import Question
+        from models.result.grading import letter_codes, score_sheets
+
+        # The exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        query = select(Exam).where(
+            and_(
+                Exam.id == exam_id,
+                Exam.created_by == user_id
+            )
+        )
+        exam = session.execute(query).first()
+
+        if not exam:
+            abort(400, "El examen con el ID no ha sido encontrado.")
+
+        # The sheets follow the order of the exam's test questions (by section, as in the exports)
+        # unless the order of a variant is given
+        query = (
+            select(exam_question_association.c.question_id, exam_question_association.c.section_id)
+            .join(Question, Question.id == exam_question_association.c.question_id)
+            .where(and_(exam_question_association.c.exam_id == exam_id, Question.type == 'test'))
+        )
+        sections = dict(session.execute(query).all())
+        exam_question_ids = [question.id for question in exam[0].questions if question.id in sections]
+        exam_question_ids.sort(key=lambda question_id: sections[question_id])
+        if question_ids is None:
+            question_ids = exam_question_ids
+        elif sorted(question_ids) != sorted(exam_question_ids):
+            abort(400, "El orden de las preguntas no corresponde a las preguntas tipo test del examen.")
+
+        # The answers of every question are loaded at once as question x option matrices
+        query = select(Answer.question_id, Answer.id, Answer.points).where(
+            Answer.question_id.in_(question_ids)
+        ).order_by(Answer.question_id, Answer.id)
+        question_answers = {}
+        for question_id, answer_id, points in session.execute(query):
+            question_answers.setdefault(question_id, []).append((answer_id, points))
+        answer_counts = np.array([len(question_answers.get(question_id, [])) for question_id in question_ids])
+        answer_ids = np.zeros((len(question_ids), max(answer_counts.max(initial=0), 1)), dtype=np.int64)
+        answer_points = np.zeros(answer_ids.shape)
+        for i, question_id in enumerate(question_ids):
+            for j, (answer_id, points) in enumerate(question_answers.get(question_id, [])):
+                answer_ids[i, j] = answer_id
+                answer_points[i, j] = points
+
+        # The whole batch of sheets is scored at once
+        codes = letter_codes([sheet['answers'] for sheet in sheets], len(question_ids))
+        points = score_sheets(codes, answer_points, answer_counts, negative_marking)
+        answered = codes >= 0
+        chosen = np.where(answered, answer_ids[np.arange(len(question_ids))[None, :], np.maximum(codes, 0)], 0)
+
+        takers = np.array([sheet['taker'] for sheet in sheets], dtype=np.int64)
+        rows = [
+            {
+                "created_by": user_id,
+                "question_id": question_id,
+                "exam_id": exam_id,
+                "taker": int(takers[i]),
+                "points": int(points[i, j]),
+                # The time of each question is not known from an answer sheet
+                "time": None,
+                "answer_id": int(chosen[i, j]) if answered[i, j] else None,
+            }
+            for i in range(len(sheets))
+            for j, question_id in enumerate(question_ids)
+        ]
+
+        # Grading the same sheets again overwrites the results of their takers
+        rows = list({(row['question_id'], row['taker']): row for row in rows}.values())
+        upload = upsert_results(session, rows)
+        Exam.touch(session, [exam_id])
+        session.commit()
+        invalidate(TAG_EXAM.format(exam_id))
+
+        totals = points.sum(axis=1)
+        return GradingSchema().dump({
+            "exam_id": exam_id,
+            "sheets": len(sheets),
+            "results": len(rows),
+            "inserted": upload['inserted'],
+            "updated": upload['updated'],
+            "unchanged": upload['unchanged'],
+            "takers": [
+                {"taker": int(taker), "score": float(total), "time": None} for taker, total in zip(takers, totals)
+            ],
+        })
 
     @staticmethod
     def delete_results_of_exam(session, exam_id: int):
@@ -119,34 +530,51 @@ class Result(Base):
             abort(401, "No tienes acceso a este recurso.")
 
         # The results belonging to the exam are deleted
+        results = Result.results_source(include_archive=True)
+        query = select(results.c.question_id).where(results.c.exam_id == exam_id).distinct()
+        question_ids = session.execute(query).scalars().all()
         query = delete(Result).where(Result.exam_id == exam_id)
         session.execute(query)
+        query = delete(ResultArchive).where(ResultArchive.exam_id == exam_id)
+        session.execute(query)
+
+        # The statistics of the affected questions are rebuilt from their remaining results
+        QuestionStatistics.rebuild(session, question_ids)
+        Exam.touch(session, [exam_id])
         session.commit()
+        discard_distractor_reports([exam_id])
+        invalidate(TAG_EXAM.format(exam_id))
 
     @staticmethod
-    def get_results_list(session, subject_id: int, limit: int = None, offset: int = 0) -> ResultListSchema:
+    def get_results_list(
+            session,
+            subject_id: int,
+            limit: int = None,
+            offset: int = 0,
+            include_archive: bool = False
+    ) -> ResultListSchema:
         from models.question import Question
         from models.exam.exam import Exam
-        from models.associations.associations import exam_question_association
 
         # The exam is checked to belong to the current user
         user_id = get_current_user_id()
+        results = Result.results_source(include_archive)
 
         query = (
             session.query(
-                Result.id,
-                Result.points,
-                Result.time,
-                Result.taker,
-                Result.exam_id,
-                Result.question_id,
+                results.c.id,
+                results.c.points,
+                results.c.time,
+                results.c.taker,
+                results.c.exam_id,
+                results.c.question_id,
                 Question.title.label('question_title'),
                 Exam.title.label('exam_title'),
 
             )
-            .join(Exam, Result.exam_id == Exam.id)
-            .join(Question, Result.question_id == Question.id)
-            .filter(Result.created_by == user_id)
+            .join(Exam, results.c.exam_id == Exam.id)
+            .join(Question, results.c.question_id == Question.id)
+            .filter(results.c.created_by == user_id)
             .filter(Question.subject_id == subject_id)
             .offset(offset)
         )
@@ -154,8 +582,6 @@ class Result(Base):
         if limit:
             query = query.limit(limit)
 
-        res = session.execute(query)
-
         items = []
         total = 0
         for item in query:
@@ -164,3 +590,388 @@ class Result(Base):
 
         schema = ResultDetailListSchema()
         return schema.dump({"items": items, "total": total})
+
+    @staticmethod
+    def get_item_analysis(session, exam_id: int, include_archive: bool = False) -> ItemAnalysisSchema:
+        from models.exam.exam import Exam
+        from models.result.item_analysis import analyse_exam
+
+        # The exam is checked to belong to the current user
+        query = select(Exam).where(
+            and_(
+                Exam.id == exam_id,
+                Exam.created_by == get_current_user_id()
+            )
+        )
+        exam = session.execute(query).first()
+
+        if not exam:
+            abort(400, "El examen con el ID no ha sido encontrado.")
+
+        # Every result of the exam is obtained in a single query and analysed as a taker x question matrix
+        results = Result.results_source(include_archive)
+        query = select(results.c.taker, results.c.question_id, results.c.points, results.c.time).where(
+            results.c.exam_id == exam_id
+        )
+        rows = session.execute(query).all()
+
+        analysis = analyse_exam(rows)
+        analysis['exam_id'] = exam_id
+
+        schema = ItemAnalysisSchema()
+        return schema.dump(analysis)
+
+    @staticmethod
+    def get_exam_summary(session, exam_id: int, include_archive: bool = False) -> ResultSummarySchema:
+        import numpy as np
+        from models.exam.exam import Exam
+
+        # The exam is checked to belong to the current user
+        query = select(Exam).where(
+            and_(
+                Exam.id == exam_id,
+                Exam.created_by == get_current_user_id()
+            )
+        )
+        exam = session.execute(query).first()
+
+        if not exam:
+            abort(400, "El examen con el ID no ha sido encontrado.")
+
+        # The total score and time of each taker are aggregated by the database
+        results = Result.results_source(include_archive)
+        totals = (
+            select(
+                results.c.taker.label('taker'),
+                func.sum(results.c.points).label('score'),
+                func.sum(results.c.time).label('time')
+            )
+            .where(results.c.exam_id == exam_id)
+            .group_by(results.c.taker)
+            .subquery()
+        )
+        takers = session.execute(select(totals).order_by(totals.c.taker)).all()
+
+        summary = {
+            "exam_id": exam_id,
+            "takers": [row._mapping for row in takers],
+            "count": len(takers),
+            "percentiles": [],
+            "histogram": [],
+        }
+        if not takers:
+            return ResultSummarySchema().dump(summary)
+
+        if session.get_bind().dialect.name == 'postgresql':
+            # The statistics are calculated over the per-taker totals without sending them back
+            score = cast(totals.c.score, Float)
+            query = select(
+                func.avg(score).label('mean'),
+                func.stddev_samp(score).label('std'),
+                func.min(score).label('min'),
+                func.max(score).label('max'),
+                func.avg(cast(totals.c.time, Float)).label('mean_time'),
+                *[
+                    func.percentile_cont(percentile / 100).within_group(score).label(f"p{percentile}")
+                    for percentile in SUMMARY_PERCENTILES
+                ]
+            )
+            statistics = session.execute(query).one()._mapping
+            summary.update({key: statistics[key] for key in ('mean', 'std', 'min', 'max', 'mean_time')})
+            summary['median'] = statistics['p50']
+            summary['percentiles'] = [
+                {"percentile": percentile, "value": statistics[f"p{percentile}"]} for percentile in SUMMARY_PERCENTILES
+            ]
+
+            # The histogram is grouped by the database as well (the maximum goes to the last bin)
+            low, high = statistics['min'], statistics['max']
+            counts = [0] * SUMMARY_HISTOGRAM_BINS
+            if high > low:
+                bucket = func.least(func.width_bucket(score, low, high, SUMMARY_HISTOGRAM_BINS), SUMMARY_HISTOGRAM_BINS)
+                query = select(bucket.label('bucket'), func.count()).group_by(bucket)
+                for bucket_number, count in session.execute(query):
+                    counts[bucket_number - 1] = count
+            else:
+                counts[0] = len(takers)
+            width = (high - low) / SUMMARY_HISTOGRAM_BINS
+            summary['histogram'] = [
+                {"start": low + i * width, "end": low + (i + 1) * width, "count": counts[i]}
+                for i in range(SUMMARY_HISTOGRAM_BINS)
+            ]
+        else:
+            # Other databases have no percentile functions, so the per-taker totals are used
+            scores = np.array([row.score for row in takers], dtype=float)
+            times = np.array([row.time for row in takers], dtype=float)
+            summary.update({
+                "mean": float(scores.mean()),
+                "median": float(np.percentile(scores, 50)),
+                "std": float(scores.std(ddof=1)) if len(scores) > 1 else None,
+                "min": float(scores.min()),
+                "max": float(scores.max()),
+                "mean_time": float(np.nanmean(times)) if not np.isnan(times).all() else None,
+                "percentiles": [
+                    {"percentile": percentile, "value": float(np.percentile(scores, percentile))}
+                    for percentile in SUMMARY_PERCENTILES
+                ],
+            })
+            counts, edges = np.histogram(scores, bins=SUMMARY_HISTOGRAM_BINS)
+            summary['histogram'] = [
+                {"start": float(edges[i]), "end": float(edges[i + 1]), "count": int(counts[i])}
+                for i in range(SUMMARY_HISTOGRAM_BINS)
+            ]
+
+        return ResultSummarySchema().dump(summary)
+
+    @staticmethod
+    def get_distractor_report(session, exam_id: int) -> DistractorReportSchema:
+        from models.answer.answer import Answer
+        from models.associations.associations import exam_question_association
+        from models.exam.exam import Exam
+        from models.result.item_analysis import distractor_report, GROUP_FRACTION
+
+        # The exam is checked to belong to the current user
+        query = select(Exam).where(
+            and_(
+                Exam.id == exam_id,
+                Exam.created_by == get_current_user_id()
+            )
+        )
+        exam = session.execute(query).first()
+
+        if not exam:
+            abort(400, "El examen con el ID no ha sido encontrado.")
+
+        # The cached report is reused until results of the exam are added or removed (which changes their
+        # count or maximum ID) or the exam is touched (which every overwrite of its results does)
+        query = select(func.count(Result.id), func.max(Result.id), Exam.updated_at).select_from(Exam).outerjoin(
+            Result, Result.exam_id == Exam.id
+        ).where(Exam.id == exam_id).group_by(Exam.id, Exam.updated_at)
+        stamp = tuple(session.execute(query).one())
+        cached = get_cached_distractor_report(exam_id, stamp)
+        if cached is not None:
+            return cached
+
+        # The takers are split into score groups by the percent rank of their total score, and the chosen
+        # answers are counted per question and group in a single grouped query
+        totals = (
+            select(Result.taker.label('taker'), func.sum(Result.points).label('score'))
+            .where(Result.exam_id == exam_id)
+            .group_by(Result.taker)
+            .subquery()
+        )
+        ranked = select(
+            totals.c.taker,
+            func.percent_rank().over(order_by=totals.c.score).label('rank')
+        ).subquery()
+        score_group = case(
+            (ranked.c.rank >= 1 - GROUP_FRACTION, 'upper'),
+            (ranked.c.rank <= GROUP_FRACTION, 'lower'),
+            else_='middle'
+        )
+        query = (
+            select(Result.question_id, Result.answer_id, score_group, func.count())
+            .join(ranked, ranked.c.taker == Result.taker)
+            .where(Result.exam_id == exam_id)
+            .group_by(Result.question_id, Result.answer_id, score_group)
+        )
+        counts = session.execute(query).all()
+
+        query = (
+            select(Answer.question_id, Answer.id, Answer.body, Answer.points)
+            .join(exam_question_association, exam_question_association.c.question_id == Answer.question_id)
+            .where(exam_question_association.c.exam_id == exam_id)
+            .order_by(Answer.question_id, Answer.id)
+        )
+        answers = session.execute(query).all()
+
+        report = DistractorReportSchema().dump({
+            "exam_id": exam_id,
+            "questions": distractor_report(counts, answers),
+        })
+        store_distractor_report(exam_id, stamp, report)
+        return report
+
+    @staticmethod
+    def export_results(
+            session,
+            format: str,
+            subject_id: int = None,
+            exam_id: int = None,
+            columns: List[str] = None,
+            exam_ids: List[int] = None,
+            takers: List[int] = None,
+            date_from: date = None,
+            date_to: date = None,
+            include_archive: bool = False,
+            batch_size: int = 10_000
+    ):
+        """
+        Returns a generator that yields the results of a subject or an exam, joined with their question
+        and exam data, as a Parquet file or an Arrow IPC stream. The rows are read through a server-side
+        cursor and written in record batches, so the memory used only depends on the batch size.
+        Only the requested columns are selected, and the rows can be filtered by exam, taker and exam date.
+        The archived results are included if include_archive is given.
+        """
+        import pyarrow as pa
+        from models.exam.exam import Exam
+        from models.question.question import Question
+        from utils.columnar_export import record_batch, stream_record_batches
+
+        # The subject or exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        if exam_id is not None:
+            query = select(Exam).where(and_(Exam.id == exam_id, Exam.created_by == user_id))
+            if not session.execute(query).first():
+                abort(400, "El examen con el ID no ha sido encontrado.")
+        else:
+            query = select(Subject).where(and_(Subject.id == subject_id, Subject.created_by == user_id))
+            if not session.execute(query).first():
+                abort(400, "La asignatura con el ID no ha sido encontrada.")
+
+        results = Result.results_source(include_archive)
+        available_columns = {
+            'result_id': (results.c.id, pa.int64()),
+            'subject_id': (Question.subject_id, pa.int64()),
+            'exam_id': (results.c.exam_id, pa.int64()),
+            'exam_title': (Exam.title, pa.string()),
+            'exam_date': (Exam.created_on, pa.timestamp('us')),
+            'question_id': (results.c.question_id, pa.int64()),
+            'question_title': (Question.title, pa.string()),
+            'question_type': (Question.type, pa.string()),
+            'question_difficulty': (Question.difficulty, pa.int32()),
+            'question_time': (Question.time, pa.int32()),
+            'taker': (results.c.taker, pa.int64()),
+            'points': (results.c.points, pa.int32()),
+            'time': (results.c.time, pa.int32()),
+            'answer_id': (results.c.answer_id, pa.int64()),
+        }
+        columns = columns or RESULT_EXPORT_COLUMNS
+        schema = pa.schema([(column, available_columns[column][1]) for column in columns])
+
+        query = (
+            select(*[available_columns[column][0] for column in columns])
+            .select_from(results)
+            .join(Exam, results.c.exam_id == Exam.id)
+            .join(Question, results.c.question_id == Question.id)
+            .order_by(results.c.id)
+        )
+        if exam_id is not None:
+            query = query.where(results.c.exam_id == exam_id)
+        else:
+            query = query.where(and_(Question.subject_id == subject_id, results.c.created_by == user_id))
+        if exam_ids:
+            query = query.where(results.c.exam_id.in_(exam_ids))
+        if takers:
+            query = query.where(results.c.taker.in_(takers))
+        if date_from:
+            query = query.where(Exam.created_on >= datetime.combine(date_from, datetime.min.time()))
+        if date_to:
+            query = query.where(Exam.created_on < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+
+        def batches():
+            rows = session.execute(query.execution_options(yield_per=batch_size))
+            for partition in rows.partitions():
+                yield record_batch(partition, schema)
+
+        return stream_record_batches(batches(), schema, format)
+
+    @staticmethod
+    def start_score_reports(session, exam_id: int, batch_size: int = 25) -> ScoreReportJobSchema:
+        """
+        Starts a job that renders the score report of every taker of the exam. The per-taker aggregates
+        are calculated here in one pass over the results, and the PDFs are rendered in batches by the
+        process pool while the job progress can be queried.
+        """
+        from models.associations.associations import exam_question_association
+        from models.exam.exam import Exam
+        from models.result.score_report import taker_reports, render_score_reports
+        from utils.jobs import create_job
+        from utils.workers import get_process_pool
+
+        # The exam is checked to belong to the current user
+        user_id = get_current_user_id()
+        query = select(Exam).where(
+            and_(
+                Exam.id == exam_id,
+                Exam.created_by == user_id
+            )
+        )
+        exam = session.execute(query).first()
+
+        if not exam:
+            abort(400, "El examen con el ID no ha sido encontrado.")
+        exam = exam[0]
+
+        query = select(Result.taker, Result.question_id, Result.points, Result.time).where(Result.exam_id == exam_id)
+        rows = session.execute(query).all()
+        if not rows:
+            abort(400, "El examen no tiene resultados.")
+
+        # The questions are listed in the order of the exam (by section, as in the exports)
+        query = select(exam_question_association.c.question_id, exam_question_association.c.section_id).where(
+            exam_question_association.c.exam_id == exam_id
+        )
+        sections = dict(session.execute(query).all())
+        questions = sorted(exam.questions, key=lambda question: sections.get(question.id, 0))
+        subject_name = session.execute(select(Subject.name).where(Subject.id == exam.subject_id)).scalar()
+
+        reports, summary = taker_reports(rows, [(question.id, question.title) for question in questions])
+
+        pool = get_process_pool()
+        batches = [reports[i:i + batch_size] for i in range(0, len(reports), batch_size)]
+        futures = [
+            pool.submit(render_score_reports, exam_id, exam.title, subject_name, summary, batch)
+            for batch in batches
+        ]
+        job = create_job(user_id, f"exam_{exam_id}_reports", futures, [len(batch) for batch in batches])
+        return ScoreReportJobSchema().dump(job.progress())
+
+    @staticmethod
+    def get_score_report_job(job_id: str) -> ScoreReportJobSchema:
+        from utils.jobs import get_job
+
+        job = get_job(job_id, get_current_user_id())
+        if not job:
+            abort(400, "El trabajo con el ID no ha sido encontrado.")
+        return ScoreReportJobSchema().dump(job.progress())
+
+    @staticmethod
+    def download_score_reports(job_id: str):
+        """
+        Returns the name of the job and a generator that yields a ZIP file with its reports,
+        adding each batch as soon as it has been rendered. If the download is interrupted, the
+        batches that have not been rendered are cancelled.
+        """
+        from utils.jobs import get_job, JobError
+        from utils.stream_utils import stream_zip
+
+        job = get_job(job_id, get_current_user_id())
+        if not job:
+            abort(400, "El trabajo con el ID no ha sido encontrado.")
+        if job.status in ('failed', 'cancelled'):
+            abort(400, job.error())
+
+        def parts():
+            try:
+                yield from job.files()
+            except JobError as e:
+                # The archive is closed with the reason instead of being cut
+                yield "ERROR.txt", str(e).encode('utf-8')
+
+        def stream():
+            finished = False
+            try:
+                yield from stream_zip(parts())
+                finished = True
+            finally:
+                if not finished and job.status == 'running':
+                    job.cancel()
+
+        return job.name, stream()
+
+    @staticmethod
+    def archive_closed_years(session, before_year: int = None) -> ArchiveResultSchema:
+        """
+        Moves the results of the current user's exams from closed academic years to the archive.
+        """
+        return ArchiveResultSchema().dump(archive_results(session, get_current_user_id(), before_year))
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, ForeignKey, CheckConstraint, DateTime, Index
+from sqlalchemy.orm import relationship, Mapped, mapped_column
+
+from db.versions.db import Base
+
+
+class ResultArchive(Base):
+    """
+    Results of closed academic years, moved out of the result table so that it only keeps the
+    results that are still being read often. The rows keep the ID they had as results.
+    """
+    __tablename__ = "result_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    created_by: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"))
+    question_id: Mapped[int] = mapped_column(Integer, ForeignKey("question.id"))
+    exam_id: Mapped[int] = mapped_column(Integer, ForeignKey("exam.id"))
+    # The time is unknown (NULL) for the results graded from answer sheets
+    time: Mapped[int] = mapped_column(Integer, nullable=True)
+    taker: Mapped[int] = mapped_column(Integer, nullable=False)
+    points: Mapped[int] = mapped_column(Integer, CheckConstraint('points >= -100 AND points <= 100'), nullable=False)
+    answer_id: Mapped[int] = mapped_column(Integer, ForeignKey("answer.id"), nullable=True)
+    academic_year: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    # Relaciones
+    exam: Mapped["Exam"] = relationship(back_populates="archived_results")
+
+    __table_args__ = (
+        Index('ix_result_archive_exam_id_taker', 'exam_id', 'taker'),
+        Index('ix_result_archive_question_id', 'question_id'),
+        Index('ix_result_archive_academic_year', 'academic_year'),
+    )
+
+    def __repr__(self):
+        return "<ResultArchive(id='%s', taker='%s')>" % (self.id, self.taker)
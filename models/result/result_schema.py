@@ -1,4 +1,13 @@
-from marshmallow import Schema, fields, post_dump, EXCLUDE
+from marshmallow import Schema, fields, post_dump, EXCLUDE, validate
+from webargs.fields import DelimitedList
+
+from utils.common_schema import PaginationSchema
+
+# Columns of the columnar export of the results, in their default order
+RESULT_EXPORT_COLUMNS = [
+    'result_id', 'subject_id', 'exam_id', 'exam_title', 'exam_date', 'question_id', 'question_title',
+    'question_type', 'question_difficulty', 'question_time', 'taker', 'points', 'time', 'answer_id',
+]
 
 
 class CSVResultSchema(Schema):
@@ -11,9 +20,10 @@ class CSVResultSchema(Schema):
 class ResultReducedSchema(Schema):
     question_id = fields.Integer()
     exam_id = fields.Integer()
-    time = fields.Integer()
+    time = fields.Integer(allow_none=True)
     taker = fields.Integer()
     points = fields.Integer()
+    answer_id = fields.Integer(allow_none=True)
 
     class Meta:
         unknown = EXCLUDE
@@ -22,9 +32,10 @@ class ResultSchema(Schema):
     id = fields.Integer()
     question_id = fields.Integer()
     exam_id = fields.Integer()
-    time = fields.Integer()
+    time = fields.Integer(allow_none=True)
     taker = fields.Integer()
     points = fields.Integer()
+    answer_id = fields.Integer(allow_none=True)
 
     class Meta:
         unknown = EXCLUDE
@@ -39,11 +50,17 @@ class ResultListSchema(Schema):
         return data
 
 
+class ResultUploadSchema(ResultListSchema):
+    inserted = fields.Integer()
+    updated = fields.Integer()
+    unchanged = fields.Integer()
+
+
 class ResultDetailSchema(Schema):
     id = fields.Integer()
     question_id = fields.Integer()
     exam_id = fields.Integer()
-    time = fields.Integer()
+    time = fields.Integer(allow_none=True)
     taker = fields.Integer()
     points = fields.Integer()
     question_title = fields.String()
@@ -60,3 +77,161 @@ class ResultDetailListSchema(Schema):
     def add_total_results(self, data, many, **kwargs):
         data['total'] = len(data['items'])
         return data
+
+
+class QuestionAnalysisSchema(Schema):
+    question_id = fields.Integer()
+    difficulty = fields.Float(allow_none=True)
+    discrimination = fields.Float(allow_none=True)
+    point_biserial = fields.Float(allow_none=True)
+    mean_time = fields.Float(allow_none=True)
+
+
+class HistogramBinSchema(Schema):
+    start = fields.Float()
+    end = fields.Float()
+    count = fields.Integer()
+
+
+class ScoreDistributionSchema(Schema):
+    mean = fields.Float(allow_none=True)
+    median = fields.Float(allow_none=True)
+    std = fields.Float(allow_none=True)
+    min = fields.Float(allow_none=True)
+    max = fields.Float(allow_none=True)
+    histogram = fields.List(fields.Nested(HistogramBinSchema))
+
+
+class ItemAnalysisSchema(Schema):
+    exam_id = fields.Integer()
+    takers = fields.Integer()
+    questions = fields.List(fields.Nested(QuestionAnalysisSchema))
+    cronbach_alpha = fields.Float(allow_none=True)
+    score_distribution = fields.Nested(ScoreDistributionSchema)
+
+
+class TakerScoreSchema(Schema):
+    taker = fields.Integer()
+    score = fields.Float()
+    time = fields.Float(allow_none=True)
+
+
+class PercentileSchema(Schema):
+    percentile = fields.Integer()
+    value = fields.Float()
+
+
+class ResultSummarySchema(Schema):
+    exam_id = fields.Integer()
+    takers = fields.List(fields.Nested(TakerScoreSchema))
+    count = fields.Integer()
+    mean = fields.Float(allow_none=True)
+    median = fields.Float(allow_none=True)
+    std = fields.Float(allow_none=True)
+    min = fields.Float(allow_none=True)
+    max = fields.Float(allow_none=True)
+    mean_time = fields.Float(allow_none=True)
+    percentiles = fields.List(fields.Nested(PercentileSchema))
+    histogram = fields.List(fields.Nested(HistogramBinSchema))
+
+
+class DistractorOptionSchema(Schema):
+    answer_id = fields.Integer(allow_none=True)
+    letter = fields.String(allow_none=True)
+    body = fields.String(allow_none=True)
+    points = fields.Integer(allow_none=True)
+    count = fields.Integer()
+    share = fields.Float(allow_none=True)
+    upper_share = fields.Float(allow_none=True)
+    lower_share = fields.Float(allow_none=True)
+
+
+class QuestionDistractorSchema(Schema):
+    question_id = fields.Integer()
+    responses = fields.Integer()
+    upper_responses = fields.Integer()
+    lower_responses = fields.Integer()
+    options = fields.List(fields.Nested(DistractorOptionSchema))
+
+
+class DistractorReportSchema(Schema):
+    exam_id = fields.Integer()
+    questions = fields.List(fields.Nested(QuestionDistractorSchema))
+
+
+class AnswerSheetSchema(Schema):
+    taker = fields.Integer(required=True)
+    answers = fields.List(fields.String(allow_none=True), required=True)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class GradeSheetsSchema(Schema):
+    sheets = fields.List(fields.Nested(AnswerSheetSchema), required=True)
+    question_ids = fields.List(fields.Integer(), load_default=None)
+    negative_marking = fields.String(
+        validate=validate.OneOf(['answers', 'none', 'guessing']), load_default='answers'
+    )
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class GradingSchema(Schema):
+    exam_id = fields.Integer()
+    sheets = fields.Integer()
+    results = fields.Integer()
+    inserted = fields.Integer()
+    updated = fields.Integer()
+    unchanged = fields.Integer()
+    takers = fields.List(fields.Nested(TakerScoreSchema))
+
+
+class ColumnarExportSchema(Schema):
+    format = fields.String(validate=validate.OneOf(['parquet', 'arrow']), load_default='parquet')
+    columns = DelimitedList(fields.String(validate=validate.OneOf(RESULT_EXPORT_COLUMNS)))
+    exam_ids = DelimitedList(fields.Integer())
+    takers = DelimitedList(fields.Integer())
+    date_from = fields.Date(load_default=None)
+    date_to = fields.Date(load_default=None)
+    include_archive = fields.Boolean(load_default=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class ScoreReportJobSchema(Schema):
+    id = fields.String()
+    name = fields.String()
+    status = fields.String()
+    completed = fields.Integer()
+    total = fields.Integer()
+
+
+class ArchiveQuerySchema(Schema):
+    include_archive = fields.Boolean(load_default=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class ResultListQuerySchema(PaginationSchema):
+    include_archive = fields.Boolean(load_default=False)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class ArchiveSchema(Schema):
+    before_year = fields.Integer(load_default=None)
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class ArchiveResultSchema(Schema):
+    archived = fields.Integer()
+    batches = fields.Integer()
+    academic_years = fields.List(fields.Integer())
+    before_year = fields.Integer()
@@ -0,0 +1,128 @@
+import io
+from xml.sax.saxutils import escape as xml_escape
+
+import numpy as np
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+from models.result.item_analysis import build_matrices
+from utils.pdf_styles import get_pdf_styles
+
+# The style of the question tables is the same in every report
+QUESTION_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.black),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.whitesmoke]),
+])
+
+QUESTION_TABLE_WIDTHS = [280, 60, 60, 90]
+
+
+def _number(value):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+def taker_reports(rows, questions) -> tuple:
+    """
+    Calculates, in one pass over the (taker, question_id, points, time) results of an exam, the report
+    of every taker: their points and time in each question, their total and their position in the class.
+    questions is a list of (question_id, title) tuples in the order of the exam. Returns the reports and
+    the class summary they are compared to.
+    """
+    points, times, takers, question_ids = build_matrices(rows)
+    columns = {question_id: i for i, question_id in enumerate(question_ids)}
+
+    totals = points.sum(axis=1)
+    total_times = np.where(np.isnan(times).all(axis=1), np.nan, np.nansum(times, axis=1))
+    question_means = points.mean(axis=0)
+
+    # The position of each taker is the number of takers with a higher total plus one
+    sorted_totals = np.sort(totals)
+    higher = len(totals) - np.searchsorted(sorted_totals, totals, side='right')
+    lower = np.searchsorted(sorted_totals, totals, side='left')
+
+    summary = {
+        "takers": len(takers),
+        "mean": float(totals.mean()),
+        "median": float(np.median(totals)),
+        "max": float(totals.max()),
+    }
+
+    reports = []
+    for i, taker in enumerate(takers):
+        report_questions = []
+        for question_id, title in questions:
+            column = columns.get(question_id)
+            report_questions.append({
+                "title": title,
+                "points": _number(points[i, column]) if column is not None else None,
+                "time": _number(times[i, column]) if column is not None else None,
+                "class_mean": _number(question_means[column]) if column is not None else None,
+            })
+        reports.append({
+            "taker": int(taker),
+            "total": float(totals[i]),
+            "time": _number(total_times[i]),
+            "position": int(higher[i]) + 1,
+            "percentile": 100 * lower[i] / len(takers),
+            "questions": report_questions,
+        })
+    return reports, summary
+
+
+def _format(value, decimals=1):
+    if value is None:
+        return '-'
+    text = f"{value:.{decimals}f}"
+    return text.rstrip('0').rstrip('.') if '.' in text else text
+
+
+def build_report(report: dict, exam_title: str, subject_name: str, summary: dict) -> list:
+    styles = get_pdf_styles()
+    content = [
+        Paragraph(f"{xml_escape(subject_name)}<br/>{xml_escape(exam_title)}", styles['right_aligned']),
+        Spacer(1, 12),
+        Paragraph(f"Informe de resultados - Alumno {report['taker']}", styles['heading2']),
+        Paragraph(
+            f"Puntuación total: <b>{_format(report['total'])}</b> "
+            f"(media de la clase {_format(summary['mean'])}, mediana {_format(summary['median'])}, "
+            f"máxima {_format(summary['max'])})",
+            styles['normal']
+        ),
+        Paragraph(
+            f"Posición: {report['position']} de {summary['takers']} "
+            f"(supera al {_format(report['percentile'], 0)}% de la clase)",
+            styles['normal']
+        ),
+        Paragraph(f"Tiempo total: {_format(report['time'])}", styles['normal']),
+        Spacer(1, 12),
+    ]
+
+    rows = [["Pregunta", "Puntos", "Tiempo", "Media clase"]]
+    for number, question in enumerate(report['questions'], 1):
+        rows.append([
+            Paragraph(f"{number}. {xml_escape(question['title'])}", styles['normal']),
+            _format(question['points']),
+            _format(question['time']),
+            _format(question['class_mean']),
+        ])
+    table = Table(rows, colWidths=QUESTION_TABLE_WIDTHS, repeatRows=1)
+    table.setStyle(QUESTION_TABLE_STYLE)
+    content.append(table)
+    return content
+
+
+def render_score_reports(exam_id: int, exam_title: str, subject_name: str, summary: dict, reports: list) -> list:
+    """
+    Renders a batch of reports in this process (the styles are shared by every report).
+    Returns a list of (file name, bytes) tuples.
+    """
+    files = []
+    for report in reports:
+        output = io.BytesIO()
+        SimpleDocTemplate(output, pagesize=letter).build(build_report(report, exam_title, subject_name, summary))
+        files.append((f"exam_{exam_id}_taker_{report['taker']}.pdf", output.getvalue()))
+    return files
@@ -1,12 +1,13 @@
 from typing import Set
 
 from flask import abort
-from sqlalchemy import Integer, String, select, delete, ForeignKey, func, or_
+from sqlalchemy import Integer, String, select, delete, ForeignKey, func, or_, and_
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from db.versions.db import Base
 from models.subject.subject_schema import SubjectSchema, SubjectListSchema
 from models.user.user import User
+from utils.cache import invalidate, TAG_SUBJECT, TAG_USER_SUBJECTS
 from utils.utils import get_current_user_id
 
 
@@ -75,6 +76,7 @@ class Subject(Base):
         )
         session.add(new_node)
         session.commit()
+        invalidate(TAG_USER_SUBJECTS.format(new_subject.created_by))
 
         schema = SubjectSchema().dump(new_subject)
         return schema
@@ -163,6 +165,9 @@ class Subject(Base):
         session.execute(query)
         session.commit()
 
+        # The cached data of the subject, its exams and its questions is invalidated
+        invalidate(TAG_USER_SUBJECTS.format(current_user_id), TAG_SUBJECT.format(id))
+
     @staticmethod
     def get_user_subjects(session, limit: int = None, offset: int = 0) -> SubjectListSchema:
         from models.question.question import Question
@@ -208,9 +213,150 @@ class Subject(Base):
         res[0].name = name
 
         session.commit()
-
+        invalidate(TAG_USER_SUBJECTS.format(current_user_id), TAG_SUBJECT.format(id))
 
         schema = SubjectSchema().dump(res[0])
 
         return schema
 
+    @staticmethod
+    def export_subject_questions(session, subject_id: int, format: str, batch_size: int = 500):
+        """
+        Returns a generator that yields every question of the subject in the given format
+        (gift, aiken or moodlexml), grouped in categories that mirror the subject's node hierarchy.
+        The questions are read in batches using keyset pagination, so the memory used and the number
+        of queries only depend on the batch size.
+        """
+        from models.question.question import Question
+        from models.node.node import Node
+        from models.answer.answer import Answer
+        from models.question_parameter.question_parameter import QuestionParameter
+        from models.associations.associations import node_question_association
+        from utils.question_formats import get_parameter_values, apply_parameters, escape_category, \
+            gift_category, gift_question, aiken_question, moodlexml_category, moodlexml_question, MOODLEXML_HEADER, \
+            MOODLEXML_FOOTER
+
+        # The subject is checked to belong to the current user
+        query = select(Subject).where(
+            and_(
+                Subject.id == subject_id,
+                Subject.created_by == get_current_user_id()
+            )
+        )
+        subject = session.execute(query).first()
+
+        if not subject:
+            abort(400, "La asignatura con el ID no ha sido encontrada.")
+
+        # The category path and depth of every node are calculated once
+        query = select(Node.id, Node.name, Node.parent_id).where(Node.subject_id == subject_id)
+        nodes = {node_id: (name, parent_id) for node_id, name, parent_id in session.execute(query)}
+        categories = {}
+        default_category = escape_category(subject[0].name)
+
+        def get_category(node_id):
+            if node_id not in categories:
+                name, parent_id = nodes[node_id]
+                if parent_id is None or parent_id not in nodes:
+                    categories[node_id] = (escape_category(name), 0)
+                else:
+                    parent_path, parent_depth = get_category(parent_id)
+                    categories[node_id] = (f"{parent_path}/{escape_category(name)}", parent_depth + 1)
+            return categories[node_id]
+
+        def generate():
+            if format == 'moodlexml':
+                yield MOODLEXML_HEADER
+
+            last_id = 0
+            current_category = None
+            while True:
+                # The next batch of questions is obtained
+                query = (
+                    select(Question.id, Question.title, Question.type, Question.parametrized)
+                    .where(
+                        and_(
+                            Question.subject_id == subject_id,
+                            Question.id > last_id
+                        )
+                    )
+                    .order_by(Question.id)
+                    .limit(batch_size)
+                )
+                questions = session.execute(query).all()
+                if not questions:
+                    break
+                last_id = questions[-1].id
+                question_ids = [question.id for question in questions]
+
+                # The answers, parameters and nodes of the whole batch are loaded at once
+                answers = {question_id: [] for question_id in question_ids}
+                query = (
+                    select(Answer.question_id, Answer.body, Answer.points)
+                    .where(Answer.question_id.in_(question_ids))
+                    .order_by(Answer.question_id, Answer.id)
+                )
+                for question_id, body, points in session.execute(query):
+                    answers[question_id].append((body, points))
+
+                parameters = {question_id: [] for question_id in question_ids}
+                if any(question.parametrized for question in questions):
+                    query = (
+                        select(
+                            QuestionParameter.question_id,
+                            QuestionParameter.group,
+                            QuestionParameter.position,
+                            QuestionParameter.value
+                        )
+                        .where(QuestionParameter.question_id.in_(question_ids))
+                    )
+                    for question_id, group, position, value in session.execute(query):
+                        parameters[question_id].append((group, position, value))
+
+                # Each question is placed in the category of its deepest node
+                question_categories = {}
+                query = (
+                    select(node_question_association.c.question_id, node_question_association.c.node_id)
+                    .where(node_question_association.c.question_id.in_(question_ids))
+                )
+                for question_id, node_id in session.execute(query):
+                    if node_id not in nodes:
+                        continue
+                    category = get_category(node_id)
+                    if question_id not in question_categories or category[1] > question_categories[question_id][1]:
+                        question_categories[question_id] = category
+
+                chunk = []
+                for question in questions:
+                    # The questions without nodes are placed in the category of the subject
+                    category = question_categories.get(question.id, (default_category, 0))
+                    if category[0] != current_category:
+                        current_category = category[0]
+                        if format == 'gift':
+                            chunk.append(gift_category(current_category))
+                        elif format == 'moodlexml':
+                            chunk.append(moodlexml_category(current_category))
+
+                    # The parameters' values (if any) are replaced in the question and its answers
+                    values = get_parameter_values(parameters[question.id])
+                    title = apply_parameters(question.title, values)
+                    question_answers = [(apply_parameters(body, values), points) for body, points in answers[question.id]]
+                    name = f"Question {question.id}"
+
+                    if format == 'gift':
+                        chunk.append(gift_question(name, title, question.type, question_answers))
+                    elif format == 'moodlexml':
+                        chunk.append(moodlexml_question(name, title, question.type, question_answers))
+                    elif question.type == 'test':
+                        # Aiken only supports test questions, so the rest are skipped
+                        text = aiken_question(title, question_answers)
+                        if text:
+                            chunk.append(text)
+
+                # Only plain rows are loaded, so nothing is kept in the session between batches
+                yield ''.join(chunk)
+
+            if format == 'moodlexml':
+                yield MOODLEXML_FOOTER
+
+        return generate()
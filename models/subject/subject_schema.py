@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields, post_dump, EXCLUDE
+from marshmallow import Schema, fields, post_dump, EXCLUDE, validate
 
 
 class SubjectSchema(Schema):
@@ -26,3 +26,9 @@ class SubjectListSchema(Schema):
         data['total'] = len(data['items'])
         return data
 
+
+class SubjectExportSchema(Schema):
+    format = fields.String(validate=validate.OneOf(['gift', 'aiken', 'moodlexml']), load_default='gift')
+
+    class Meta:
+        unknown = EXCLUDE
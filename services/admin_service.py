@@ -0,0 +1,43 @@
+from flask import current_app
+from flask_jwt_extended import jwt_required
+from flask_smorest import Blueprint, abort
+from db.versions.db import create_db
+from models.user.user import User
+from utils.slow_queries import top_slow_queries
+from utils.slow_query_schema import SlowQueryArgsSchema, SlowQueryListSchema
+from utils.utils import get_current_user_id
+
+blp = Blueprint("Admin", __name__, url_prefix="/admin")
+SESSION = create_db()
+
+
+def is_admin() -> bool:
+    # The administrators are the users whose email is in the ADMIN_EMAILS setting
+    admins = {email.strip().lower() for email in current_app.config["ADMIN_EMAILS"].split(',') if email.strip()}
+    user = User.get_user(SESSION, id=get_current_user_id())
+    return user.email.lower() in admins
+
+
+@blp.route('/slow-queries', methods=["GET"])
+@jwt_required()
+@blp.arguments(SlowQueryArgsSchema, location='query')
+@blp.response(200, SlowQueryListSchema)
+def get_slow_queries(args):
+    """ Returns the statements of the slow query log with the highest total time
+    """
+    try:
+        admin = is_admin()
+    except Exception as e:
+        SESSION.rollback()
+        abort(400, message=str(e))
+    if not admin:
+        abort(403, message="Solo los administradores pueden consultar las consultas lentas")
+
+    try:
+        return {"items": top_slow_queries(
+            current_app.config["SLOW_QUERY_LOG"],
+            backups=current_app.config["SLOW_QUERY_LOG_BACKUPS"],
+            limit=args["limit"]
+        )}
+    except Exception as e:
+        abort(400, message=str(e))
@@ -1,20 +1,30 @@
-from flask import send_file, jsonify
+from io import BytesIO
+
+from flask import send_file, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required
 
 from models.exam.exam import Exam
-from models.exam.exam_schema import ExamSchema, FullExamSchema, ExamListSchema, SectionSchema, CompareExamsSchema
+from models.exam.exam_schema import ExamSchema, FullExamSchema, ExamListSchema, SectionSchema, CompareExamsSchema, \
+    ExamBundleSchema, PrintRunSchema, HtmlExportSchema
 from flask_smorest import Blueprint, abort
 from db.versions.db import create_db
 from models.question.question_schema import QuestionListSchema, QuestionExtendedListSchema
+from utils.cache import cached_response, TAG_EXAM, TAG_QUESTION, TAG_SUBJECT
 from utils.common_schema import PaginationSchema
+from utils.conditional import conditional_response
 
 blp = Blueprint("Exam", __name__, url_prefix="/exam")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 @blp.route('<int:id>', methods=["GET"])
 @jwt_required()
+@conditional_response(lambda id: Exam.get_exam_version(SESSION, id))
+@cached_response(
+    lambda id: [TAG_EXAM.format(id)],
+    lambda data: [TAG_SUBJECT.format(data['subject_id'])]
+                 + [TAG_QUESTION.format(question['id']) for question in data['questions']['items']]
+)
 @blp.response(200, FullExamSchema)
 def get_exam(id):
     """ Returns exam
@@ -83,7 +93,7 @@ def select_nodes_questions(section_data):
         parametrized=section_data.get('parametrized', None),
         question_number=section_data.get('question_number', None),
         exclude_ids=section_data.get('exclude_ids', None),
-
+        empirical=section_data.get('empirical', False),
     )
 
 
@@ -162,6 +172,86 @@ def export_exam_to_odt(id):
         abort(400, message=str(e))
 
 
+@blp.route('/<int:id>/export_html', methods=["GET"])
+@jwt_required()
+@blp.arguments(HtmlExportSchema, location='query')
+def export_exam_to_html(html_params, id):
+    """ Returns the exam as an HTML file, optionally with the answer key
+    """
+    try:
+        html = Exam.export_exam_to_html(SESSION, id, answer_key=html_params.get('answer_key'))
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return Response(
+        html,
+        mimetype='text/html',
+        headers={"Content-Disposition": f"attachment; filename=exam_{id}.html"}
+    )
+
+
+@blp.route('/<int:id>/preview', methods=["GET"])
+@jwt_required()
+@blp.arguments(HtmlExportSchema, location='query')
+def preview_exam(html_params, id):
+    """ Returns a print preview of the exam in HTML, optionally with the answer key
+    """
+    try:
+        html = Exam.export_exam_to_html(SESSION, id, answer_key=html_params.get('answer_key'))
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return Response(html, mimetype='text/html')
+
+
+@blp.route('/<int:id>/export_bundle', methods=["GET"])
+@jwt_required()
+@blp.arguments(ExamBundleSchema, location='query')
+def export_exam_bundle(bundle_params, id):
+    """ Returns a ZIP file with the exam exported to every requested format
+    """
+    try:
+        chunks = Exam.export_exam_bundle(SESSION, id, bundle_params.get('formats'))
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f"attachment; filename=exam_{id}.zip"}
+    )
+
+
+@blp.route('/<int:id>/print_run', methods=["POST"])
+@jwt_required()
+@blp.arguments(PrintRunSchema)
+def export_exam_print_run(print_run_data, id):
+    """ Returns several copies of the exam, in a single PDF or as a ZIP file with one PDF per copy
+    """
+    separate = print_run_data.get('separate')
+    try:
+        output = Exam.export_exam_print_run(
+            SESSION,
+            exam_id=id,
+            copies=print_run_data.get('copies'),
+            student_names=print_run_data.get('student_names'),
+            separate=separate,
+            variants=print_run_data.get('variants'),
+            processes=print_run_data.get('processes')
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+    if not separate:
+        return send_file(BytesIO(output), mimetype='application/pdf', as_attachment=True,
+                         download_name=f"exam_{id}_copies.pdf")
+    return Response(
+        stream_with_context(output),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f"attachment; filename=exam_{id}_copies.zip"}
+    )
+
+
 
 @blp.route('<int:exam_id>', methods=["PUT"])
 @jwt_required()
@@ -4,10 +4,10 @@ from models.node.node_schema import NodeSchema, NodeReducedSchema, NodeListSchem
 from flask_smorest import Blueprint, abort
 from db.versions.db import create_db
 from models.question.question_schema import FullQuestionListSchema
+from utils.cache import cached_response, TAG_SUBJECT, TAG_SUBJECT_NODES
 
 blp = Blueprint("Node", __name__, url_prefix="/node")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 @blp.route('<int:id>', methods=["GET"])
@@ -46,6 +46,7 @@ def add_node(node_data):
 
 @blp.route('/list/<int:id>', methods=["GET"])
 @jwt_required()
+@cached_response(lambda id: [TAG_SUBJECT_NODES.format(id), TAG_SUBJECT.format(id)])
 @blp.response(200, NodeListSchema)
 def get_subjects_nodes(id):
     """ Returns the list of nodes that a subject has
@@ -8,11 +8,12 @@ from flask_smorest import Blueprint, abort
 from db.versions.db import create_db
 from models.question_parameter.question_parameter import QuestionParameter
 from models.answer.answer import Answer
+from utils.cache import cached_response, TAG_QUESTION, TAG_SUBJECT
 from utils.common_schema import PaginationSchema
+from utils.conditional import conditional_response
 
 blp = Blueprint("Question", __name__, url_prefix="/question")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 
@@ -80,6 +81,7 @@ def get_user_questions(pagination_params):
 
 @blp.route('/subject-questions/<int:id>', methods=["GET"])
 @jwt_required()
+@conditional_response(lambda id: Question.get_subject_questions_version(SESSION, id))
 @blp.arguments(PaginationSchema, location='query')
 @blp.response(200, QuestionListSchema)
 def get_subject_questions(pagination_params, id):
@@ -95,6 +97,7 @@ def get_subject_questions(pagination_params, id):
 
 @blp.route('/full/<int:id>', methods=["GET"])
 @jwt_required()
+@cached_response(lambda id: [TAG_QUESTION.format(id)], lambda data: [TAG_SUBJECT.format(data['subject_id'])])
 @blp.response(200, FullQuestionSchema)
 def get_full_question(id):
     """ Returns question with its answers created by the current user
@@ -158,7 +161,7 @@ def upload_questions(import_data):
             difficulty=import_data.get('difficulty', 1),
             time=import_data.get('time', 1),
         )
-        return {"items": questions}, 200
+        return questions, 200
     except FileNotFoundError:
         abort(400, message="File not found")
     except Exception as e:
@@ -184,7 +187,7 @@ def upload_questions_aiken(import_data):
             difficulty=import_data.get('difficulty', 1),
             time=import_data.get('time', 1),
         )
-        return {"items": questions}, 200
+        return questions, 200
     except FileNotFoundError:
         abort(400, message="File not found")
     except Exception as e:
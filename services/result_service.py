@@ -1,34 +1,69 @@
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_jwt_extended import jwt_required
 from flask_smorest import Blueprint, abort
 from db.versions.db import create_db
 from models.result.result import Result
-from models.result.result_schema import ResultListSchema, ResultDetailListSchema
-from utils.common_schema import PaginationSchema
+from models.result.result_schema import ResultDetailListSchema, ItemAnalysisSchema, \
+    ResultSummarySchema, DistractorReportSchema, GradeSheetsSchema, GradingSchema, ColumnarExportSchema, \
+    ScoreReportJobSchema, ArchiveQuerySchema, ResultListQuerySchema, ArchiveSchema, ArchiveResultSchema, \
+    ResultUploadSchema
 
 blp = Blueprint("Result", __name__, url_prefix="/result")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 @blp.route('/upload', methods=["POST"])
 @jwt_required()
-@blp.response(200, ResultListSchema)
+@blp.response(200, ResultUploadSchema)
 def upload_results():
-    """ Uploads a CSV file and adds results """
+    """ Uploads a CSV file and adds results, overwriting the ones uploaded before """
     if 'file' not in request.files:
         abort(400, message="CSV file not provided")
 
     file = request.files['file']
 
     try:
-        results = Result.insert_results_from_csv(session=SESSION, file=file)
-        return {"items": results}, 200
+        return Result.insert_results_from_csv(session=SESSION, file=file), 200
     except FileNotFoundError:
         abort(400, message="File not found")
     except Exception as e:
         abort(400, message=str(e))
 
+@blp.route('/grade/<int:exam_id>', methods=["POST"])
+@jwt_required()
+@blp.arguments(GradeSheetsSchema)
+@blp.response(200, GradingSchema)
+def grade_answer_sheets(grading_data, exam_id):
+    """ Grades answer sheets of an exam and adds their results
+    """
+    try:
+        return Result.grade_answer_sheets(
+            SESSION,
+            exam_id=exam_id,
+            sheets=grading_data['sheets'],
+            question_ids=grading_data['question_ids'],
+            negative_marking=grading_data['negative_marking']
+        )
+    except Exception as e:
+        SESSION.rollback()
+        abort(400, message=str(e))
+
+@blp.route('/archive', methods=["POST"])
+@jwt_required()
+@blp.arguments(ArchiveSchema)
+@blp.response(200, ArchiveResultSchema)
+def archive_closed_years(archive_data):
+    """ Moves the results of closed academic years to the archive
+    """
+    try:
+        return Result.archive_closed_years(
+            SESSION,
+            before_year=archive_data.get('before_year', None)
+        )
+    except Exception as e:
+        SESSION.rollback()
+        abort(400, message=str(e))
+
 @blp.route('<int:id>', methods=["DELETE"])
 @jwt_required()
 @blp.response(204)
@@ -46,7 +81,7 @@ def delete_results_of_exam(id):
 
 @blp.route('/list/<int:subject_id>', methods=["GET"])
 @jwt_required()
-@blp.arguments(PaginationSchema, location='query')
+@blp.arguments(ResultListQuerySchema, location='query')
 @blp.response(200, ResultDetailListSchema)
 def get_subject_exams(pagination_params, subject_id):
     """ Returns list of results
@@ -55,5 +90,138 @@ def get_subject_exams(pagination_params, subject_id):
         SESSION,
         limit=pagination_params.get('limit', None),
         offset=pagination_params.get('offset', 0),
-        subject_id=subject_id
+        subject_id=subject_id,
+        include_archive=pagination_params.get('include_archive', False)
+    )
+
+
+@blp.route('/analysis/<int:exam_id>', methods=["GET"])
+@jwt_required()
+@blp.arguments(ArchiveQuerySchema, location='query')
+@blp.response(200, ItemAnalysisSchema)
+def get_item_analysis(archive_params, exam_id):
+    """ Returns the item analysis of an exam (difficulty, discrimination, reliability...)
+    """
+    try:
+        return Result.get_item_analysis(
+            SESSION,
+            exam_id=exam_id,
+            include_archive=archive_params.get('include_archive', False)
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+
+@blp.route('/summary/<int:exam_id>', methods=["GET"])
+@jwt_required()
+@blp.arguments(ArchiveQuerySchema, location='query')
+@blp.response(200, ResultSummarySchema)
+def get_exam_summary(archive_params, exam_id):
+    """ Returns the total score and time of each taker and the score statistics of an exam
+    """
+    try:
+        return Result.get_exam_summary(
+            SESSION,
+            exam_id=exam_id,
+            include_archive=archive_params.get('include_archive', False)
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+
+@blp.route('/distractors/<int:exam_id>', methods=["GET"])
+@jwt_required()
+@blp.response(200, DistractorReportSchema)
+def get_distractor_report(exam_id):
+    """ Returns the share of takers choosing each answer of the exam's questions, by score group
+    """
+    try:
+        return Result.get_distractor_report(
+            SESSION,
+            exam_id=exam_id
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+
+def columnar_export_response(chunks, export_format: str, file_name: str):
+    from utils.columnar_export import COLUMNAR_FORMATS
+
+    mimetype, extension = COLUMNAR_FORMATS[export_format]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={file_name}.{extension}"}
+    )
+
+
+@blp.route('/export/subject/<int:subject_id>', methods=["GET"])
+@jwt_required()
+@blp.arguments(ColumnarExportSchema, location='query')
+def export_subject_results(export_params, subject_id):
+    """ Exports the results of a subject as a Parquet file or an Arrow stream
+    """
+    try:
+        chunks = Result.export_results(SESSION, subject_id=subject_id, **export_params)
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return columnar_export_response(chunks, export_params['format'], f"subject_{subject_id}_results")
+
+
+@blp.route('/export/exam/<int:exam_id>', methods=["GET"])
+@jwt_required()
+@blp.arguments(ColumnarExportSchema, location='query')
+def export_exam_results(export_params, exam_id):
+    """ Exports the results of an exam as a Parquet file or an Arrow stream
+    """
+    try:
+        chunks = Result.export_results(SESSION, exam_id=exam_id, **export_params)
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return columnar_export_response(chunks, export_params['format'], f"exam_{exam_id}_results")
+
+
+@blp.route('/reports/<int:exam_id>', methods=["POST"])
+@jwt_required()
+@blp.response(202, ScoreReportJobSchema)
+def start_score_reports(exam_id):
+    """ Starts rendering the score report of every taker of an exam
+    """
+    try:
+        return Result.start_score_reports(
+            SESSION,
+            exam_id=exam_id
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+
+@blp.route('/reports/job/<string:job_id>', methods=["GET"])
+@jwt_required()
+@blp.response(200, ScoreReportJobSchema)
+def get_score_report_job(job_id):
+    """ Returns the progress of a score report job
+    """
+    try:
+        return Result.get_score_report_job(job_id)
+    except Exception as e:
+        abort(400, message=str(e))
+
+
+@blp.route('/reports/job/<string:job_id>/download', methods=["GET"])
+@jwt_required()
+def download_score_reports(job_id):
+    """ Downloads the score reports of a job as a ZIP file, streamed as they are rendered
+    """
+    try:
+        name, chunks = Result.download_score_reports(job_id)
+    except Exception as e:
+        abort(400, message=str(e))
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f"attachment; filename={name}.zip"}
     )
@@ -1,13 +1,16 @@
+from flask import Response, stream_with_context
 from flask_jwt_extended import jwt_required
 from flask_smorest import Blueprint, abort
+
 from db.versions.db import create_db
 from models.subject.subject import Subject
-from models.subject.subject_schema import SubjectSchema, BasicSubjectSchema, SubjectListSchema
+from models.subject.subject_schema import SubjectSchema, BasicSubjectSchema, SubjectListSchema, SubjectExportSchema
+from utils.cache import cached_response, TAG_SUBJECT_QUESTIONS, TAG_USER_SUBJECTS
 from utils.common_schema import PaginationSchema
+from utils.utils import get_current_user_id
 
 blp = Blueprint("Subject", __name__, url_prefix="/subject")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 @blp.route('<int:id>', methods=["GET"])
@@ -24,6 +27,10 @@ def get_subject(id):
 
 @blp.route('/user-subjects', methods=["GET"])
 @jwt_required()
+@cached_response(
+    lambda: [TAG_USER_SUBJECTS.format(get_current_user_id())],
+    lambda data: [TAG_SUBJECT_QUESTIONS.format(subject['id']) for subject in data['items']]
+)
 @blp.arguments(PaginationSchema, location='query')
 @blp.response(200, SubjectListSchema)
 def get_user_subject(pagination_params):
@@ -82,3 +89,34 @@ def edit_subject(subject_data, id):
         name=subject_data.get('name')
 
     )
+
+
+EXPORT_FORMATS = {
+    'gift': ('text/plain', 'txt'),
+    'aiken': ('text/plain', 'txt'),
+    'moodlexml': ('application/xml', 'xml'),
+}
+
+
+@blp.route('<int:id>/export', methods=["GET"])
+@jwt_required()
+@blp.arguments(SubjectExportSchema, location='query')
+def export_subject(export_params, id):
+    """ Exports every question of the subject, in categories that mirror its nodes
+    """
+    export_format = export_params.get('format')
+    try:
+        chunks = Subject.export_subject_questions(
+            SESSION,
+            subject_id=id,
+            format=export_format
+        )
+    except Exception as e:
+        abort(400, message=str(e))
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(chunk.encode('utf-8') for chunk in chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=subject_{id}_{export_format}.{extension}"}
+    )
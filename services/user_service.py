@@ -8,8 +8,7 @@ import bcrypt
 
 
 blp = Blueprint("User", __name__, url_prefix="/user")
-Session = create_db()
-SESSION = Session()
+SESSION = create_db()
 
 
 @blp.route('<int:id>', methods=["GET"])
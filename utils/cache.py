@@ -0,0 +1,299 @@
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from flask import Response, current_app, request
+from flask_smorest.utils import get_appcontext
+
+from utils.metrics import increment
+from utils.utils import get_current_user_id, load_settings
+
+# Settings of the cache, which can be given in the environment
+CACHE_DEFAULTS = {
+    "CACHE_ENABLED": True,
+    # Seconds an entry is kept, which bounds how stale it can be if an invalidation is missed
+    "CACHE_TTL": 60.0,
+    "CACHE_MAX_ENTRIES": 2048,
+    # Shared backend speaking the Redis protocol, such as redis://localhost:6379/0 (empty for none)
+    "CACHE_URL": "",
+}
+
+# Tags of the cached data. An entry is stale once any of its tags is invalidated
+TAG_USER_SUBJECTS = "user:{}:subjects"
+TAG_SUBJECT = "subject:{}"
+TAG_SUBJECT_NODES = "subject:{}:nodes"
+TAG_SUBJECT_QUESTIONS = "subject:{}:questions"
+TAG_EXAM = "exam:{}"
+TAG_QUESTION = "question:{}"
+
+# Prefixes of the keys of the shared backend
+ENTRY_PREFIX = "questions-api:entry:"
+VERSION_PREFIX = "questions-api:tag:"
+# Counter of the invalidations of any tag
+GENERATION_KEY = "questions-api:generation"
+
+
+class RespClient:
+    """
+    Minimal client of the Redis protocol (RESP) with a connection per thread, enough for the commands
+    used by the cache.
+    """
+
+    def __init__(self, url: str, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            connection = self.local.connection = (sock, sock.makefile('rb'))
+            if self.password:
+                self._send(connection, 'AUTH', self.password)
+            if self.database:
+                self._send(connection, 'SELECT', self.database)
+        return connection
+
+    def _send(self, connection, *arguments):
+        sock, reader = connection
+        command = [f"*{len(arguments)}\r\n".encode()]
+        for argument in arguments:
+            value = argument if isinstance(argument, bytes) else str(argument).encode('utf-8')
+            command.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        sock.sendall(b''.join(command))
+        return self._read(reader)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("The cache server closed the connection")
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value.decode()
+        if kind == b'-':
+            raise RuntimeError(value.decode())
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            if int(value) < 0:
+                return None
+            data = reader.read(int(value) + 2)
+            return data[:-2]
+        if kind == b'*':
+            return [self._read(reader) for _ in range(int(value))] if int(value) >= 0 else None
+        raise RuntimeError(f"Unexpected reply from the cache server: {line!r}")
+
+    def execute(self, *arguments):
+        try:
+            return self._send(self._connection(), *arguments)
+        except Exception:
+            # The connection is discarded, since a partial reply would corrupt the next ones
+            connection = getattr(self.local, 'connection', None)
+            if connection is not None:
+                connection[0].close()
+            self.local.connection = None
+            raise
+
+
+class ResponseCache:
+    """
+    Cache of serialized data with an in-process LRU and, optionally, a shared backend. Each entry stores
+    the versions of its tags when its data was read, and invalidating a tag increments its version, so
+    the entries of a changed resource are never served again, whichever process stored them.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, url: str = ""):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.shared = RespClient(url) if url else None
+
+    def tag_versions(self, tags: list) -> dict:
+        if not tags:
+            return {}
+        if self.shared is not None:
+            values = self.shared.execute('MGET', *(VERSION_PREFIX + tag for tag in tags))
+            return {tag: int(value or 0) for tag, value in zip(tags, values)}
+        with self.lock:
+            return {tag: self.versions.get(tag, 0) for tag in tags}
+
+    def current_generation(self) -> int:
+        if self.shared is not None:
+            return int(self.shared.execute('GET', GENERATION_KEY) or 0)
+        with self.lock:
+            return self.generation
+
+    def invalidate(self, tags: list):
+        # The generation is incremented before the tags (after the changes were committed), so that a load
+        # that finds it unchanged began after the changes of any tag version it has read
+        if self.shared is not None:
+            self.shared.execute('INCR', GENERATION_KEY)
+            for tag in set(tags):
+                self.shared.execute('INCR', VERSION_PREFIX + tag)
+            return
+        with self.lock:
+            self.generation += 1
+            for tag in set(tags):
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def _load_entry(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry["expires"] > time.time():
+                    self.entries.move_to_end(key)
+                    return entry
+                del self.entries[key]
+        if self.shared is not None:
+            value = self.shared.execute('GET', ENTRY_PREFIX + key)
+            if value is not None:
+                entry = json.loads(value)
+                self._store_local(key, entry)
+                return entry
+        return None
+
+    def _store_local(self, key: str, entry: dict):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the value of the entry if it exists and none of its tags has been invalidated since it
+        was stored, or None otherwise.
+        """
+        entry = self._load_entry(key)
+        if entry is not None and self.tag_versions(list(entry["tags"])) == entry["tags"]:
+            increment('cache_requests_total', (('result', 'hit'),))
+            return entry["value"]
+        increment('cache_requests_total', (('result', 'miss'),))
+        return None
+
+    def set(self, key: str, value, versions: dict):
+        """
+        Stores a JSON-serializable value with the versions its tags had before its data was read.
+        """
+        entry = {"value": value, "tags": versions, "expires": time.time() + self.ttl}
+        self._store_local(key, entry)
+        if self.shared is not None:
+            self.shared.execute('SET', ENTRY_PREFIX + key, json.dumps(entry), 'PX', int(self.ttl * 1000))
+
+    def get_or_load(self, key: str, tags: list, loader, data_tags=None):
+        """
+        Returns the cached value of the key, or loads and stores it. The tags known in advance are read
+        before loading, so that an invalidation during the load makes the entry stale. data_tags returns
+        the tags that depend on the loaded value, such as the questions of an exam, which can only be read
+        after loading; the value is then not stored if any tag was invalidated while it was loaded, since
+        their versions could be newer than the data.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        generation = self.current_generation() if data_tags is not None else None
+        versions = self.tag_versions(tags)
+        value = loader()
+        if value is not None:
+            if data_tags is not None:
+                versions.update(self.tag_versions([tag for tag in data_tags(value) if tag not in versions]))
+                if self.current_generation() != generation:
+                    return value, False
+            self.set(key, value, versions)
+        return value, False
+
+
+_cache = None
+
+
+def _reset_after_fork():
+    # The connections to the shared backend belong to the parent, so a forked child opens its own
+    if _cache is not None:
+        _cache.lock = threading.Lock()
+        if _cache.shared is not None:
+            _cache.shared.local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def invalidate(*tags):
+    """
+    Invalidates the cached entries with any of the tags. It is called by the model methods after they
+    commit their changes.
+    """
+    if _cache is None or not tags:
+        return
+    try:
+        _cache.invalidate(list(tags))
+    except Exception as e:
+        current_app.logger.warning("The cache tags %s could not be invalidated: %s", tags, e)
+
+
+def cached_response(tags, data_tags=None):
+    """
+    Caches the successful JSON responses of a route for each user and URL. tags receives the arguments
+    of the route and returns the tags known before the data is read, and data_tags receives the
+    serialized data and returns the ones that depend on it. It is placed below jwt_required and above
+    the response decorator of the blueprint.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _cache is None:
+                return function(*args, **kwargs)
+
+            # The response built on a miss is returned as it is, and only cached if it succeeded
+            built = []
+
+            def load():
+                response = function(*args, **kwargs)
+                built.append(response)
+                if response.status_code != 200 or response.is_streamed:
+                    return None
+                return {"body": response.get_data(as_text=True), "status": response.status_code}
+
+            def loaded_tags(value):
+                return data_tags(get_appcontext().get("result_dump"))
+
+            key = f"{request.endpoint}:{get_current_user_id()}:{request.full_path}"
+            try:
+                value, hit = _cache.get_or_load(key, tags(**kwargs), load, loaded_tags if data_tags else None)
+            except (OSError, RuntimeError) as e:
+                # The shared backend is unavailable, so the route is served without the cache
+                current_app.logger.warning("The cache is unavailable: %s", e)
+                return built[0] if built else function(*args, **kwargs)
+
+            if not hit:
+                built[0].headers['X-Cache'] = 'MISS'
+                return built[0]
+            response = Response(value["body"], status=value["status"], mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def init_cache(app):
+    """
+    Creates the response cache of the process with its settings, taken from the app config or the
+    environment. Several server processes only see each other's invalidations with a shared backend.
+    """
+    global _cache
+    load_settings(app, CACHE_DEFAULTS)
+    if app.config["CACHE_ENABLED"]:
+        _cache = ResponseCache(app.config["CACHE_TTL"], app.config["CACHE_MAX_ENTRIES"], app.config["CACHE_URL"])
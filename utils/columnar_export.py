@@ -0,0 +1,39 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.stream_utils import StreamBuffer
+
+# MIME type and file extension of each columnar format
+COLUMNAR_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def record_batch(rows, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Converts a list of row tuples, ordered as the fields of the schema, into a record batch.
+    """
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def stream_record_batches(batches, schema: pa.Schema, format: str):
+    """
+    Yields a Parquet file (one row group per batch) or an Arrow IPC stream chunk by chunk,
+    writing each record batch as soon as it is obtained.
+    """
+    buffer = StreamBuffer()
+    if format == 'parquet':
+        writer = pq.ParquetWriter(buffer, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(buffer, schema)
+
+    with writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,65 @@
+import functools
+import hashlib
+
+from flask import Response, current_app, request
+
+from utils.utils import get_current_user_id, load_settings
+
+# Settings of the conditional requests, which can be given in the environment
+ETAG_DEFAULTS = {
+    "ETAG_ENABLED": True,
+    # The responses are only stored by the browser of the user, which revalidates them before using them
+    "ETAG_CACHE_CONTROL": "private, no-cache",
+}
+
+
+def make_etag(version) -> str:
+    """
+    Returns the ETag of the current request for the version of its resource. The user and the URL are
+    part of it, since the same version is returned differently to each of them (pages, filters), and
+    so is the API version, so that a change of the returned fields changes it as well.
+    """
+    key = repr((current_app.config.get("API_VERSION"), request.endpoint, get_current_user_id(),
+                request.full_path, version))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def conditional_response(version):
+    """
+    Answers the GET requests of a route whose If-None-Match holds the current ETag with a 304 response,
+    before the route loads and serializes its data. version receives the arguments of the route and
+    returns the version stamp of the resource with a single lookup, or None if it is not known (for
+    example, if the resource does not exist), in which case the route answers as usual. It is placed
+    below jwt_required and above the cache and the response decorator of the blueprint.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("ETAG_ENABLED"):
+                return function(*args, **kwargs)
+            stamp = version(**kwargs)
+            if stamp is None:
+                return function(*args, **kwargs)
+
+            # The ETags are weak, since the same data could be serialized with other bytes
+            etag = make_etag(stamp)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = function(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = current_app.config["ETAG_CACHE_CONTROL"]
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def init_conditional_requests(app):
+    """
+    Loads the settings of the conditional requests from the app config or the environment.
+    """
+    load_settings(app, ETAG_DEFAULTS)
@@ -0,0 +1,20 @@
+import os
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+# The environment and the templates are loaded and compiled once, when the worker imports this module
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATES_PATH),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+    cache_size=-1,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+EXAM_TEMPLATE = environment.get_template('exam.html')
+
+
+def render_exam_html(exam, subject_name, sections, answer_key: bool = False) -> str:
+    return EXAM_TEMPLATE.render(exam=exam, subject_name=subject_name, sections=sections, answer_key=answer_key)
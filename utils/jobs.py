@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import wait
+import time
+import uuid
+
+# Directory where the state and the files of the jobs are stored, shared by the server processes, so that
+# any of them can report the progress of a job or send its files (it must be shared by every host as well)
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'questions-api-jobs'))
+
+# Seconds a finished job is kept before it is removed
+JOB_TTL = 3600
+
+# Seconds after which a job that still seems to be running is removed (its process exited without finishing it)
+STALE_JOB_TTL = 24 * 3600
+
+# Seconds a download waits for the next batch before giving up
+JOB_STALL_TIMEOUT = 600
+
+# Seconds between the checks of a download for finished batches
+POLL_INTERVAL = 0.2
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Futures of the jobs started by this process, which are the only ones it can cancel or wait for
+_futures = {}
+_lock = threading.Lock()
+
+
+class JobError(Exception):
+    pass
+
+
+class Job:
+    """
+    Background job made of batches, each of them producing a list of files (for example the reports of
+    some takers). The batches are rendered by the process that started the job, which stores the files of
+    each one in the directory of the job as soon as it finishes. The progress is the number of files of
+    the finished batches.
+    """
+
+    def __init__(self, id: str, owner: int, name: str, created_at: float, sizes: list):
+        self.id = id
+        self.owner = owner
+        self.name = name
+        self.created_at = created_at
+        self.sizes = sizes
+        self.total = sum(sizes)
+
+    def path(self, *names) -> str:
+        return os.path.join(JOBS_DIR, self.id, *names)
+
+    @classmethod
+    def load(cls, job_id: str):
+        """
+        Returns the stored job with the given ID, or None if there is none.
+        """
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(os.path.join(JOBS_DIR, job_id, 'job.json')) as state:
+                return cls(id=job_id, **json.load(state))
+        except (OSError, ValueError):
+            return None
+
+    def batch_state(self, index: int) -> str:
+        if os.path.isdir(self.path(f'batch_{index}')):
+            return 'finished'
+        if os.path.exists(self.path(f'batch_{index}.failed')):
+            return 'failed'
+        return 'running'
+
+    @property
+    def cancelled(self) -> bool:
+        return os.path.exists(self.path('cancelled'))
+
+    @property
+    def completed(self) -> int:
+        return sum(size for index, size in enumerate(self.sizes) if self.batch_state(index) == 'finished')
+
+    @property
+    def status(self) -> str:
+        states = [self.batch_state(index) for index in range(len(self.sizes))]
+        if 'failed' in states:
+            return 'failed'
+        if all(state == 'finished' for state in states):
+            return 'finished'
+        return 'cancelled' if self.cancelled else 'running'
+
+    def progress(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "completed": self.completed,
+            "total": self.total,
+        }
+
+    def error(self) -> str:
+        """
+        Returns the reason why the job did not finish.
+        """
+        for index in range(len(self.sizes)):
+            if self.batch_state(index) == 'failed':
+                with open(self.path(f'batch_{index}.failed')) as failure:
+                    return f"El lote {index + 1} del trabajo ha fallado: {failure.read()}"
+        return "El trabajo ha sido cancelado."
+
+    def cancel(self):
+        """
+        Cancels the batches that have not finished. The ones queued in this process are removed from the
+        pool, and the ones of other processes are discarded when they finish.
+        """
+        with open(self.path('cancelled'), 'w'):
+            pass
+        with _lock:
+            futures = list(_futures.get(self.id, []))
+        for future in futures:
+            future.cancel()
+
+    def files(self):
+        """
+        Yields the (file name, bytes) of each batch as soon as it is stored, whichever process renders it.
+        Raises JobError if a batch fails, the job is cancelled or no batch finishes for a long time.
+        """
+        pending = set(range(len(self.sizes)))
+        progressed = time.monotonic()
+        while pending:
+            for index in sorted(pending):
+                state = self.batch_state(index)
+                if state == 'failed':
+                    raise JobError(self.error())
+                if state == 'finished':
+                    pending.discard(index)
+                    progressed = time.monotonic()
+                    directory = self.path(f'batch_{index}')
+                    for name in sorted(os.listdir(directory)):
+                        with open(os.path.join(directory, name), 'rb') as file:
+                            yield name, file.read()
+            if not pending:
+                break
+            if self.cancelled:
+                raise JobError(self.error())
+            if time.monotonic() - progressed > JOB_STALL_TIMEOUT:
+                raise JobError("El trabajo no ha avanzado y se ha dejado de esperar.")
+            time.sleep(POLL_INTERVAL)
+
+
+def _store_batch(job: Job, index: int, future):
+    # The result is written to the directory of the job, and the future is forgotten so that its files
+    # are not kept in memory
+    with _lock:
+        futures = _futures.get(job.id, [])
+        if future in futures:
+            futures.remove(future)
+        if not futures:
+            _futures.pop(job.id, None)
+    if future.cancelled() or job.cancelled:
+        return
+
+    try:
+        if future.exception() is not None:
+            raise future.exception()
+        directory = job.path(f'batch_{index}.tmp')
+        os.makedirs(directory, exist_ok=True)
+        for name, data in future.result():
+            with open(os.path.join(directory, os.path.basename(name)), 'wb') as file:
+                file.write(data)
+        # The batch appears at once, when all of its files have been written
+        os.replace(directory, job.path(f'batch_{index}'))
+    except Exception as e:
+        with open(job.path(f'batch_{index}.failed'), 'w') as failure:
+            failure.write(str(e))
+
+
+def _prune():
+    if not os.path.isdir(JOBS_DIR):
+        return
+    now = time.time()
+    with _lock:
+        local = set(_futures)
+    for job_id in os.listdir(JOBS_DIR):
+        job = Job.load(job_id)
+        if job is None or job_id in local:
+            continue
+        age = now - job.created_at
+        if age > STALE_JOB_TTL or (age > JOB_TTL and job.status != 'running'):
+            shutil.rmtree(job.path(), ignore_errors=True)
+
+
+def create_job(owner: int, name: str, futures: list, sizes: list) -> Job:
+    _prune()
+    job = Job(uuid.uuid4().hex, owner, name, time.time(), sizes)
+    os.makedirs(job.path())
+    with open(job.path('job.json'), 'w') as state:
+        json.dump({"owner": owner, "name": name, "created_at": job.created_at, "sizes": sizes}, state)
+
+    with _lock:
+        _futures[job.id] = list(futures)
+    for index, future in enumerate(futures):
+        future.add_done_callback(lambda future, index=index: _store_batch(job, index, future))
+    return job
+
+
+def get_job(job_id: str, owner: int) -> Job:
+    """
+    Returns the job with the given ID if it belongs to the owner, or None otherwise.
+    """
+    job = Job.load(job_id)
+    return job if job and job.owner == owner else None
+
+
+def job_statistics() -> tuple:
+    """
+    Returns the number of jobs started by this process that are still rendering, and the number of
+    their batches that are waiting or running.
+    """
+    with _lock:
+        futures = {job_id: list(job_futures) for job_id, job_futures in _futures.items()}
+    statuses = Counter({'running': len(futures)})
+    pending = sum(not future.done() for job_futures in futures.values() for future in job_futures)
+    return statuses, pending
+
+
+def wait_for_jobs(timeout: float) -> int:
+    """
+    Waits until the batches of every job started by this process finish or the timeout expires, and
+    returns the number of batches that are still pending.
+    """
+    with _lock:
+        futures = [future for job_futures in _futures.values() for future in job_futures if not future.done()]
+    wait(futures, timeout=max(timeout, 0))
+    return sum(not future.done() for future in futures)
@@ -0,0 +1,239 @@
+import bisect
+import hmac
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from flask import Response, current_app, g, request
+from flask_smorest import abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.utils import load_settings
+
+METRICS_DEFAULTS = {
+    # Token the scrapers send as "Authorization: Bearer <token>". The metrics are not served without it
+    "METRICS_TOKEN": "",
+}
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'Requests handled, by route and status code.'),
+    'http_request_errors_total': ('counter', 'Requests answered with an error status code, by route.'),
+    'http_request_duration_seconds': ('histogram', 'Time until the response of each route is returned.'),
+    'sql_statements_total': ('counter', 'SQL statements executed, by operation.'),
+    'sql_statement_duration_seconds': ('histogram', 'Duration of the SQL statements, by operation.'),
+    'db_pool_size': ('gauge', 'Connections kept by the pool of each engine.'),
+    'db_pool_checked_out': ('gauge', 'Connections of the pool of each engine that are in use.'),
+    'db_pool_overflow': ('gauge', 'Connections opened by each engine beyond the pool size.'),
+    'export_jobs': ('gauge', 'Background export jobs being rendered by this process, by status.'),
+    'export_job_pending_batches': ('gauge', 'Batches of the background export jobs waiting or running.'),
+    'export_pool_queued_tasks': ('gauge', 'Tasks queued in the export pools of this process.'),
+    'cache_requests_total': ('counter', 'Lookups in the response cache, by result (hit or miss).'),
+}
+
+
+class _Shard:
+    """
+    Metrics recorded by a single thread. Every thread only writes its own shard, so no lock is taken
+    while recording, and the shards are added up when the metrics are read. The shard of a thread that
+    exits is merged into the shard of the exited threads, so the number of shards stays bounded.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def observe(self, name: str, labels: tuple, value: float, buckets: tuple):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            # One count per bucket (the last one is +Inf), then the sum of the values
+            histogram = self.histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def add(self, shard: '_Shard'):
+        for key, value in dict(shard.counters).items():
+            self.counters[key] += value
+        for key, values in dict(shard.histograms).items():
+            total = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(list(values)):
+                total[i] += value
+
+
+class _ShardOwner:
+    # Only referenced by the storage of its thread, so it is released when the thread exits
+    __slots__ = ('__weakref__',)
+
+
+_shards = []
+_shards_lock = threading.Lock()
+_local = threading.local()
+_exited = _Shard()
+
+
+def _retire(shard: _Shard):
+    with _shards_lock:
+        _shards.remove(shard)
+        _exited.add(shard)
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        _local.owner = _ShardOwner()
+        with _shards_lock:
+            _shards.append(shard)
+        weakref.finalize(_local.owner, _retire, shard)
+    return shard
+
+
+def increment(name: str, labels: tuple = (), value: float = 1):
+    _shard().counters[(name, labels)] += value
+
+
+def observe(name: str, labels: tuple, value: float, buckets: tuple):
+    _shard().observe(name, labels, value, buckets)
+
+
+def _collect() -> tuple:
+    """
+    Adds up the counters and histograms of every thread.
+    """
+    total = _Shard()
+    # The lock is held so that the shard of an exiting thread is not added twice or missed
+    with _shards_lock:
+        for shard in [_exited] + _shards:
+            total.add(shard)
+    return total.counters, total.histograms
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _gauges() -> list:
+    """
+    Returns the (name, labels, value) gauges read when the metrics are requested.
+    """
+    from db.versions.db import engines
+    from utils.jobs import job_statistics
+    from utils.workers import pool_statistics
+
+    gauges = []
+    for number, engine in enumerate(engines, 1):
+        pool = engine.pool
+        labels = (('engine', number),)
+        for name, method in (('db_pool_size', 'size'), ('db_pool_checked_out', 'checkedout'),
+                             ('db_pool_overflow', 'overflow')):
+            if hasattr(pool, method):
+                gauges.append((name, labels, max(getattr(pool, method)(), 0)))
+
+    statuses, pending = job_statistics()
+    # The finished jobs are stored for every process, so only the ones rendered by this process are counted
+    gauges.append(('export_jobs', (('status', 'running'),), statuses.get('running', 0)))
+    gauges.append(('export_job_pending_batches', (), pending))
+    for pool, queued in pool_statistics().items():
+        gauges.append(('export_pool_queued_tasks', (('pool', pool),), queued))
+    return gauges
+
+
+def render_metrics() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    counters, histograms = _collect()
+    samples = defaultdict(list)
+    for (name, labels), value in counters.items():
+        samples[name].append((name, labels, value))
+    for (name, labels), values in histograms.items():
+        buckets = REQUEST_BUCKETS if name.startswith('http') else STATEMENT_BUCKETS
+        cumulative = 0
+        for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+            cumulative += count
+            samples[name].append((f"{name}_bucket", labels + (('le', bound),), cumulative))
+        samples[name].append((f"{name}_sum", labels, values[-1]))
+        samples[name].append((f"{name}_count", labels, cumulative))
+    for name, labels, value in _gauges():
+        samples[name].append((name, labels, value))
+
+    lines = []
+    for name, (kind, description) in METRIC_HELP.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples.get(name, []):
+            lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    labels = (('operation', statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'),)
+    increment('sql_statements_total', labels)
+    observe('sql_statement_duration_seconds', labels, duration, STATEMENT_BUCKETS)
+
+
+def _metrics_authorized() -> bool:
+    token = current_app.config["METRICS_TOKEN"]
+    if not token:
+        return False
+    # The token is compared in constant time so that it can not be guessed from the response times
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
+
+
+def init_metrics(app):
+    """
+    Records the requests of every route and the SQL statements, and serves them with the pool and export
+    job gauges in /metrics to the scrapers that send the METRICS_TOKEN setting. The latency of streamed
+    responses is the time until their headers are returned.
+    """
+    load_settings(app, METRICS_DEFAULTS)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('request_start', None)
+        if start is None or request.endpoint == 'metrics':
+            return response
+
+        # The route template is used instead of the path so that the number of series is bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+        increment('http_requests_total', labels + (('status', response.status_code),))
+        if response.status_code >= 400:
+            increment('http_request_errors_total', labels + (('status', response.status_code),))
+        observe('http_request_duration_seconds', labels, time.perf_counter() - start, REQUEST_BUCKETS)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if not _metrics_authorized():
+            abort(403, message="Las métricas solo se sirven con el token de METRICS_TOKEN")
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
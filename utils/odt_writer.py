@@ -0,0 +1,144 @@
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+ODT_MIMETYPE = "application/vnd.oasis.opendocument.text"
+
+NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:meta="urn:oasis:names:tc:opendocument:xmlns:meta:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0"'
+)
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# Styles used by the exam documents: (name, family, text properties, paragraph properties)
+EXAM_STYLES = [
+    ("Heading1", "paragraph", {'fo:font-size': "24pt", 'fo:font-weight': "bold"}, {}),
+    ("Heading2", "paragraph", {'fo:font-size': "18pt", 'fo:font-weight': "bold"}, {}),
+    ("Paragraph", "paragraph", {'fo:font-size': "12pt"}, {}),
+    ("Bold", "text", {'fo:font-weight': "bold"}, {}),
+    ("SmallRightAlign", "paragraph", {'fo:font-size': "10pt"}, {'fo:text-align': "right"}),
+]
+
+
+def _properties(element, properties):
+    if not properties:
+        return ''
+    attributes = ' '.join(f'{name}={quoteattr(value)}' for name, value in properties.items())
+    return f'<style:{element} {attributes}/>'
+
+
+def _compile_styles(styles):
+    elements = ''.join(
+        f'<style:style style:name="{name}" style:family="{family}" style:display-name="{name}">'
+        f'{_properties("text-properties", text_properties)}'
+        f'{_properties("paragraph-properties", paragraph_properties)}'
+        f'</style:style>'
+        for name, family, text_properties, paragraph_properties in styles
+    )
+    return (
+        f'{XML_DECLARATION}<office:document-styles {NAMESPACES} office:version="1.2">'
+        f'<office:styles>{elements}</office:styles><office:automatic-styles></office:automatic-styles>'
+        f'</office:document-styles>'
+    ).encode('utf-8')
+
+
+# The fixed parts of the document are compiled once
+STYLES_XML = _compile_styles(EXAM_STYLES)
+
+META_XML = (
+    f'{XML_DECLARATION}<office:document-meta {NAMESPACES} office:version="1.2">'
+    f'<office:meta><meta:generator>questions-backend</meta:generator></office:meta></office:document-meta>'
+).encode('utf-8')
+
+MANIFEST_XML = (
+    f'{XML_DECLARATION}<manifest:manifest {NAMESPACES}>'
+    f'<manifest:file-entry manifest:full-path="/" manifest:media-type="{ODT_MIMETYPE}"/>'
+    f'<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+    f'<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    f'<manifest:file-entry manifest:full-path="meta.xml" manifest:media-type="text/xml"/>'
+    f'</manifest:manifest>'
+).encode('utf-8')
+
+CONTENT_HEADER = (
+    f'{XML_DECLARATION}<office:document-content {NAMESPACES} office:version="1.2">'
+    f'<office:automatic-styles/><office:body><office:text>'
+).encode('utf-8')
+
+CONTENT_FOOTER = b'</office:text></office:body></office:document-content>'
+
+# Size of the blocks in which content.xml is written to the archive
+FLUSH_SIZE = 64 * 1024
+
+
+class OdtWriter:
+    """
+    Writes an ODT text document straight into its ZIP file. The styles, metadata and manifest are
+    precompiled, and content.xml is streamed into the archive while the document is being written,
+    so no document tree is kept in memory. output_file can be a path or a binary stream.
+    """
+
+    def __init__(self, output_file):
+        self._archive = zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_DEFLATED)
+
+        # The mimetype must be the first entry and must not be compressed
+        self._archive.writestr(zipfile.ZipInfo('mimetype'), ODT_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        self._archive.writestr('styles.xml', STYLES_XML)
+
+        self._content = self._archive.open('content.xml', 'w')
+        self._content.write(CONTENT_HEADER)
+        self._pending = []
+        self._pending_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._archive is not None:
+            # A failed document is not completed, its archive is only released
+            self._content.close()
+            self._archive.close()
+            self._archive = None
+        self.close()
+
+    def _write(self, xml: str):
+        self._pending.append(xml)
+        self._pending_size += len(xml)
+        if self._pending_size >= FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._content.write(''.join(self._pending).encode('utf-8'))
+            self._pending = []
+            self._pending_size = 0
+
+    def paragraph(self, text: str = '', style: str = None, span_style: str = None):
+        style_attribute = f' text:style-name="{style}"' if style else ''
+        if not text:
+            self._write(f'<text:p{style_attribute}/>')
+        elif span_style:
+            self._write(
+                f'<text:p{style_attribute}><text:span text:style-name="{span_style}">'
+                f'{escape(text)}</text:span></text:p>'
+            )
+        else:
+            self._write(f'<text:p{style_attribute}>{escape(text)}</text:p>')
+
+    def heading(self, text: str, level: int, style: str = None):
+        style_attribute = f' text:style-name="{style}"' if style else ''
+        self._write(f'<text:h text:outline-level="{level}"{style_attribute}>{escape(text)}</text:h>')
+
+    def close(self):
+        if self._archive is None:
+            return
+        self._flush()
+        self._content.write(CONTENT_FOOTER)
+        self._content.close()
+        self._archive.writestr('meta.xml', META_XML)
+        self._archive.writestr('META-INF/manifest.xml', MANIFEST_XML)
+        self._archive.close()
+        self._archive = None
@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+
+@lru_cache(maxsize=None)
+def get_pdf_styles() -> dict:
+    """
+    Returns the paragraph styles used in the PDF documents. They are built once per process.
+    """
+    styles = getSampleStyleSheet()
+    return {
+        'normal': styles['Normal'],
+        'heading2': styles['Heading2'],
+        'right_aligned': ParagraphStyle(
+            name='RightAligned',
+            parent=styles['Normal'],
+            alignment=TA_RIGHT
+        ),
+        'bold': ParagraphStyle(
+            name='Bold',
+            parent=styles['Normal'],
+            fontName='Helvetica-Bold'
+        ),
+    }
@@ -0,0 +1,47 @@
+import importlib
+
+from sqlalchemy.orm import configure_mappers
+
+# Modules of the models, which import each other inside their methods (their schemas are imported with them)
+MODEL_MODULES = (
+    'models.answer.answer',
+    'models.exam.exam',
+    'models.node.node',
+    'models.question.question',
+    'models.question_parameter.question_parameter',
+    'models.question_statistics.question_statistics',
+    'models.result.result',
+    'models.result.result_archive',
+    'models.subject.subject',
+    'models.user.user',
+)
+
+# Libraries only needed by the import, export and analysis endpoints, and the modules that use them,
+# which the models import when they are used
+HEAVY_MODULES = (
+    'numpy',
+    'pandas',
+    'pyarrow',
+    'reportlab.platypus',
+    'models.result.grading',
+    'models.result.item_analysis',
+    'models.result.score_report',
+    'utils.columnar_export',
+    'utils.pdf_styles',
+)
+
+
+def preload(api, heavy_modules: bool = False):
+    """
+    Does once, before the workers serve requests, the work they would otherwise do on their first requests:
+    every model is imported, the mappers are configured and the OpenAPI spec is built, which resolves the
+    nested schemas. The heavy libraries are only imported with heavy_modules, for a server that preloads
+    the app before forking its workers, so that they share those pages instead of importing them on demand.
+    """
+    for name in MODEL_MODULES:
+        importlib.import_module(name)
+    configure_mappers()
+    api.spec.to_dict()
+    if heavy_modules:
+        for name in HEAVY_MODULES:
+            importlib.import_module(name)
@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.utils import expose_headers
+
+# Number of identical statements in a request from which they are reported as an N+1 loop
+N_PLUS_ONE_THRESHOLD = 10
+
+# Maximum number of different call sites logged for a repeated statement
+MAX_CALL_SITES = 3
+
+# Number of frames of the application shown for each call site
+CALL_SITE_DEPTH = 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lists of bound parameters, such as the ones of an IN clause, whose length changes between executions
+PARAMETER_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s)\s*,)*\s*(?:\?|%s|%\(\w+\)s)\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Returns the statement with its lists of parameters collapsed and its whitespace normalized, so that
+    the executions of the same query with different values have the same shape.
+    """
+    return ' '.join(PARAMETER_LIST.sub('(?)', statement).split())
+
+
+def call_site(ignored: tuple = ()) -> str:
+    """
+    Returns the innermost frames of the application (not of a library, of this module or of the ignored
+    files) in the stack, from the one that executed the statement to its callers.
+    """
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < CALL_SITE_DEPTH:
+        filename = frame.f_code.co_filename
+        if filename.startswith(ROOT) and 'site-packages' not in filename and filename != __file__ \
+                and filename not in ignored:
+            frames.append(f"{os.path.relpath(filename, ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return ' <- '.join(frames) or "unknown"
+
+
+class QueryProfile:
+    """
+    Statements executed while handling a request, with their total time and the call sites of each shape.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.call_sites = {}
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        sites = self.call_sites.setdefault(shape, [])
+        if len(sites) < MAX_CALL_SITES:
+            site = call_site()
+            if site not in sites:
+                sites.append(site)
+
+    def repeated(self, threshold: int) -> list:
+        """
+        Returns the (shape, count, call sites) of the statements executed at least threshold times.
+        """
+        return [
+            (shape, count, self.call_sites[shape])
+            for shape, count in self.shapes.most_common() if count >= threshold
+        ]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_profile' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if starts and has_request_context() and 'query_profile' in g:
+        g.query_profile.record(statement, time.perf_counter() - starts.pop())
+
+
+def init_query_counter(app):
+    """
+    Counts the statements executed by every request and their total time. In debug mode (or with the
+    QUERY_COUNTER setting) they are returned in the X-Query-Count and X-Query-Time headers, and the
+    statements repeated at least N_PLUS_ONE_THRESHOLD times are logged with their call sites.
+    The statements of streamed responses are executed after the headers are sent, so they are not counted.
+    """
+    app.config.setdefault("QUERY_COUNTER", False)
+    app.config.setdefault("N_PLUS_ONE_THRESHOLD", N_PLUS_ONE_THRESHOLD)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_profile():
+        if app.debug or app.config["QUERY_COUNTER"]:
+            g.query_profile = QueryProfile()
+
+    @app.after_request
+    def add_query_headers(response):
+        profile = g.pop('query_profile', None)
+        if profile is None:
+            return response
+
+        response.headers['X-Query-Count'] = str(profile.count)
+        response.headers['X-Query-Time'] = f"{profile.duration * 1000:.1f}ms"
+        expose_headers(response, 'X-Query-Count', 'X-Query-Time')
+
+        for shape, count, sites in profile.repeated(app.config["N_PLUS_ONE_THRESHOLD"]):
+            app.logger.warning(
+                "Possible N+1 query: %d identical statements in %s %s\n    %s\n    at %s",
+                count, request.method, request.path, shape, '\n    at '.join(sites)
+            )
+        return response
@@ -0,0 +1,133 @@
+import random
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+from utils.utils import replace_parameters
+
+
+GIFT_SPECIAL_CHARACTERS = ['\\', '~', '=', '#', '{', '}', ':']
+
+
+def get_parameter_values(question_parameters, group=None):
+    """
+    Returns the values of the given parameter group (a random one if no group is given),
+    ordered by position. question_parameters is a list of (group, position, value) tuples.
+    """
+    if not question_parameters:
+        return []
+    if group is None:
+        group = random.choice(question_parameters)[0]
+    return [value for param_group, position, value in sorted(question_parameters) if param_group == group]
+
+
+def question_parameter_values(question) -> list:
+    """
+    Returns the parameter values of an exported question (as returned by Question.get_full_question)
+    for its selected group, or for a random group if none was selected, in the order of its parameters.
+    """
+    parameters = question.get('question_parameters', {}).get('items', [])
+    if not parameters:
+        return []
+    group = question.get('group')
+    if group is None:
+        group = random.choice(parameters)['group']
+    return [parameter['value'] for parameter in parameters if parameter['group'] == group]
+
+
+def answer_letter(position: int) -> str:
+    # The answers of a question are lettered from A in order
+    return chr(ord('A') + position)
+
+
+def apply_parameters(text, parameters):
+    # The text is only processed if the question is parametrized
+    return replace_parameters(text, parameters) if parameters else text
+
+
+def escape_gift(text):
+    for character in GIFT_SPECIAL_CHARACTERS:
+        text = text.replace(character, '\\' + character)
+    return text
+
+
+def escape_category(name):
+    # Moodle uses "/" to separate categories, so it has to be doubled inside a category name
+    return name.replace('/', '//')
+
+
+def gift_category(path):
+    return f"$CATEGORY: $course$/{path}\n\n"
+
+
+def gift_question(name, title, type, answers, escape=True):
+    """
+    Returns a question in GIFT format. answers is a list of (body, points) tuples. If escape is False the
+    texts are written as they are (the exam exports keep the GIFT markup written in the questions).
+    """
+    text = escape_gift if escape else str
+    lines = [f"::{text(name)}::{text(title)} {{"]
+    if type == 'test':
+        for body, points in answers:
+            lines.append(f"~%{points}%{text(body)}")
+    lines.append("}\n\n")
+    return '\n'.join(lines)
+
+
+def aiken_question(title, answers):
+    """
+    Returns a question in Aiken format, or None if it can not be represented
+    (Aiken only supports test questions with a correct answer). If several answers have 100 points,
+    the last one is the correct answer.
+    """
+    lines = [title]
+    correct_answer_letter = None
+    for position, (body, points) in enumerate(answers):
+        lines.append(f"{answer_letter(position)}. {body}")
+        if points == 100:
+            correct_answer_letter = answer_letter(position)
+
+    if not correct_answer_letter:
+        return None
+    lines.append(f"ANSWER: {correct_answer_letter}\n\n")
+    return '\n'.join(lines)
+
+
+MOODLEXML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n<quiz>\n'
+MOODLEXML_FOOTER = '</quiz>\n'
+
+
+def moodlexml_category(path):
+    question_element = Element('question', type='category')
+    category = SubElement(question_element, 'category')
+    text = SubElement(category, 'text')
+    text.text = f"$course$/{path}"
+    return tostring(question_element, encoding='unicode') + '\n'
+
+
+def moodlexml_question(name, title, type, answers):
+    """
+    Returns a question in MoodleXML format. answers is a list of (body, points) tuples.
+    """
+    if type == 'test':
+        question_element = Element('question', type='multichoice')
+    else:
+        question_element = Element('question', type='essay')
+
+    name_element = SubElement(question_element, 'name')
+    text = SubElement(name_element, 'text')
+    text.text = name
+
+    question_text = SubElement(question_element, 'questiontext', format='html')
+    text = SubElement(question_text, 'text')
+    text.text = title
+
+    if type == 'test':
+        for body, points in answers:
+            answer_element = SubElement(question_element, 'answer', fraction=str(int(points)))
+            text = SubElement(answer_element, 'text')
+            text.text = body
+    else:
+        answer_element = SubElement(question_element, 'answer', fraction='0')
+        text = SubElement(answer_element, 'text')
+        text.text = ''
+
+    return tostring(question_element, encoding='unicode') + '\n'
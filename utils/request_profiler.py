@@ -0,0 +1,225 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils.utils import load_settings
+
+# Settings of the profiler, which can be given in the environment (the profiler is disabled by default)
+PROFILER_DEFAULTS = {
+    "PROFILER_ENABLED": False,
+    # Fraction of the requests profiled without the X-Profile header
+    "PROFILER_SAMPLE_RATE": 0.0,
+    "PROFILER_DIRECTORY": os.path.join(tempfile.gettempdir(), "questions-api-profiles"),
+    # Limits of the overhead: profiles per minute and seconds profiled in each request
+    "PROFILER_MAX_PER_MINUTE": 6,
+    "PROFILER_MAX_DURATION": 30.0,
+    # Seconds between the stack samples of the flame graphs
+    "PROFILER_SAMPLE_INTERVAL": 0.005,
+    # Limits of the disk use: the oldest profiles are removed above them
+    "PROFILER_MAX_PROFILES": 100,
+    "PROFILER_MAX_BYTES": 200 * 1024 * 1024,
+}
+
+PROFILE_EXTENSIONS = ('.prof', '.collapsed')
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of a thread at regular intervals while it is active, counting the collapsed
+    stacks (frames from the outermost to the innermost, separated by semicolons) of the flame graphs.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.active.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class ProfileSession:
+    """
+    Profile of a single request, which can be activated several times (while the view runs and while
+    each chunk of a streamed response is produced) until the maximum duration is reached.
+    """
+
+    def __init__(self, max_duration: float, sample_interval: float):
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), sample_interval)
+        self.max_duration = max_duration
+        self.start = time.perf_counter()
+        self.truncated = False
+        self.sampler.start()
+
+    @contextmanager
+    def active(self):
+        if time.perf_counter() - self.start > self.max_duration:
+            self.truncated = True
+            yield
+            return
+
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is already running in the process
+            self.truncated = True
+            yield
+            return
+        self.sampler.active.set()
+        try:
+            yield
+        finally:
+            self.sampler.active.clear()
+            self.profile.disable()
+
+    def finish(self) -> float:
+        self.sampler.stop()
+        return time.perf_counter() - self.start
+
+
+def prune_profiles(directory: str, max_profiles: int, max_bytes: int):
+    """
+    Removes the oldest profile files until the directory is within the limits.
+    """
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(PROFILE_EXTENSIONS):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    while files and (len(files) > max_profiles * len(PROFILE_EXTENSIONS) or total > max_bytes):
+        _, size, path = files.pop(0)
+        os.remove(path)
+        total -= size
+
+
+class RequestProfilerMiddleware:
+    """
+    WSGI middleware that profiles the requests with the X-Profile: 1 header or chosen by the sampling
+    rate. At most one request is profiled at a time, and at most PROFILER_MAX_PER_MINUTE per minute;
+    the rest are served without overhead. The profiles are saved as cProfile stats and collapsed stacks,
+    named after the endpoint and the duration, and their ID is returned in the X-Profile-Id header.
+    """
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.lock = threading.Lock()
+        self.recent = deque()
+
+    def should_profile(self, environ) -> bool:
+        config = self.app.config
+        if not config["PROFILER_ENABLED"]:
+            return False
+        if environ.get('HTTP_X_PROFILE') != '1' and random.random() >= config["PROFILER_SAMPLE_RATE"]:
+            return False
+
+        # Only one request is profiled at a time, and only a few of them every minute
+        if not self.lock.acquire(blocking=False):
+            return False
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        if len(self.recent) >= config["PROFILER_MAX_PER_MINUTE"]:
+            self.lock.release()
+            return False
+        self.recent.append(now)
+        return True
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            endpoint = self.app.url_map.bind_to_environ(environ).match()[0]
+        except Exception:
+            endpoint = 'unknown'
+        profile_id = uuid.uuid4().hex[:12]
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-Id', profile_id))
+            return start_response(status, headers, exc_info)
+
+        config = self.app.config
+        session = ProfileSession(config["PROFILER_MAX_DURATION"], config["PROFILER_SAMPLE_INTERVAL"])
+        try:
+            with session.active():
+                response = self.wsgi_app(environ, profiled_start_response)
+        except Exception:
+            self.save(session, profile_id, environ['REQUEST_METHOD'], endpoint)
+            raise
+        return self.profiled_response(response, session, profile_id, environ['REQUEST_METHOD'], endpoint)
+
+    def profiled_response(self, response, session: ProfileSession, profile_id: str, method: str, endpoint: str):
+        # The chunks of streamed responses are produced while they are iterated, so they are profiled too
+        try:
+            iterator = iter(response)
+            while True:
+                with session.active():
+                    chunk = next(iterator, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+            self.save(session, profile_id, method, endpoint)
+
+    def save(self, session: ProfileSession, profile_id: str, method: str, endpoint: str):
+        config = self.app.config
+        try:
+            duration = session.finish()
+            directory = config["PROFILER_DIRECTORY"]
+            os.makedirs(directory, exist_ok=True)
+            tag = re.sub(r'[^\w.-]', '_', f"{method}_{endpoint}")
+            truncated = '_truncated' if session.truncated else ''
+            name = f"{datetime.now():%Y%m%d-%H%M%S}_{tag}_{duration * 1000:.0f}ms{truncated}_{profile_id}"
+
+            session.profile.dump_stats(os.path.join(directory, f"{name}.prof"))
+            with open(os.path.join(directory, f"{name}.collapsed"), 'w') as output:
+                for stack, count in session.sampler.stacks.most_common():
+                    output.write(f"{stack} {count}\n")
+            prune_profiles(directory, config["PROFILER_MAX_PROFILES"], config["PROFILER_MAX_BYTES"])
+        except Exception as e:
+            # A failed profile never affects the request
+            self.app.logger.warning("The profile %s could not be saved: %s", profile_id, e)
+        finally:
+            self.lock.release()
+
+
+def init_request_profiler(app):
+    """
+    Installs the request profiler. Its settings are taken from the app config or, if missing, from
+    the environment variables with the same name.
+    """
+    load_settings(app, PROFILER_DEFAULTS)
+    app.wsgi_app = RequestProfilerMiddleware(app.wsgi_app, app)
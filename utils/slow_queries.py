@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.query_counter import ROOT, call_site, statement_shape
+from utils.utils import load_settings
+
+# Settings of the slow query log, which can be given in the environment
+SLOW_QUERY_DEFAULTS = {
+    "SLOW_QUERY_ENABLED": True,
+    # Seconds from which a statement is logged
+    "SLOW_QUERY_THRESHOLD": 0.2,
+    # EXPLAIN ANALYZE (only in Postgres) runs the statement again, so it is only used for SELECT statements
+    "SLOW_QUERY_EXPLAIN": True,
+    "SLOW_QUERY_EXPLAIN_ANALYZE": False,
+    # Seconds during which the plan of a statement shape is not captured again
+    "SLOW_QUERY_EXPLAIN_INTERVAL": 300.0,
+    "SLOW_QUERY_LOG": os.path.join(tempfile.gettempdir(), "questions-api-slow-queries.log"),
+    "SLOW_QUERY_LOG_BYTES": 10 * 1024 * 1024,
+    "SLOW_QUERY_LOG_BACKUPS": 3,
+    # Comma separated emails of the users that can read the slow query log
+    "ADMIN_EMAILS": "",
+}
+
+# Plans waiting to be captured above which the new slow statements are logged without their plan
+MAX_PENDING_EXPLAINS = 20
+
+# Milliseconds after which a Postgres EXPLAIN ANALYZE is cancelled
+EXPLAIN_TIMEOUT = 30000
+
+MODELS = os.path.join(ROOT, 'models')
+EXPLAINED_OPERATIONS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+logger = logging.getLogger('questions_api.slow_queries')
+logger.propagate = False
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+_local = threading.local()
+_lock = threading.Lock()
+_pending = 0
+_explained = {}
+
+
+def _reset_after_fork():
+    # The thread of the executor belongs to the parent, so a forked child creates its own
+    global _executor, _lock, _pending
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+    _lock = threading.Lock()
+    _pending = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def redact(value):
+    """
+    Returns the parameter with its text replaced by its type and length. Numbers, booleans and nulls
+    (IDs, limits and flags) are kept, since they are needed to reproduce the plan.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    return f"<{type(value).__name__}>"
+
+
+def model_method() -> str:
+    """
+    Returns the innermost method of a model in the stack, which is the one that built the statement.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(MODELS):
+            return getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+def explain(engine, statement: str, parameters, analyze: bool) -> str:
+    """
+    Returns the plan of the statement, obtained in a connection of its own that is rolled back.
+    """
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        query = f"EXPLAIN QUERY PLAN {statement}"
+    elif analyze:
+        query = f"EXPLAIN (ANALYZE, BUFFERS) {statement}"
+    else:
+        query = f"EXPLAIN {statement}"
+
+    _local.explaining = True
+    try:
+        with engine.connect() as connection:
+            if dialect == 'postgresql':
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT}")
+            rows = connection.exec_driver_sql(query, parameters).fetchall()
+            connection.rollback()
+    finally:
+        _local.explaining = False
+
+    if dialect == 'sqlite':
+        # The columns are the ID of the step, the one of its parent, an unused one and its description
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+def _should_explain(shape: str, config) -> bool:
+    global _pending
+    if not config["SLOW_QUERY_EXPLAIN"] or not shape.upper().startswith(EXPLAINED_OPERATIONS):
+        return False
+
+    # Every shape is explained once per interval, and only while the plans are not falling behind
+    now = time.monotonic()
+    with _lock:
+        if _pending >= MAX_PENDING_EXPLAINS:
+            return False
+        if now - _explained.get(shape, -config["SLOW_QUERY_EXPLAIN_INTERVAL"]) < config["SLOW_QUERY_EXPLAIN_INTERVAL"]:
+            return False
+        _explained[shape] = now
+        _pending += 1
+        return True
+
+
+def _write_entry(app, entry: dict, engine=None, statement: str = None, parameters=None):
+    global _pending
+    if engine is not None:
+        analyze = app.config["SLOW_QUERY_EXPLAIN_ANALYZE"] and engine.dialect.name == 'postgresql' \
+            and entry["statement"].upper().startswith('SELECT')
+        try:
+            entry["plan"] = explain(engine, statement, parameters, analyze)
+            entry["analyzed"] = analyze
+        except Exception as e:
+            entry["plan_error"] = str(e)
+        finally:
+            with _lock:
+                _pending -= 1
+    try:
+        logger.info(json.dumps(entry, default=str))
+    except Exception as e:
+        app.logger.warning("The slow query could not be logged: %s", e)
+
+
+def _route():
+    if not has_request_context():
+        return None
+    return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not getattr(_local, 'explaining', False):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+
+def _listener(app):
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts or getattr(_local, 'explaining', False):
+            return
+        duration = time.perf_counter() - starts.pop()
+        config = app.config
+        if not config["SLOW_QUERY_ENABLED"] or duration < config["SLOW_QUERY_THRESHOLD"]:
+            return
+
+        shape = statement_shape(statement)
+        entry = {
+            "time": datetime.now().isoformat(timespec='seconds'),
+            "duration": round(duration, 6),
+            "statement": shape,
+            "parameters": redact(parameters),
+            "method": model_method(),
+            "call_site": call_site((__file__,)),
+            "route": _route(),
+            "plan": None,
+        }
+        # The statements executed with several sets of parameters are logged, but not explained
+        if not executemany and _should_explain(shape, config):
+            copied = dict(parameters) if isinstance(parameters, dict) else tuple(parameters or ())
+            _executor.submit(_write_entry, app, entry, conn.engine, statement, copied)
+        else:
+            _executor.submit(_write_entry, app, entry)
+
+    return after_cursor_execute
+
+
+def top_slow_queries(path: str, backups: int, limit: int) -> list:
+    """
+    Returns the statement shapes of the slow query log (the current file and its backups) with the
+    highest total time, with their last parameters, call sites and plan.
+    """
+    shapes = {}
+    for number in range(backups, -1, -1):
+        name = f"{path}.{number}" if number else path
+        if not os.path.exists(name):
+            continue
+        with open(name) as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                shape = shapes.setdefault(entry["statement"], {
+                    "statement": entry["statement"],
+                    "count": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "methods": [],
+                    "call_sites": [],
+                    "routes": [],
+                    "plan": None,
+                })
+                shape["count"] += 1
+                shape["total_time"] += entry["duration"]
+                shape["max_time"] = max(shape["max_time"], entry["duration"])
+                shape["last_seen"] = entry["time"]
+                shape["parameters"] = entry.get("parameters")
+                for key, value in (("methods", entry.get("method")), ("call_sites", entry.get("call_site")),
+                                   ("routes", entry.get("route"))):
+                    if value and value not in shape[key]:
+                        shape[key].append(value)
+                if entry.get("plan"):
+                    shape["plan"] = entry["plan"]
+
+    top = sorted(shapes.values(), key=lambda shape: shape["total_time"], reverse=True)[:limit]
+    for shape in top:
+        shape["mean_time"] = shape["total_time"] / shape["count"]
+    return top
+
+
+def init_slow_query_log(app):
+    """
+    Logs the statements slower than SLOW_QUERY_THRESHOLD seconds, with their redacted parameters, the model
+    method that executed them and their plan, to a rotating file of JSON lines. The plans are captured and
+    the entries are written by a background thread, so the requests only pay for measuring the statements.
+    The log can be shared by several processes, although a few entries may be lost while it is rotated.
+    """
+    load_settings(app, SLOW_QUERY_DEFAULTS)
+    if not logger.handlers:
+        directory = os.path.dirname(app.config["SLOW_QUERY_LOG"])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(
+            app.config["SLOW_QUERY_LOG"],
+            maxBytes=app.config["SLOW_QUERY_LOG_BYTES"],
+            backupCount=app.config["SLOW_QUERY_LOG_BACKUPS"],
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _listener(app))
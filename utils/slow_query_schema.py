@@ -0,0 +1,23 @@
+from marshmallow import Schema, fields, validate
+
+
+class SlowQueryArgsSchema(Schema):
+    limit = fields.Integer(load_default=20, validate=validate.Range(min=1, max=500))
+
+
+class SlowQuerySchema(Schema):
+    statement = fields.String()
+    count = fields.Integer()
+    total_time = fields.Float()
+    mean_time = fields.Float()
+    max_time = fields.Float()
+    last_seen = fields.String()
+    parameters = fields.Raw(allow_none=True)
+    methods = fields.List(fields.String())
+    call_sites = fields.List(fields.String())
+    routes = fields.List(fields.String())
+    plan = fields.String(allow_none=True)
+
+
+class SlowQueryListSchema(Schema):
+    items = fields.List(fields.Nested(SlowQuerySchema))
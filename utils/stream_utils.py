@@ -0,0 +1,38 @@
+import io
+import zipfile
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable stream whose content is taken out in chunks as it is written,
+    so that files generated on the fly can be sent in a streamed response.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(parts):
+    """
+    Yields a ZIP archive chunk by chunk. parts is an iterable of (file name, bytes) tuples,
+    and each part is written to the archive as soon as it is obtained.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts:
+            archive.writestr(name, data)
+            yield buffer.drain()
+    yield buffer.drain()
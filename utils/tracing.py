@@ -0,0 +1,363 @@
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.query_counter import statement_shape
+from utils.utils import load_settings
+
+# Settings of the tracing, which can be given in the environment (it is disabled by default)
+TRACING_DEFAULTS = {
+    "TRACING_ENABLED": False,
+    # Fraction of the requests traced, unless the caller sends a sampled traceparent header
+    "TRACING_SAMPLE_RATE": 1.0,
+    "TRACING_SERVICE_NAME": "questions-api",
+    # File where the spans are appended, one OTLP/JSON export request per line
+    "TRACING_FILE": os.path.join(tempfile.gettempdir(), "questions-api-traces.jsonl"),
+    # OTLP/HTTP collector the spans are sent to as well, such as http://localhost:4318/v1/traces
+    "TRACING_ENDPOINT": "",
+    # Seconds between exports, and maximum number of spans waiting to be exported
+    "TRACING_EXPORT_INTERVAL": 2.0,
+    "TRACING_MAX_QUEUE": 20000,
+}
+
+# Kinds of span of OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# Status codes of OTLP
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Number of spans exported in each OTLP request
+EXPORT_BATCH_SIZE = 1000
+
+# Characters of the statements kept in the SQL spans
+MAX_STATEMENT_LENGTH = 2000
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    Operation of a trace, with the IDs, times and attributes of the OTLP format.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.time_ns()
+        self.end = None
+        self.status = None
+        self.message = None
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None) -> 'Span':
+        return Span(name, self.trace_id, self.span_id, kind, attributes)
+
+    def fail(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.message = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        self.end = time.time_ns()
+        _exporter.add(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status:
+            span["status"] = {"code": self.status, "message": self.message or ""}
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # The 64 bit integers are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanExporter(threading.Thread):
+    """
+    Exports the finished spans from a background thread, every TRACING_EXPORT_INTERVAL seconds, to the
+    traces file and to the collector. The spans that do not fit in the queue are dropped.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True, name='span-exporter')
+        self.spans = queue.Queue()
+        self.config = {}
+        self.dropped = 0
+
+    def configure(self, config: dict):
+        self.config = config
+        self.spans = queue.Queue(maxsize=self.config["TRACING_MAX_QUEUE"])
+        if not self.is_alive():
+            self.start()
+
+    def add(self, span: Span):
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            time.sleep(self.config["TRACING_EXPORT_INTERVAL"])
+            self.flush()
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self.spans.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(spans), EXPORT_BATCH_SIZE):
+            self.export(spans[start:start + EXPORT_BATCH_SIZE])
+
+    def export(self, spans: list):
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.config["TRACING_SERVICE_NAME"]}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [span.to_otlp() for span in spans],
+            }],
+        }]})
+        try:
+            if self.config["TRACING_FILE"]:
+                with open(self.config["TRACING_FILE"], 'a') as traces:
+                    traces.write(payload + '\n')
+            if self.config["TRACING_ENDPOINT"]:
+                export_request = urllib.request.Request(
+                    self.config["TRACING_ENDPOINT"], data=payload.encode('utf-8'),
+                    headers={"Content-Type": "application/json"}, method='POST'
+                )
+                urllib.request.urlopen(export_request, timeout=5).close()
+        except Exception:
+            # The traces never affect the requests, so the failed exports are dropped
+            self.dropped += len(spans)
+
+
+_exporter = SpanExporter()
+
+
+def _reset_after_fork():
+    # The thread of the exporter belongs to the parent, so a forked child starts its own
+    global _exporter
+    config = _exporter.config
+    _exporter = SpanExporter()
+    if config:
+        _exporter.configure(config)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def flush_spans():
+    """
+    Exports the spans waiting in the queue, before the process exits.
+    """
+    if _exporter.config:
+        _exporter.flush()
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None):
+    """
+    Traces the block as a child of the current span. Nothing is traced outside a sampled request.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = parent.child(name, kind, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.fail(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+def traced(function, name: str = None):
+    """
+    Returns the function traced in a span named after its qualified name.
+    """
+    name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return function(*args, **kwargs)
+        attributes = {"code.function": function.__qualname__, "code.namespace": function.__module__}
+        with span(name, attributes=attributes):
+            return function(*args, **kwargs)
+
+    wrapper.traced = True
+    return wrapper
+
+
+def instrument_models():
+    """
+    Traces the static methods of every model. The generators are left as they are, since their work
+    is done while they are iterated and not when they are called.
+    """
+    from db.versions.db import Base
+
+    for mapper in Base.registry.mappers:
+        model = mapper.class_
+        for attribute, value in list(vars(model).items()):
+            if isinstance(value, staticmethod) and not inspect.isgeneratorfunction(value.__func__) \
+                    and not getattr(value.__func__, 'traced', False):
+                setattr(model, attribute, staticmethod(traced(value.__func__)))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+    conn.info.setdefault('trace_spans', []).append(parent.child(operation, SPAN_KIND_CLIENT, {
+        "db.system": conn.engine.dialect.name,
+        "db.operation": operation,
+        "db.statement": statement_shape(statement)[:MAX_STATEMENT_LENGTH],
+        "db.executemany": bool(executemany),
+    }))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    if spans and _current_span.get() is not None:
+        statement_span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            statement_span.attributes["db.rows"] = cursor.rowcount
+        statement_span.finish()
+
+
+def _handle_error(exception_context):
+    spans = exception_context.connection.info.get('trace_spans') if exception_context.connection else None
+    if spans and _current_span.get() is not None:
+        statement_span = spans.pop()
+        statement_span.fail(exception_context.original_exception)
+        statement_span.finish()
+
+
+def _parent_from_headers(sample_rate: float) -> tuple:
+    """
+    Returns the trace ID and parent span ID of the W3C traceparent header, or new ones if the request
+    is chosen by the sampling rate. The trace ID is None when the request is not traced.
+    """
+    match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        return (trace_id, parent_id) if int(flags, 16) & 1 else (None, None)
+    if random.random() < sample_rate:
+        return secrets.token_hex(16), None
+    return None, None
+
+
+def init_tracing(app):
+    """
+    Traces the requests, their view functions, the static methods of the models and the SQL statements,
+    with spans propagated through a context variable and exported in the OTLP/JSON format to
+    TRACING_FILE and, if set, to the TRACING_ENDPOINT collector. The view functions have to be
+    registered before it is called. The ID of the trace is returned in the traceparent header.
+    """
+    load_settings(app, TRACING_DEFAULTS)
+    if not app.config["TRACING_ENABLED"]:
+        return
+
+    _exporter.configure({key: app.config[key] for key in TRACING_DEFAULTS})
+    instrument_models()
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint != 'static':
+            app.view_functions[endpoint] = traced(view, f"view {endpoint}")
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_trace():
+        trace_id, parent_id = _parent_from_headers(app.config["TRACING_SAMPLE_RATE"])
+        if trace_id is None:
+            return
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        root = Span(f"{request.method} {route}", trace_id, parent_id, SPAN_KIND_SERVER, {
+            "http.request.method": request.method,
+            "http.route": route,
+            "url.path": request.path,
+        })
+        g.trace_span = root
+        g.trace_token = _current_span.set(root)
+
+    @app.after_request
+    def add_trace_header(response):
+        root = g.get('trace_span')
+        if root is not None:
+            root.attributes["http.response.status_code"] = response.status_code
+            if response.status_code >= 500:
+                root.status = STATUS_ERROR
+            response.headers['traceparent'] = f"00-{root.trace_id}-{root.span_id}-01"
+        return response
+
+    @app.teardown_request
+    def finish_trace(error):
+        # The request context is torn down once the streamed responses are consumed, so they are included
+        root = g.pop('trace_span', None)
+        if root is None:
+            return
+        if error is not None:
+            root.fail(error)
+        try:
+            _current_span.reset(g.pop('trace_token'))
+        except ValueError:
+            # The response was streamed from another context
+            _current_span.set(None)
+        root.finish()
@@ -1,4 +1,5 @@
 from flask_jwt_extended import get_jwt_identity
+import os
 import re
 
 def get_current_user_id():
@@ -6,8 +7,30 @@ def get_current_user_id():
     current_user_id = get_jwt_identity()
     return current_user_id
 
+def get_academic_year(date) -> int:
+    # Academic years start in September and are identified by the year they start in
+    return date.year if date.month >= 9 else date.year - 1
+
 def replace_parameters(text, parameters):
     for i, param in enumerate(parameters, 1):
         placeholder = f"##param{i}##"
         text = re.sub(placeholder, param, text)
     return text
+
+def load_settings(app, defaults: dict):
+    # Settings missing from the app config are taken from the environment variables with the same name
+    for key, default in defaults.items():
+        value = os.environ.get(key)
+        if value is None:
+            app.config.setdefault(key, default)
+        elif isinstance(default, bool):
+            app.config.setdefault(key, value.lower() in ('1', 'true', 'yes'))
+        else:
+            app.config.setdefault(key, type(default)(value))
+
+def expose_headers(response, *names):
+    # The names are added to the headers already exposed to the browser instead of replacing them
+    exposed = [name.strip() for name in response.headers.get('Access-Control-Expose-Headers', '').split(',')]
+    exposed = [name for name in exposed if name]
+    exposed += [name for name in names if name not in exposed]
+    response.headers['Access-Control-Expose-Headers'] = ', '.join(exposed)
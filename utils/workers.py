@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Pools shared by the export endpoints, created the first time they are needed in each worker
+_process_pool = None
+_thread_pool = None
+_lock = threading.Lock()
+
+
+def get_process_pool_size() -> int:
+    return int(os.environ.get('EXPORT_PROCESSES', os.cpu_count() or 1))
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the pool used for CPU-bound work (PDF and ODT rendering).
+    """
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=get_process_pool_size(),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Returns the pool used for light work (text formats).
+    """
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=int(os.environ.get('EXPORT_THREADS', 4)),
+                thread_name_prefix='export'
+            )
+        return _thread_pool
+
+
+def pool_statistics() -> dict:
+    """
+    Returns the number of tasks queued in each pool (in the process pool, the running ones as well).
+    The pools that have not been created in this worker are not included.
+    """
+    statistics = {}
+    if _process_pool is not None:
+        statistics['process'] = len(getattr(_process_pool, '_pending_work_items', {}))
+    if _thread_pool is not None:
+        statistics['thread'] = _thread_pool._work_queue.qsize()
+    return statistics
+
+
+def shutdown_pools(wait: bool = True):
+    """
+    Shuts the pools down, waiting for their tasks unless wait is False, in which case the queued tasks
+    are cancelled.
+    """
+    global _process_pool, _thread_pool
+    with _lock:
+        pools = [pool for pool in (_process_pool, _thread_pool) if pool is not None]
+        _process_pool = _thread_pool = None
+    for pool in pools:
+        pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _reset_after_fork():
+    # The threads and processes of the pools belong to the parent, so a forked child creates its own
+    global _process_pool, _thread_pool, _lock
+    _process_pool = _thread_pool = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,7 @@
+"""
+Production entry point, served by gunicorn with the settings of gunicorn.conf.py:
+
+    flask --app app init-db
+    gunicorn wsgi:app
+"""
+from app import app